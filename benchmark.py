@@ -0,0 +1,308 @@
+"""Load generator and latency benchmark for the banking API servers.
+
+Drives /register, /login, /protected and /accounts/* against a running server
+with a configurable concurrency and operation mix, then reports throughput,
+latency percentiles and error rates per operation.
+
+    python benchmark.py --url http://127.0.0.1:5000 --concurrency 32 --duration 30 \\
+        --mix my-account=10,deposit=5,withdraw=3,transfer=3,protected=5,login=1 \\
+        --output results/fastapi.json
+
+    python benchmark.py --compare results/before.json results/after.json
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+DEFAULT_MIX = "my-account=10,deposit=5,withdraw=3,transfer=3,protected=5,login=1"
+OPERATIONS = ("register", "login", "protected", "my-account", "deposit", "withdraw", "transfer")
+
+
+class BenchUser:
+    def __init__(self, username: str, password: str):
+        self.username = username
+        self.password = password
+        self.token: Optional[str] = None
+        self.account_number: Optional[str] = None
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {op: [] for op in OPERATIONS}
+        self.statuses: Dict[str, Dict[str, int]] = {op: {} for op in OPERATIONS}
+
+    def record(self, op: str, seconds: float, status: str) -> None:
+        self.latencies[op].append(seconds)
+        self.statuses[op][status] = self.statuses[op].get(status, 0) + 1
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise SystemExit(f"Unknown operation in mix: {name} (choose from {', '.join(OPERATIONS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(pct / 100 * len(sorted_values))
+    return sorted_values[max(0, min(len(sorted_values), rank) - 1)]
+
+
+def extract_token(data: Dict[str, Any]) -> Optional[str]:
+    token = data.get("data") or data.get("token")
+    return token if isinstance(token, str) else None
+
+
+def extract_account_number(data: Dict[str, Any]) -> Optional[str]:
+    for key in ("data", "account"):
+        nested = data.get(key)
+        if isinstance(nested, dict) and "account_number" in nested:
+            return nested["account_number"]
+    return data.get("account_number")
+
+
+class Benchmark:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.mix = parse_mix(args.mix)
+        self.recorder = Recorder()
+        self.users: List[BenchUser] = []
+        self.bearer = True
+        self.rng = random.Random(args.seed)
+        self.remaining: Optional[int] = None
+
+    def headers(self, user: BenchUser) -> Dict[str, str]:
+        if user.token is None:
+            return {}
+        return {"Authorization": f"Bearer {user.token}" if self.bearer else user.token}
+
+    async def timed(self, client: httpx.AsyncClient, op: str, method: str, path: str, **kwargs) -> Optional[httpx.Response]:
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, path, **kwargs)
+        except httpx.HTTPError as e:
+            self.recorder.record(op, time.perf_counter() - started, type(e).__name__)
+            return None
+        self.recorder.record(op, time.perf_counter() - started, str(response.status_code))
+        return response
+
+    async def login(self, client: httpx.AsyncClient, user: BenchUser, op: str = "login") -> None:
+        response = await self.timed(client, op, "POST", "/login",
+                                    json={"username": user.username, "password": user.password})
+        if response is not None and response.status_code in (200, 201):
+            user.token = extract_token(response.json()) or user.token
+
+    async def setup(self, client: httpx.AsyncClient) -> None:
+        prefix = self.args.user_prefix or f"bench-{uuid.uuid4().hex[:8]}"
+        self.users = [BenchUser(f"{prefix}-{i}", "bench-password") for i in range(self.args.users)]
+
+        async def prepare(user: BenchUser) -> None:
+            await client.post("/register", json={"username": user.username, "password": user.password})
+            response = await client.post("/login", json={"username": user.username, "password": user.password})
+            response.raise_for_status()
+            user.token = extract_token(response.json())
+
+        await asyncio.gather(*(prepare(user) for user in self.users))
+
+        # Flask expects the raw token, the other backends a Bearer token
+        probe = await client.get("/protected", headers=self.headers(self.users[0]))
+        if probe.status_code not in (200, 201):
+            self.bearer = False
+
+        async def open_account(user: BenchUser) -> None:
+            response = await client.post("/accounts/create", headers=self.headers(user),
+                                         json={"initial_balance": self.args.initial_balance})
+            if response.status_code in (200, 201):
+                user.account_number = extract_account_number(response.json())
+            if user.account_number is None:
+                response = await client.get("/accounts/my-account", headers=self.headers(user))
+                if response.status_code in (200, 201):
+                    user.account_number = extract_account_number(response.json())
+
+        await asyncio.gather(*(open_account(user) for user in self.users))
+
+    async def run_operation(self, client: httpx.AsyncClient, op: str) -> None:
+        user = self.rng.choice(self.users)
+        amount = round(self.rng.uniform(1, self.args.max_amount), 2)
+        if op == "register":
+            username = f"{user.username}-r{uuid.uuid4().hex[:10]}"
+            await self.timed(client, op, "POST", "/register", json={"username": username, "password": "bench-password"})
+        elif op == "login":
+            await self.login(client, user)
+        elif op == "protected":
+            await self.timed(client, op, "GET", "/protected", headers=self.headers(user))
+        elif op == "my-account":
+            await self.timed(client, op, "GET", "/accounts/my-account", headers=self.headers(user))
+        elif op in ("deposit", "withdraw"):
+            await self.timed(client, op, "POST", f"/accounts/{op}", headers=self.headers(user), json={"amount": amount})
+        elif op == "transfer":
+            recipient = self.rng.choice(self.users)
+            await self.timed(client, op, "POST", "/accounts/transfer", headers=self.headers(user),
+                             json={"to_account_number": recipient.account_number or "", "amount": amount})
+
+    async def worker(self, client: httpx.AsyncClient, deadline: float) -> None:
+        ops = list(self.mix)
+        weights = [self.mix[op] for op in ops]
+        while time.perf_counter() < deadline:
+            if self.remaining is not None:
+                if self.remaining <= 0:
+                    return
+                self.remaining -= 1
+            await self.run_operation(client, self.rng.choices(ops, weights)[0])
+
+    async def run(self) -> Dict[str, Any]:
+        limits = httpx.Limits(max_connections=self.args.concurrency, max_keepalive_connections=self.args.concurrency)
+        timeout = httpx.Timeout(self.args.timeout)
+        async with httpx.AsyncClient(base_url=self.args.url, limits=limits, timeout=timeout) as client:
+            await self.setup(client)
+            self.recorder = Recorder()
+            self.remaining = self.args.requests or None
+            started = time.perf_counter()
+            deadline = started + self.args.duration if self.args.duration else float("inf")
+            await asyncio.gather(*(self.worker(client, deadline) for _ in range(self.args.concurrency)))
+            elapsed = time.perf_counter() - started
+        return self.report(elapsed)
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        operations = {}
+        total = errors = 0
+        for op in OPERATIONS:
+            latencies = sorted(self.recorder.latencies[op])
+            if not latencies:
+                continue
+            statuses = self.recorder.statuses[op]
+            failed = sum(count for status, count in statuses.items() if not status.startswith("2"))
+            total += len(latencies)
+            errors += failed
+            operations[op] = {
+                "requests": len(latencies),
+                "throughput": len(latencies) / elapsed,
+                "error_rate": failed / len(latencies),
+                "statuses": statuses,
+                "latency_ms": {
+                    "mean": sum(latencies) / len(latencies) * 1000,
+                    "p50": percentile(latencies, 50) * 1000,
+                    "p95": percentile(latencies, 95) * 1000,
+                    "p99": percentile(latencies, 99) * 1000,
+                    "max": latencies[-1] * 1000
+                }
+            }
+        all_latencies = sorted(l for op in OPERATIONS for l in self.recorder.latencies[op])
+        return {
+            "started_at": datetime.datetime.utcnow().isoformat(),
+            "commit": git_commit(),
+            "config": {
+                "url": self.args.url,
+                "concurrency": self.args.concurrency,
+                "duration": self.args.duration,
+                "requests": self.args.requests,
+                "users": self.args.users,
+                "mix": self.mix,
+                "token_format": "bearer" if self.bearer else "direct"
+            },
+            "elapsed_seconds": elapsed,
+            "total": {
+                "requests": total,
+                "throughput": total / elapsed if elapsed else 0.0,
+                "error_rate": errors / total if total else 0.0,
+                "latency_ms": {
+                    "p50": percentile(all_latencies, 50) * 1000,
+                    "p95": percentile(all_latencies, 95) * 1000,
+                    "p99": percentile(all_latencies, 99) * 1000,
+                    "max": all_latencies[-1] * 1000 if all_latencies else 0.0
+                }
+            },
+            "operations": operations
+        }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(result: Dict[str, Any]) -> None:
+    print(f"{'operation':<12} {'reqs':>8} {'req/s':>9} {'err%':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}  (ms)")
+    rows = list(result["operations"].items()) + [("TOTAL", result["total"])]
+    for name, stats in rows:
+        latency = stats["latency_ms"]
+        print(f"{name:<12} {stats['requests']:>8} {stats['throughput']:>9.1f} {stats['error_rate'] * 100:>6.1f} "
+              f"{latency['p50']:>8.2f} {latency['p95']:>8.2f} {latency['p99']:>8.2f} {latency['max']:>8.2f}")
+
+
+def compare(before_path: str, after_path: str) -> None:
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+    print(f"{before_path} ({before.get('commit')}) -> {after_path} ({after.get('commit')})")
+    print(f"{'operation':<12} {'req/s':>18} {'p50 ms':>18} {'p99 ms':>18}")
+    names = [name for name in after["operations"] if name in before["operations"]]
+    rows = [(name, before["operations"][name], after["operations"][name]) for name in names]
+    rows.append(("TOTAL", before["total"], after["total"]))
+    for name, old, new in rows:
+        cells = []
+        for old_value, new_value in ((old["throughput"], new["throughput"]),
+                                     (old["latency_ms"]["p50"], new["latency_ms"]["p50"]),
+                                     (old["latency_ms"]["p99"], new["latency_ms"]["p99"])):
+            change = (new_value - old_value) / old_value * 100 if old_value else 0.0
+            cells.append(f"{new_value:>9.2f} ({change:+6.1f}%)")
+        print(f"{name:<12} " + " ".join(cells))
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark a running banking API server")
+    parser.add_argument("--url", default="http://127.0.0.1:5000", help="server base URL")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent client workers")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to run (0 for no limit)")
+    parser.add_argument("--requests", type=int, default=0, help="stop after this many requests (0 for no limit)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="weighted operation mix, e.g. deposit=5,login=1")
+    parser.add_argument("--users", type=int, default=20, help="benchmark users to register before the run")
+    parser.add_argument("--user-prefix", help="username prefix, to reuse users across runs")
+    parser.add_argument("--initial-balance", type=float, default=100000.0)
+    parser.add_argument("--max-amount", type=float, default=50.0)
+    parser.add_argument("--timeout", type=float, default=30.0, help="per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, help="random seed for the operation mix")
+    parser.add_argument("--output", help="write the JSON results to this file")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two result files")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if not args.duration and not args.requests:
+        parser.error("set --duration or --requests")
+
+    result = asyncio.run(Benchmark(args).run())
+    print_report(result)
+    if args.output:
+        directory = os.path.dirname(args.output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Results written to {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Bulk NDJSON import and export for the Python backends' storage.
+
+Reads and writes the same files as the servers, from the current directory,
+so with the JSON backend stop the server first (SQLite can stay online).
+
+    python bulk.py export --output dump.ndjson
+    python bulk.py import dump.ndjson --chunk-size 5000
+    STORAGE_BACKEND=sqlite python bulk.py import - < dump.ndjson
+
+See shared/bulk.py for the record format. The summary, including records
+per second, is printed to stderr.
+"""
+import argparse
+import os
+import sys
+from typing import List, Optional
+
+from shared.allocator import AccountNumberAllocator
+from shared.bulk import BulkExporter, BulkImporter, describe, read_lines
+from shared.config import env_bool, env_int, env_str
+from shared.passwords import PasswordPool
+from shared.storage import open_storage
+
+READ_SIZE = 1 << 16
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Bulk NDJSON import/export of users and accounts")
+    parser.add_argument("action", choices=("import", "export"))
+    parser.add_argument("path", nargs="?", default="-", help="NDJSON file to import, - for stdin")
+    parser.add_argument("--output", default="-", help="file to export to, - for stdout")
+    parser.add_argument("--backend", default=env_str("STORAGE_BACKEND", "json"), choices=("json", "sqlite"))
+    parser.add_argument("--sqlite-path", default=env_str("SQLITE_PATH", "bank.db"))
+    parser.add_argument("--chunk-size", type=int, default=1000, help="records committed per write")
+    parser.add_argument("--bcrypt-rounds", type=int, default=env_int("BCRYPT_ROUNDS", 12),
+                        help="cost for records that carry a plain password")
+    args = parser.parse_args(argv)
+
+    storage = open_storage(
+        args.backend,
+        users_file="users.json",
+        accounts_file="accounts.json",
+        journal_file="accounts.journal",
+        history_file="accounts.history",
+        sqlite_path=args.sqlite_path,
+        fsync=env_bool("JOURNAL_FSYNC", True),
+        shards=env_int("ACCOUNT_SHARDS", 1),
+        snapshot_format=env_str("ACCOUNTS_FORMAT", "json")
+    )
+    try:
+        if args.action == "export":
+            exporter = BulkExporter(storage)
+            out = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+            try:
+                out.writelines(exporter.lines())
+            finally:
+                if out is not sys.stdout.buffer:
+                    out.close()
+            print(describe("Exported", exporter.report()), file=sys.stderr)
+        else:
+            allocator = AccountNumberAllocator(lambda number: storage.get_account(number) is not None)
+            # Room for a whole chunk of plain passwords at once
+            passwords = PasswordPool(os.cpu_count() or 2, args.chunk_size, rounds=args.bcrypt_rounds)
+            importer = BulkImporter(storage, allocator, passwords, chunk_size=args.chunk_size)
+            source = sys.stdin.buffer if args.path == "-" else open(args.path, "rb")
+            try:
+                report = importer.run(read_lines(iter(lambda: source.read(READ_SIZE), b"")))
+            finally:
+                if source is not sys.stdin.buffer:
+                    source.close()
+                passwords.shutdown()
+            print(describe("Imported", report), file=sys.stderr)
+            for sample in report["error_samples"]:
+                print("  " + sample, file=sys.stderr)
+    finally:
+        storage.close()
+
+
+if __name__ == "__main__":
+    main()
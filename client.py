@@ -1,12 +1,23 @@
 import tkinter as tk
-from tkinter import messagebox, ttk
-import requests
+from tkinter import messagebox
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import json
+import sys
+import threading
+import time
+import uuid
+import httpx
 
 BACKEND_URL = "http://127.0.0.1:5000"
+REQUEST_TIMEOUT = 10.0
+NETWORK_WORKERS = 4
+POLL_INTERVAL_MS = 20
 
-token = None
+client = None
+network = None
 current_account = None
-server_token_format = None
+window = None
 
 def get_error_message(response):
     """Extract error message from either FastAPI, Flask, or Java Spring Boot response"""
@@ -25,87 +36,201 @@ def get_error_message(response):
     except:
         return "Unknown error occurred"
 
-def detect_server_token_format():
-    """Detect what token format the server expects by testing both formats"""
-    global server_token_format
-    
-    if not token:
-        return
-    
-    headers_bearer = {"Authorization": f"Bearer {token}"}
-    response_bearer = requests.get(f"{BACKEND_URL}/protected", headers=headers_bearer)
-    
-    if response_bearer.status_code in [200, 201]:
-        server_token_format = "bearer"
-        return
-    
-    headers_direct = {"Authorization": token}
-    response_direct = requests.get(f"{BACKEND_URL}/protected", headers=headers_direct)
-    
-    if response_direct.status_code in [200, 201]:
-        server_token_format = "direct"
-        return
-    
-    server_token_format = "bearer"
-
-def get_headers():
-    """Get headers with authentication token - auto-detects server format"""
-    if not token:
-        return {}
-    
-    if server_token_format is None:
-        return {"Authorization": f"Bearer {token}"}
-    
-    if server_token_format == "bearer":
-        return {"Authorization": f"Bearer {token}"}
-    else:
-        return {"Authorization": token}
+def extract_token(data):
+    """Pull the JWT out of a login response from any backend"""
+    if data.get("success"):
+        return data.get("data") or data.get("token")
+    return data.get("token")
+
+def extract_account(data):
+    """Pull the account out of a create or my-account response from any backend"""
+    if "success" in data and data["success"] and "data" in data:
+        return data["data"]
+    elif "account" in data:
+        return data["account"]
+    return data
+
+def extract_new_balance(data, default=None):
+    """Pull the new balance out of a deposit, withdraw or transfer response"""
+    if "data" in data:
+        return data["data"]["new_balance"]
+    return data.get("new_balance", default)
+
+class BankClient:
+    """Keep-alive HTTP session to one backend.
+
+    Backends differ in whether they expect "Bearer <token>" or the bare token
+    in the Authorization header. Rather than probing /protected at login, the
+    first authenticated request goes out as Bearer and is retried once with
+    the bare token if it is rejected; the format that worked is remembered.
+    A rejected request was never applied, so the retry is safe for POSTs too.
+
+    When the backend hands out a refresh token at login, an expired access
+    token is swapped for a new one through /token/refresh and the request
+    is retried, instead of logging in (and paying for bcrypt) again.
+
+    A request sent with an idempotency_key carries it as the Idempotency-Key
+    header and is retried once, with the same key, if it times out or the
+    connection drops; the server answers the retry from its cache if the
+    first attempt went through, so the operation is applied at most once.
+    """
+
+    def __init__(self, base_url, timeout=REQUEST_TIMEOUT, http=None, token_format=None):
+        self.http = http or httpx.Client(base_url=base_url, timeout=timeout)
+        self.token = None
+        self.refresh_token = None
+        self.token_format = token_format
+        self._refresh_lock = threading.Lock()
+
+    def _headers(self, token_format, idempotency_key=None):
+        headers = {"Idempotency-Key": idempotency_key} if idempotency_key else {}
+        if not self.token:
+            return headers
+        if token_format == "direct":
+            headers["Authorization"] = self.token
+        else:
+            headers["Authorization"] = f"Bearer {self.token}"
+        return headers
+
+    def request(self, method, path, json=None, idempotency_key=None):
+        token = self.token
+        response = self._send(method, path, json, idempotency_key)
+        if response.status_code == 401 and self.refresh_token and self.refresh(token):
+            response = self._send(method, path, json, idempotency_key)
+        return response
+
+    def refresh(self, expired_token):
+        """Trade the refresh token for a new access token; False if that is not possible.
+
+        Concurrent requests that all saw expired_token rejected share one
+        refresh, since each refresh token can be used only once.
+        """
+        with self._refresh_lock:
+            if self.token != expired_token:
+                return True
+            response = self.http.post("/token/refresh", json={"refresh_token": self.refresh_token})
+            if response.status_code != 200:
+                self.refresh_token = None
+                return False
+            data = response.json()
+            self.token = extract_token(data)
+            self.refresh_token = data.get("refresh_token")
+            return True
+
+    def _send(self, method, path, json, idempotency_key=None):
+        response = self._attempt(method, path, json, self.token_format, idempotency_key)
+        if self.token and self.token_format is None:
+            if response.status_code in [401, 403]:
+                retry = self._attempt(method, path, json, "direct", idempotency_key)
+                if retry.status_code not in [401, 403]:
+                    self.token_format = "direct"
+                    return retry
+            else:
+                self.token_format = "bearer"
+        return response
+
+    def _attempt(self, method, path, json, token_format, idempotency_key):
+        headers = self._headers(token_format, idempotency_key)
+        try:
+            return self.http.request(method, path, json=json, headers=headers)
+        except (httpx.TimeoutException, httpx.NetworkError):
+            if idempotency_key is None:
+                raise
+            return self.http.request(method, path, json=json, headers=headers)
+
+    def login(self, username, password):
+        """Log in and keep the token; returns the response"""
+        self.token = None
+        self.refresh_token = None
+        response = self.request("POST", "/login", {"username": username, "password": password})
+        if response.status_code in [200, 201]:
+            data = response.json()
+            self.token = extract_token(data)
+            self.refresh_token = data.get("refresh_token")
+        return response
+
+    def close(self):
+        self.http.close()
+
+def run_in_background(task, on_done, on_error=None):
+    """Run task() on a network worker and hand its result to on_done on the Tk thread.
+
+    Tk may only be touched from the main thread, so the event loop polls the
+    future with after() instead of the worker calling back into Tk.
+    """
+    future = network.submit(task)
+    owner = window
+
+    def check():
+        if not future.done():
+            owner.after(POLL_INTERVAL_MS, check)
+            return
+        try:
+            result = future.result()
+        except httpx.HTTPError as e:
+            messagebox.showerror("Connection Error", f"Could not reach the server: {e}")
+            if on_error:
+                on_error()
+            return
+        on_done(result)
+
+    owner.after(POLL_INTERVAL_MS, check)
+
+def submit_with(button, task, on_done):
+    """Like run_in_background, but keeps button disabled while the request is in flight"""
+    button.config(state='disabled')
+
+    def restore():
+        if button.winfo_exists():
+            button.config(state='normal')
+
+    def done(response):
+        restore()
+        on_done(response)
+
+    run_in_background(task, done, on_error=restore)
 
 def register():
     username = entry_username.get()
     password = entry_password.get()
-    
-    response = requests.post(f"{BACKEND_URL}/register", json={"username": username, "password": password})
 
-    if response.status_code in [200, 201]:
-        messagebox.showinfo("Registration", "User registered successfully!")
-    else:
-        error_msg = get_error_message(response)
-        messagebox.showerror("Registration Failed", error_msg)
+    def on_done(response):
+        if response.status_code in [200, 201]:
+            messagebox.showinfo("Registration", "User registered successfully!")
+        else:
+            error_msg = get_error_message(response)
+            messagebox.showerror("Registration Failed", error_msg)
+
+    submit_with(register_button, lambda: client.request("POST", "/register", {"username": username, "password": password}), on_done)
 
 def login():
-    global token, current_account
     username = entry_username.get()
     password = entry_password.get()
 
-    response = requests.post(f"{BACKEND_URL}/login", json={"username": username, "password": password})
-
-    if response.status_code in [200, 201]:
-        data = response.json()
-        if data.get("success"):
-            token = data.get("data") or data.get("token")
-        else:
-            token = data.get("token")
-        
-        if token:
-            detect_server_token_format()
-            messagebox.showinfo("Login Success", "Welcome!")
-            root.destroy()
-            open_main_app()
+    def on_done(response):
+        if response.status_code in [200, 201]:
+            if client.token:
+                messagebox.showinfo("Login Success", "Welcome!")
+                root.destroy()
+                open_main_app()
+            else:
+                messagebox.showerror("Login Failed", "No token received")
         else:
-            messagebox.showerror("Login Failed", "No token received")
-    else:
-        error_msg = get_error_message(response)
-        messagebox.showerror("Login Failed", error_msg)
+            error_msg = get_error_message(response)
+            messagebox.showerror("Login Failed", error_msg)
+
+    submit_with(login_button, lambda: client.login(username, password), on_done)
 
 def access_protected():
-    response = requests.get(f"{BACKEND_URL}/protected", headers=get_headers())
-    if response.status_code in [200, 201]:
-        data = response.json()
-        messagebox.showinfo("Response", data.get("message", "Access granted!"))
-    else:
-        error_msg = get_error_message(response)
-        messagebox.showerror("Access Failed", error_msg)
+    def on_done(response):
+        if response.status_code in [200, 201]:
+            data = response.json()
+            messagebox.showinfo("Response", data.get("message", "Access granted!"))
+        else:
+            error_msg = get_error_message(response)
+            messagebox.showerror("Access Failed", error_msg)
+
+    run_in_background(lambda: client.request("GET", "/protected"), on_done)
 
 def create_account():
     """Create a new account"""
@@ -118,62 +243,45 @@ def create_account():
         except ValueError:
             messagebox.showerror("Error", "Please enter a valid number")
             return
-        
-        response = requests.post(
-            f"{BACKEND_URL}/accounts/create", 
-            json={"initial_balance": initial_balance},
-            headers=get_headers()
-        )
-        
-        if response.status_code in [200, 201]:
-            data = response.json()
-            if "success" in data and data["success"] and "data" in data:
-                account_data = data['data']
-                messagebox.showinfo("Success", f"Account created!\nAccount Number: {account_data['account_number']}\nBalance: ${account_data['balance']:.2f}")
-            elif 'data' in data:
-                account_data = data['data']
-                messagebox.showinfo("Success", f"Account created!\nAccount Number: {account_data['account_number']}\nBalance: ${account_data['balance']:.2f}")
+
+        def on_done(response):
+            if response.status_code in [200, 201]:
+                account_data = extract_account(response.json())
+                create_window.destroy()
+                refresh_account_info()
+                messagebox.showinfo("Success", f"Account created!\nAccount Number: {account_data.get('account_number', 'N/A')}\nBalance: ${account_data.get('balance', 0):.2f}")
             else:
-                messagebox.showinfo("Success", f"Account created!\nAccount Number: {data.get('account_number', 'N/A')}\nBalance: ${data.get('balance', 0):.2f}")
-            create_window.destroy()
-            refresh_account_info()
-        else:
-            error_msg = get_error_message(response)
-            messagebox.showerror("Error", error_msg)
-    
+                error_msg = get_error_message(response)
+                messagebox.showerror("Error", error_msg)
+
+        submit_with(create_button, lambda: client.request("POST", "/accounts/create", {"initial_balance": initial_balance}), on_done)
+
     create_window = tk.Toplevel()
     create_window.title("Create Account")
     create_window.geometry("300x150")
     create_window.configure(padx=20, pady=20)
-    
+
     tk.Label(create_window, text="Initial Balance:").pack(pady=5)
     initial_balance_entry = tk.Entry(create_window)
     initial_balance_entry.pack(pady=5)
     initial_balance_entry.insert(0, "0.00")
-    
-    tk.Button(create_window, text="Create Account", command=create).pack(pady=10)
+
+    create_button = tk.Button(create_window, text="Create Account", command=create)
+    create_button.pack(pady=10)
 
 def get_account_info():
-    """Get current account information"""
-    global current_account
-    response = requests.get(f"{BACKEND_URL}/accounts/my-account", headers=get_headers())
-    
+    """Get current account information; runs on a network worker"""
+    response = client.request("GET", "/accounts/my-account")
+
     if response.status_code in [200, 201]:
-        data = response.json()
-        if "success" in data and data["success"] and "data" in data:
-            current_account = data['data']
-        elif 'account' in data:
-            current_account = data['account']
-        else:
-            current_account = data
-        return current_account
+        return extract_account(response.json())
     else:
-        current_account = None
         return None
 
-def refresh_account_info():
-    """Refresh and display account information"""
-    account = get_account_info()
+def show_account(account):
+    """Display account information and enable the operations that apply"""
+    global current_account
+    current_account = account
     if account:
         account_info_label.config(text=f"Account: {account['account_number']}\nBalance: ${account['balance']:.2f}")
         for widget in account_operations_frame.winfo_children():
@@ -187,9 +295,19 @@ def refresh_account_info():
             else:
                 widget.config(state='disabled')
 
-def deposit():
-    """Deposit money to account"""
-    def perform_deposit():
+def refresh_account_info():
+    """Refresh and display account information without blocking the UI"""
+    run_in_background(get_account_info, show_account)
+
+def show_new_balance(new_balance):
+    """Show the balance an operation reported while the full refresh is in flight"""
+    if current_account and new_balance is not None:
+        show_account(dict(current_account, balance=new_balance))
+    refresh_account_info()
+
+def balance_operation(title, prompt, path, verb, with_recipient=False):
+    """Open a dialog that posts an amount (and optionally a recipient) to path"""
+    def perform():
         try:
             amount = float(amount_entry.get())
             if amount <= 0:
@@ -198,218 +316,337 @@ def deposit():
         except ValueError:
             messagebox.showerror("Error", "Please enter a valid number")
             return
-        
-        response = requests.post(
-            f"{BACKEND_URL}/accounts/deposit", 
-            json={"amount": amount},
-            headers=get_headers()
-        )
-        
-        if response.status_code in [200, 201]:
-            data = response.json()
-            if "success" in data and data["success"] and "data" in data:
-                new_balance = data['data']['new_balance']
-                messagebox.showinfo("Success", f"Deposited ${amount:.2f}\nNew Balance: ${new_balance:.2f}")
-            elif 'data' in data:
-                new_balance = data['data']['new_balance']
-                messagebox.showinfo("Success", f"Deposited ${amount:.2f}\nNew Balance: ${new_balance:.2f}")
+
+        payload = {"amount": amount}
+        suffix = ""
+        if with_recipient:
+            to_account = to_account_entry.get().strip()
+            if not to_account:
+                messagebox.showerror("Error", "Please enter recipient account number")
+                return
+            payload["to_account_number"] = to_account
+            suffix = f" to account {to_account}"
+
+        def on_done(response):
+            if response.status_code in [200, 201]:
+                new_balance = extract_new_balance(response.json(), amount)
+                dialog.destroy()
+                show_new_balance(new_balance)
+                messagebox.showinfo("Success", f"{verb} ${amount:.2f}{suffix}\nNew Balance: ${new_balance:.2f}")
             else:
-                new_balance = data.get('new_balance', amount)
-                messagebox.showinfo("Success", f"Deposited ${amount:.2f}\nNew Balance: ${new_balance:.2f}")
-            deposit_window.destroy()
-            refresh_account_info()
-        else:
-            error_msg = get_error_message(response)
-            messagebox.showerror("Error", error_msg)
-    
-    deposit_window = tk.Toplevel()
-    deposit_window.title("Deposit Money")
-    deposit_window.geometry("300x150")
-    deposit_window.configure(padx=20, pady=20)
-    
-    tk.Label(deposit_window, text="Amount to Deposit:").pack(pady=5)
-    amount_entry = tk.Entry(deposit_window)
+                error_msg = get_error_message(response)
+                messagebox.showerror("Error", error_msg)
+
+        # One key per submission: a retry after a timeout cannot apply it twice
+        key = uuid.uuid4().hex
+        submit_with(submit_button, lambda: client.request("POST", path, payload, idempotency_key=key), on_done)
+
+    dialog = tk.Toplevel()
+    dialog.title(title)
+    dialog.geometry("350x200" if with_recipient else "300x150")
+    dialog.configure(padx=20, pady=20)
+
+    if with_recipient:
+        tk.Label(dialog, text="Recipient Account Number:").pack(pady=5)
+        to_account_entry = tk.Entry(dialog)
+        to_account_entry.pack(pady=5)
+
+    tk.Label(dialog, text=prompt).pack(pady=5)
+    amount_entry = tk.Entry(dialog)
     amount_entry.pack(pady=5)
-    
-    tk.Button(deposit_window, text="Deposit", command=perform_deposit).pack(pady=10)
+
+    submit_button = tk.Button(dialog, text=title.split()[0], command=perform)
+    submit_button.pack(pady=10)
+
+def deposit():
+    """Deposit money to account"""
+    balance_operation("Deposit Money", "Amount to Deposit:", "/accounts/deposit", "Deposited")
 
 def withdraw():
     """Withdraw money from account"""
-    def perform_withdraw():
-        try:
-            amount = float(amount_entry.get())
-            if amount <= 0:
-                messagebox.showerror("Error", "Amount must be positive")
-                return
-        except ValueError:
-            messagebox.showerror("Error", "Please enter a valid number")
-            return
-        
-        response = requests.post(
-            f"{BACKEND_URL}/accounts/withdraw", 
-            json={"amount": amount},
-            headers=get_headers()
-        )
-        
-        if response.status_code in [200, 201]:
-            data = response.json()
-            if "success" in data and data["success"] and "data" in data:
-                new_balance = data['data']['new_balance']
-                messagebox.showinfo("Success", f"Withdrew ${amount:.2f}\nNew Balance: ${new_balance:.2f}")
-            elif 'data' in data:
-                new_balance = data['data']['new_balance']
-                messagebox.showinfo("Success", f"Withdrew ${amount:.2f}\nNew Balance: ${new_balance:.2f}")
-            else:
-                new_balance = data.get('new_balance', amount)
-                messagebox.showinfo("Success", f"Withdrew ${amount:.2f}\nNew Balance: ${new_balance:.2f}")
-            withdraw_window.destroy()
-            refresh_account_info()
-        else:
-            error_msg = get_error_message(response)
-            messagebox.showerror("Error", error_msg)
-    
-    withdraw_window = tk.Toplevel()
-    withdraw_window.title("Withdraw Money")
-    withdraw_window.geometry("300x150")
-    withdraw_window.configure(padx=20, pady=20)
-    
-    tk.Label(withdraw_window, text="Amount to Withdraw:").pack(pady=5)
-    amount_entry = tk.Entry(withdraw_window)
-    amount_entry.pack(pady=5)
-    
-    tk.Button(withdraw_window, text="Withdraw", command=perform_withdraw).pack(pady=10)
+    balance_operation("Withdraw Money", "Amount to Withdraw:", "/accounts/withdraw", "Withdrew")
 
 def transfer():
     """Transfer money to another account"""
-    def perform_transfer():
-        try:
-            amount = float(amount_entry.get())
-            if amount <= 0:
-                messagebox.showerror("Error", "Amount must be positive")
-                return
-        except ValueError:
-            messagebox.showerror("Error", "Please enter a valid number")
-            return
-        
-        to_account = to_account_entry.get().strip()
-        if not to_account:
-            messagebox.showerror("Error", "Please enter recipient account number")
-            return
-        
-        response = requests.post(
-            f"{BACKEND_URL}/accounts/transfer", 
-            json={"to_account_number": to_account, "amount": amount},
-            headers=get_headers()
-        )
-        
-        if response.status_code in [200, 201]:
-            data = response.json()
-            if "success" in data and data["success"] and "data" in data:
-                new_balance = data['data']['new_balance']
-                messagebox.showinfo("Success", f"Transferred ${amount:.2f} to account {to_account}\nNew Balance: ${new_balance:.2f}")
-            elif 'data' in data:
-                new_balance = data['data']['new_balance']
-                messagebox.showinfo("Success", f"Transferred ${amount:.2f} to account {to_account}\nNew Balance: ${new_balance:.2f}")
-            else:
-                new_balance = data.get('new_balance', amount)
-                messagebox.showinfo("Success", f"Transferred ${amount:.2f} to account {to_account}\nNew Balance: ${new_balance:.2f}")
-            transfer_window.destroy()
-            refresh_account_info()
-        else:
-            error_msg = get_error_message(response)
-            messagebox.showerror("Error", error_msg)
-    
-    transfer_window = tk.Toplevel()
-    transfer_window.title("Transfer Money")
-    transfer_window.geometry("350x200")
-    transfer_window.configure(padx=20, pady=20)
-    
-    tk.Label(transfer_window, text="Recipient Account Number:").pack(pady=5)
-    to_account_entry = tk.Entry(transfer_window)
-    to_account_entry.pack(pady=5)
-    
-    tk.Label(transfer_window, text="Amount to Transfer:").pack(pady=5)
-    amount_entry = tk.Entry(transfer_window)
-    amount_entry.pack(pady=5)
-    
-    tk.Button(transfer_window, text="Transfer", command=perform_transfer).pack(pady=10)
+    balance_operation("Transfer Money", "Amount to Transfer:", "/accounts/transfer", "Transferred", with_recipient=True)
 
 def close_account():
     """Close the current account"""
     if messagebox.askyesno("Confirm", "Are you sure you want to close your account? This action cannot be undone."):
-        response = requests.post(f"{BACKEND_URL}/accounts/close", headers=get_headers())
-        
-        if response.status_code in [200, 201]:
-            messagebox.showinfo("Success", "Account closed successfully")
-            refresh_account_info()
-        else:
-            error_msg = get_error_message(response)
-            messagebox.showerror("Error", error_msg)
+        def on_done(response):
+            if response.status_code in [200, 201]:
+                refresh_account_info()
+                messagebox.showinfo("Success", "Account closed successfully")
+            else:
+                error_msg = get_error_message(response)
+                messagebox.showerror("Error", error_msg)
+
+        run_in_background(lambda: client.request("POST", "/accounts/close"), on_done)
 
 def open_main_app():
-    global account_info_label, account_operations_frame
-    
+    global account_info_label, account_operations_frame, window
+
     app = tk.Tk()
+    window = app
     app.title("Banking App")
     app.geometry("500x600")
     app.configure(padx=30, pady=30)
 
     tk.Label(app, text="Welcome! You are authenticated.", font=("Arial", 14)).pack(pady=20)
-    
+
     account_frame = tk.Frame(app)
     account_frame.pack(fill="x", pady=10)
-    
+
     tk.Label(account_frame, text="Account Information:", font=("Arial", 12, "bold")).pack()
     account_info_label = tk.Label(account_frame, text="Loading...", font=("Arial", 10))
     account_info_label.pack(pady=5)
-    
+
     tk.Button(account_frame, text="Refresh Account Info", command=refresh_account_info).pack(pady=5)
-    
+
     operations_frame = tk.Frame(app)
     operations_frame.pack(fill="x", pady=20)
-    
+
     tk.Label(operations_frame, text="Account Operations:", font=("Arial", 12, "bold")).pack()
-    
+
     account_operations_frame = tk.Frame(operations_frame)
     account_operations_frame.pack(pady=10)
-    
+
     tk.Button(account_operations_frame, text="Create Account", command=create_account, width=15).grid(row=0, column=0, padx=5, pady=5)
     tk.Button(account_operations_frame, text="Deposit", command=deposit, width=15).grid(row=0, column=1, padx=5, pady=5)
     tk.Button(account_operations_frame, text="Withdraw", command=withdraw, width=15).grid(row=0, column=2, padx=5, pady=5)
     tk.Button(account_operations_frame, text="Transfer", command=transfer, width=15).grid(row=1, column=0, padx=5, pady=5)
     tk.Button(account_operations_frame, text="Close Account", command=close_account, width=15).grid(row=1, column=1, padx=5, pady=5)
-    
+
     other_frame = tk.Frame(app)
     other_frame.pack(fill="x", pady=20)
-    
+
     tk.Label(other_frame, text="Other Operations:", font=("Arial", 12, "bold")).pack()
     tk.Button(other_frame, text="Access Protected", command=access_protected, width=15).pack(pady=5)
     tk.Button(other_frame, text="Exit", command=app.quit, width=15).pack(pady=5)
-    
+
     refresh_account_info()
-    
+
     app.mainloop()
 
-root = tk.Tk()
-root.title("Login/Register")
-root.geometry("300x200")
-root.configure(padx=20, pady=20)
+SCRIPT_OPERATIONS = ("register", "login", "protected", "create", "my-account", "deposit", "withdraw", "transfer", "close")
+
+class ScriptUser:
+    def __init__(self, username, password, steps):
+        self.username = username
+        self.password = password
+        self.steps = steps
+        self.client = None
+
+class ScriptRunner:
+    """Replays a JSON-lines script of per-user operations against a backend.
+
+    Each line names a user and an operation, for example
+    {"user": "alice", "op": "transfer", "amount": 5, "to_user": "bob"}.
+    A user's lines run in file order; different users run concurrently on
+    `concurrency` threads that share one connection pool. Every request goes
+    through BankClient and the same response parsing as the GUI, so scripts
+    work against any of the backends.
+    """
 
-tk.Label(root, text="Username:").grid(row=0, column=0, padx=5, pady=5, sticky="e")
-tk.Label(root, text="Password:").grid(row=1, column=0, padx=5, pady=5, sticky="e")
+    def __init__(self, url, users, concurrency=32, timeout=REQUEST_TIMEOUT):
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        self.url = url
+        self.http = httpx.Client(base_url=url, timeout=timeout, limits=limits)
+        self.users = users
+        self.concurrency = concurrency
+        self.token_format = None
+        self.account_numbers = {}
+        self.latencies = {op: [] for op in SCRIPT_OPERATIONS}
+        self.statuses = {op: {} for op in SCRIPT_OPERATIONS}
+        self._lock = threading.Lock()
 
-entry_username = tk.Entry(root)
-entry_password = tk.Entry(root, show="*")
+    def record(self, op, seconds, status):
+        with self._lock:
+            self.latencies[op].append(seconds)
+            self.statuses[op][status] = self.statuses[op].get(status, 0) + 1
 
-entry_username.grid(row=0, column=1, padx=5, pady=5, sticky="ew")
-entry_password.grid(row=1, column=1, padx=5, pady=5, sticky="ew")
+    def call(self, user, step):
+        op = step["op"]
+        client = user.client
+        if op == "register":
+            return client.request("POST", "/register", {"username": user.username, "password": user.password})
+        if op == "login":
+            return client.login(user.username, user.password)
+        if op == "protected":
+            return client.request("GET", "/protected")
+        if op == "create":
+            return client.request("POST", "/accounts/create", {"initial_balance": step.get("initial_balance", 0.0)})
+        if op == "my-account":
+            return client.request("GET", "/accounts/my-account")
+        if op in ("deposit", "withdraw"):
+            return client.request("POST", f"/accounts/{op}", {"amount": step["amount"]}, idempotency_key=uuid.uuid4().hex)
+        if op == "transfer":
+            to_account = step.get("to_account_number") or self.account_numbers.get(step.get("to_user"), "")
+            return client.request("POST", "/accounts/transfer", {"to_account_number": to_account, "amount": step["amount"]},
+                                  idempotency_key=uuid.uuid4().hex)
+        return client.request("POST", "/accounts/close")
 
-button_frame = tk.Frame(root)
-button_frame.grid(row=2, column=0, columnspan=2, pady=10)
+    def run_user(self, user):
+        user.client = BankClient(self.url, http=self.http, token_format=self.token_format)
+        for step in user.steps:
+            op = step["op"]
+            started = time.perf_counter()
+            try:
+                response = self.call(user, step)
+            except httpx.HTTPError as e:
+                self.record(op, time.perf_counter() - started, type(e).__name__)
+                continue
+            self.record(op, time.perf_counter() - started, str(response.status_code))
+            if self.token_format is None:
+                self.token_format = user.client.token_format
+            if op in ("create", "my-account") and response.status_code in [200, 201]:
+                account_number = extract_account(response.json()).get("account_number")
+                if account_number:
+                    self.account_numbers[user.username] = account_number
 
-tk.Button(button_frame, text="Register", command=register, width=10).pack(side=tk.LEFT, padx=5)
-tk.Button(button_frame, text="Login", command=login, width=10).pack(side=tk.LEFT, padx=5)
+    def run(self):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="script-user") as pool:
+            for future in [pool.submit(self.run_user, user) for user in self.users]:
+                future.result()
+        elapsed = time.perf_counter() - started
+        self.http.close()
+        return self.report(elapsed)
 
-root.grid_columnconfigure(1, weight=1)
+    def report(self, elapsed):
+        from benchmark import git_commit, percentile
+
+        def latency_summary(latencies):
+            return {
+                "mean": sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+                "p50": percentile(latencies, 50) * 1000,
+                "p95": percentile(latencies, 95) * 1000,
+                "p99": percentile(latencies, 99) * 1000,
+                "max": latencies[-1] * 1000 if latencies else 0.0
+            }
+
+        operations = {}
+        total = errors = 0
+        for op in SCRIPT_OPERATIONS:
+            latencies = sorted(self.latencies[op])
+            if not latencies:
+                continue
+            statuses = self.statuses[op]
+            failed = sum(count for status, count in statuses.items() if not status.startswith("2"))
+            total += len(latencies)
+            errors += failed
+            operations[op] = {
+                "requests": len(latencies),
+                "throughput": len(latencies) / elapsed,
+                "error_rate": failed / len(latencies),
+                "statuses": statuses,
+                "latency_ms": latency_summary(latencies)
+            }
+        all_latencies = sorted(l for op in SCRIPT_OPERATIONS for l in self.latencies[op])
+        return {
+            "commit": git_commit(),
+            "config": {
+                "url": self.url,
+                "concurrency": self.concurrency,
+                "users": len(self.users),
+                "token_format": self.token_format
+            },
+            "elapsed_seconds": elapsed,
+            "total": {
+                "requests": total,
+                "throughput": total / elapsed if elapsed else 0.0,
+                "error_rate": errors / total if total else 0.0,
+                "latency_ms": latency_summary(all_latencies)
+            },
+            "operations": operations
+        }
+
+def load_script(path, default_password):
+    """Group a JSON-lines script into ScriptUsers, keeping each user's lines in order"""
+    users = {}
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                step = json.loads(line)
+            except ValueError as e:
+                raise SystemExit(f"{path}:{line_number}: invalid JSON: {e}")
+            if step.get("op") not in SCRIPT_OPERATIONS:
+                raise SystemExit(f"{path}:{line_number}: unknown op {step.get('op')!r} (choose from {', '.join(SCRIPT_OPERATIONS)})")
+            if "user" not in step:
+                raise SystemExit(f"{path}:{line_number}: missing user")
+            if step["op"] in ("deposit", "withdraw", "transfer") and "amount" not in step:
+                raise SystemExit(f"{path}:{line_number}: {step['op']} needs an amount")
+            username = str(step["user"])
+            if username not in users:
+                users[username] = ScriptUser(username, step.get("password", default_password), [])
+            users[username].steps.append(step)
+    return list(users.values())
+
+def run_script(args):
+    from benchmark import print_report
+
+    users = load_script(args.script, args.password)
+    result = ScriptRunner(args.url, users, concurrency=args.concurrency, timeout=args.timeout).run()
+    print_report(result)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Results written to {args.output}", file=sys.stderr)
+
+def run_gui():
+    global client, network, window, root, entry_username, entry_password, register_button, login_button
+
+    client = BankClient(BACKEND_URL)
+    network = ThreadPoolExecutor(max_workers=NETWORK_WORKERS, thread_name_prefix="client-http")
+
+    root = tk.Tk()
+    window = root
+    root.title("Login/Register")
+    root.geometry("300x200")
+    root.configure(padx=20, pady=20)
+
+    tk.Label(root, text="Username:").grid(row=0, column=0, padx=5, pady=5, sticky="e")
+    tk.Label(root, text="Password:").grid(row=1, column=0, padx=5, pady=5, sticky="e")
+
+    entry_username = tk.Entry(root)
+    entry_password = tk.Entry(root, show="*")
+
+    entry_username.grid(row=0, column=1, padx=5, pady=5, sticky="ew")
+    entry_password.grid(row=1, column=1, padx=5, pady=5, sticky="ew")
+
+    button_frame = tk.Frame(root)
+    button_frame.grid(row=2, column=0, columnspan=2, pady=10)
+
+    register_button = tk.Button(button_frame, text="Register", command=register, width=10)
+    register_button.pack(side=tk.LEFT, padx=5)
+    login_button = tk.Button(button_frame, text="Login", command=login, width=10)
+    login_button.pack(side=tk.LEFT, padx=5)
+
+    root.grid_columnconfigure(1, weight=1)
+
+    root.mainloop()
+
+    network.shutdown(wait=False)
+    client.close()
+
+def main(argv=None):
+    global BACKEND_URL
+    parser = argparse.ArgumentParser(description="Banking client for any of the backends")
+    parser.add_argument("--url", default=BACKEND_URL, help="server base URL")
+    parser.add_argument("--script", help="replay a JSON-lines operation script headlessly instead of opening the GUI")
+    parser.add_argument("--concurrency", type=int, default=32, help="users replayed at once in script mode")
+    parser.add_argument("--password", default="password", help="password for script users that do not set one")
+    parser.add_argument("--timeout", type=float, default=REQUEST_TIMEOUT, help="per-request timeout in seconds")
+    parser.add_argument("--output", help="write the script-mode results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    if args.script:
+        run_script(args)
+    else:
+        BACKEND_URL = args.url
+        run_gui()
 
-root.mainloop()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -1,32 +1,89 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Header, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from starlette.concurrency import run_in_threadpool
+from starlette.routing import Match
 from pydantic import BaseModel
-from typing import Dict, Optional
+from typing import Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
 import uvicorn
-import bcrypt
+import argparse
+import asyncio
+import functools
+import json
 import jwt
 import datetime
 import os
-import json
-import uuid
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.accounts import (
+    AccountNotFound, AccountAlreadyExists, AccountNumberTaken, RecipientNotFound, RecipientInactive,
+    InsufficientFunds, NonZeroBalance, InvalidAmount, InvalidOperation, BatchAborted
+)
+from shared.admission import AdmissionController, AdmissionGate, AdmissionRejected, DeadlineExceeded
+from shared.allocator import AccountNumberAllocator
+from shared.bulk import BulkExporter, BulkImporter, LineSplitter, admin_token_matches, describe
+from shared.config import env_bool, env_float, env_int, env_str
+from shared.history import normalize_timestamp, take_page
+from shared.idempotency import IdempotencyKeyInUse, IdempotencyKeyReused, request_fingerprint, valid_key
+from shared.metrics import CONTENT_TYPE, MetricsRegistry, instrument
+from shared.passwords import PasswordPool, PasswordPoolBusy
+from shared.profiler import RequestProfile, SamplingProfiler, route_label
+from shared.storage import STORAGE_OPERATIONS, open_storage
+from shared.tokens import TokenCache, new_refresh_token, refresh_token_digest
+from shared.workers import connect_shared_storage, remove_shared_storage, run_workers, share_storage
 
 app = FastAPI()
 SECRET_KEY = "supersecretkey"
 USERS_FILE = "users.json"
 ACCOUNTS_FILE = "accounts.json"
-
-if not os.path.exists(USERS_FILE):
-    with open(USERS_FILE, "w") as f:
-        json.dump({}, f)
-
-if not os.path.exists(ACCOUNTS_FILE):
-    with open(ACCOUNTS_FILE, "w") as f:
-        json.dump({}, f)
+ACCOUNTS_JOURNAL = "accounts.journal"
+ACCOUNTS_HISTORY = "accounts.history"
+STORAGE_BACKEND = env_str("STORAGE_BACKEND", "json")
+SQLITE_PATH = env_str("SQLITE_PATH", "bank.db")
+JOURNAL_FSYNC = env_bool("JOURNAL_FSYNC", True)
+JOURNAL_GROUP_WINDOW_MS = env_float("JOURNAL_GROUP_WINDOW_MS", 0.0)
+JOURNAL_GROUP_SIZE = env_int("JOURNAL_GROUP_SIZE", 256)
+BCRYPT_ROUNDS = env_int("BCRYPT_ROUNDS", 12)
+PASSWORD_POOL_WORKERS = env_int("PASSWORD_POOL_WORKERS", os.cpu_count() or 2)
+PASSWORD_POOL_QUEUE = env_int("PASSWORD_POOL_QUEUE", 32)
+PASSWORD_POOL_PROCESSES = env_bool("PASSWORD_POOL_PROCESSES", False)
+TOKEN_CACHE_SIZE = env_int("TOKEN_CACHE_SIZE", 10000)
+REFRESH_TOKEN_DAYS = env_float("REFRESH_TOKEN_DAYS", 30.0)
+IDEMPOTENCY_CACHE_SIZE = env_int("IDEMPOTENCY_CACHE_SIZE", 10000)
+IDEMPOTENCY_TTL_SECONDS = env_float("IDEMPOTENCY_TTL_SECONDS", 3600.0)
+ACCOUNT_LOCK_STRIPES = env_int("ACCOUNT_LOCK_STRIPES", 256)
+SNAPSHOT_INTERVAL_SECONDS = env_float("SNAPSHOT_INTERVAL_SECONDS", 300.0)
+SNAPSHOT_RECORDS = env_int("SNAPSHOT_RECORDS", 100000)
+ACCOUNT_SHARDS = env_int("ACCOUNT_SHARDS", 1)
+ACCOUNTS_FORMAT = env_str("ACCOUNTS_FORMAT", "json")
+ASYNC_ENDPOINTS = env_bool("ASYNC_ENDPOINTS", True)
+STORAGE_IO_WORKERS = env_int("STORAGE_IO_WORKERS", 16)
+MAX_BATCH_OPERATIONS = env_int("MAX_BATCH_OPERATIONS", 1000)
+TRANSACTIONS_PAGE_SIZE = env_int("TRANSACTIONS_PAGE_SIZE", 50)
+TRANSACTIONS_PAGE_MAX = env_int("TRANSACTIONS_PAGE_MAX", 500)
+ADMIN_TOKEN = env_str("ADMIN_TOKEN", "")
+PROFILE_SAMPLE_RATE = env_float("PROFILE_SAMPLE_RATE", 0.0)
+PROFILE_INTERVAL_MS = env_float("PROFILE_INTERVAL_MS", 5.0)
+PROFILE_RETENTION_SECONDS = env_float("PROFILE_RETENTION_SECONDS", 900.0)
+ADMISSION_AUTH_LIMIT = env_int("ADMISSION_AUTH_LIMIT", 64)
+ADMISSION_READ_LIMIT = env_int("ADMISSION_READ_LIMIT", 256)
+ADMISSION_WRITE_LIMIT = env_int("ADMISSION_WRITE_LIMIT", 128)
+ADMISSION_QUEUE = env_int("ADMISSION_QUEUE", 256)
+ADMISSION_DEADLINE_MS = env_float("ADMISSION_DEADLINE_MS", 2000.0)
+AUTH_ROUTES = ("/register", "/login", "/token/refresh", "/token/revoke")
+IMPORT_CHUNK_SIZE = env_int("IMPORT_CHUNK_SIZE", 1000)
 
 class User(BaseModel):
     username: str
     password: str
 
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
 class AccountCreate(BaseModel):
     initial_balance: float = 0.0
 
@@ -37,6 +94,15 @@ class AccountTransfer(BaseModel):
     to_account_number: str
     amount: float
 
+class BatchOperation(BaseModel):
+    type: str
+    amount: float
+    to_account_number: Optional[str] = None
+
+class AccountBatch(BaseModel):
+    operations: List[BatchOperation]
+    continue_on_error: bool = False
+
 class Account(BaseModel):
     account_number: str
     username: str
@@ -46,27 +112,216 @@ class Account(BaseModel):
 
 security = HTTPBearer()
 
-def load_users():
-    with open(USERS_FILE, "r") as f:
-        return json.load(f)
+BATCH_ERROR_MESSAGES = {
+    InvalidOperation: "Unknown operation type",
+    InvalidAmount: "Amount must be positive",
+    InsufficientFunds: "Insufficient funds",
+    RecipientNotFound: "Recipient account not found",
+    RecipientInactive: "Recipient account is not active",
+}
+
+# Worker processes started with --workers use the parent's storage rather than opening the files again
+storage = connect_shared_storage() or open_storage(
+    STORAGE_BACKEND,
+    users_file=USERS_FILE,
+    accounts_file=ACCOUNTS_FILE,
+    journal_file=ACCOUNTS_JOURNAL,
+    history_file=ACCOUNTS_HISTORY,
+    sqlite_path=SQLITE_PATH,
+    fsync=JOURNAL_FSYNC,
+    group_window=JOURNAL_GROUP_WINDOW_MS / 1000,
+    group_size=JOURNAL_GROUP_SIZE,
+    lock_stripes=ACCOUNT_LOCK_STRIPES,
+    snapshot_interval=SNAPSHOT_INTERVAL_SECONDS,
+    snapshot_records=SNAPSHOT_RECORDS,
+    shards=ACCOUNT_SHARDS,
+    snapshot_format=ACCOUNTS_FORMAT,
+    idempotency_size=IDEMPOTENCY_CACHE_SIZE,
+    idempotency_ttl=IDEMPOTENCY_TTL_SECONDS
+)
+startup_summary = storage.startup_summary()
+if startup_summary:
+    print(startup_summary, file=sys.stderr)
+account_numbers = AccountNumberAllocator(lambda number: storage.get_account(number) is not None)
+
+storage_executor = ThreadPoolExecutor(max_workers=STORAGE_IO_WORKERS, thread_name_prefix="storage-io")
+profiler = SamplingProfiler(PROFILE_SAMPLE_RATE, PROFILE_INTERVAL_MS / 1000, PROFILE_RETENTION_SECONDS)
+# A limit of 0 leaves that class of routes unlimited
+admission = AdmissionController({
+    name: AdmissionGate(name, limit, ADMISSION_QUEUE)
+    for name, limit in (("auth", ADMISSION_AUTH_LIMIT), ("reads", ADMISSION_READ_LIMIT), ("writes", ADMISSION_WRITE_LIMIT))
+    if limit > 0
+}, ADMISSION_DEADLINE_MS / 1000)
+
+async def run_blocking(func, *args, **kwargs):
+    """Run blocking storage work on the dedicated storage executor"""
+    func = admission.before_deadline(profiler.bind(func))
+    if not ASYNC_ENDPOINTS:
+        return await run_in_threadpool(func, *args, **kwargs)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(storage_executor, functools.partial(func, *args, **kwargs))
+
+def endpoint(route, reads_only: bool = False):
+    """Mount a sync handler on a route decorator such as app.post("/path").
+
+    With ASYNC_ENDPOINTS off the handler is mounted as-is and runs on
+    Starlette's thread pool. Otherwise it is mounted as an async route that
+    runs the handler on the storage executor, or directly on the event loop
+    when it only reads and the backend serves reads from memory.
+    """
+    def decorator(func):
+        if not ASYNC_ENDPOINTS:
+            return route(func)
+        if reads_only and storage.memory_reads:
+            @functools.wraps(func)
+            async def handler(*args, **kwargs):
+                return func(*args, **kwargs)
+        else:
+            @functools.wraps(func)
+            async def handler(*args, **kwargs):
+                return await run_blocking(func, *args, **kwargs)
+        return route(handler)
+    return decorator
+
+password_pool = PasswordPool(
+    PASSWORD_POOL_WORKERS, PASSWORD_POOL_QUEUE,
+    rounds=BCRYPT_ROUNDS,
+    use_processes=PASSWORD_POOL_PROCESSES
+)
+
+async def run_password_task(submit, *args):
+    """Run a bcrypt task on the password pool without holding a request thread"""
+    try:
+        future = submit(*args)
+    except PasswordPoolBusy:
+        raise HTTPException(status_code=503, detail="Server busy, please retry", headers={"Retry-After": "1"})
+    return await asyncio.wrap_future(future)
+
+async def hash_password(password: str) -> str:
+    return await run_password_task(password_pool.submit_hash, password)
+
+async def check_password(password: str, hashed_password: str) -> bool:
+    return await run_password_task(password_pool.submit_check, password, hashed_password)
+
+token_cache = TokenCache(SECRET_KEY, algorithms=["HS256"], maxsize=TOKEN_CACHE_SIZE)
+
+metrics = MetricsRegistry()
+request_count = metrics.counter("http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+request_latency = metrics.histogram("http_request_duration_seconds", "HTTP request latency by route and status",
+                                    ("method", "route", "status"))
+storage_latency = metrics.histogram("storage_operation_duration_seconds", "Storage call latency by operation", ("operation",))
+instrument(storage, STORAGE_OPERATIONS, storage_latency)
+metrics.register_stats("storage", storage.stats)
+metrics.register_stats("password_pool", password_pool.stats)
+metrics.register_stats("token_cache", token_cache.stats)
+metrics.register_stats("profiler", profiler.stats)
+metrics.register_stats("admission", admission.stats)
+for gate in admission.gates.values():
+    metrics.register_stats(f"admission_{gate.name}", gate.stats)
+metrics.register_stats("storage_executor", lambda: {
+    "workers": STORAGE_IO_WORKERS,
+    # ThreadPoolExecutor has no public queue length
+    "queue_depth": storage_executor._work_queue.qsize()
+})
+
+def profile_requested(scope) -> bool:
+    """X-Profile: 1 together with the admin token profiles a request whatever the sample rate"""
+    if not ADMIN_TOKEN:
+        return False
+    headers = dict(scope["headers"])
+    if headers.get(b"x-profile") != b"1":
+        return False
+    presented = headers.get(b"x-admin-token")
+    return admin_token_matches(ADMIN_TOKEN, presented.decode("latin-1") if presented is not None else None)
+
+class ProfileRequests:
+    """Samples the stacks of the requests the profiler picks.
+
+    A plain ASGI middleware added ahead of record_metrics, so it sits inside
+    it and runs in the same task as routing, dependencies and the handler;
+    that task is what the profiler follows, along with the storage executor
+    threads run_blocking hands its work to.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not profiler.should_sample(profile_requested(scope)):
+            return await self.app(scope, receive, send)
+        profile = RequestProfile()
+        try:
+            with profiler.track_task(profile):
+                await self.app(scope, receive, send)
+        finally:
+            # The router has filled in the route by now
+            route = scope.get("route")
+            profiler.finish(profile, route_label(scope["method"], route.path if route is not None else None))
+
+app.add_middleware(ProfileRequests)
 
-def save_users(users):
-    with open(USERS_FILE, "w") as f:
-        json.dump(users, f, indent=4)
+def route_class(scope) -> Optional[str]:
+    """The admission gate a request goes through; None for /metrics and /admin, which bypass admission"""
+    path = scope["path"]
+    if path in AUTH_ROUTES:
+        return "auth"
+    if path == "/metrics" or path.startswith("/admin/"):
+        return None
+    return "reads" if scope["method"] in ("GET", "HEAD") else "writes"
 
-def load_accounts():
-    with open(ACCOUNTS_FILE, "r") as f:
-        return json.load(f)
+def server_busy() -> JSONResponse:
+    return JSONResponse({"detail": "Server busy, please retry"}, status_code=503, headers={"Retry-After": "1"})
 
-def save_accounts(accounts):
-    with open(ACCOUNTS_FILE, "w") as f:
-        json.dump(accounts, f, indent=4)
+class AdmitRequests:
+    """Admission control: per-class in-flight limits and a deadline to start by.
 
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+    Sits between record_metrics and ProfileRequests, so shed requests are
+    counted but not profiled. A request that cannot get a slot before its
+    deadline is answered 503 with Retry-After without reaching the router;
+    one that is admitted carries the deadline into run_blocking, where work
+    still queued for the storage executor past it is dropped as well.
+    """
 
-def check_password(password: str, hashed_password: str) -> bool:
-    return bcrypt.checkpw(password.encode(), hashed_password.encode())
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        try:
+            await admission.admit(route_class(scope), lambda: self.app(scope, receive, send))
+        except AdmissionRejected:
+            # Label the rejection with its route, as the router would have
+            for route in app.router.routes:
+                if route.matches(scope)[0] == Match.FULL:
+                    scope["route"] = route
+                    break
+            await server_busy()(scope, receive, send)
+
+app.add_middleware(AdmitRequests)
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded(request: Request, exc: DeadlineExceeded):
+    return server_busy()
+
+@app.middleware("http")
+async def record_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        request_count.inc(request.method, path, status)
+        request_latency.observe(time.perf_counter() - started, request.method, path, status)
+
+@app.get("/metrics")
+async def get_metrics():
+    # Rendering collects storage.stats(), which may hit the database or the storage server
+    return Response(await run_blocking(metrics.render), media_type=CONTENT_TYPE)
 
 def generate_token(username: str) -> str:
     payload = {
@@ -75,200 +330,376 @@ def generate_token(username: str) -> str:
     }
     return jwt.encode(payload, SECRET_KEY, algorithm="HS256")
 
+def issue_refresh_token(username: str) -> str:
+    """Store a new refresh token for the user and return it"""
+    refresh_token = new_refresh_token()
+    storage.add_refresh_token(refresh_token_digest(SECRET_KEY, refresh_token), username,
+                              time.time() + REFRESH_TOKEN_DAYS * 86400)
+    return refresh_token
+
 def generate_account_number() -> str:
     """Generate a unique account number"""
+    return account_numbers.allocate()
+
+def open_account(username: str, initial_balance: float) -> Dict:
+    # Each worker process allocates numbers on its own, so one can rarely be taken by another first
     while True:
-        account_number = str(uuid.uuid4().int)[:10]
-        accounts = load_accounts()
-        if account_number not in accounts:
-            return account_number
+        account_number = generate_account_number()
+        try:
+            return storage.create_account(username, account_number, initial_balance)
+        except AccountNumberTaken:
+            continue
+        finally:
+            # Once committed the store's index covers the number; on failure it is free again
+            account_numbers.release([account_number])
 
 async def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     token = credentials.credentials
     try:
-        return jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+        return token_cache.decode(token)
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
 @app.post("/register")
-def register(user: User):
-    users = load_users()
-    if user.username in users:
+async def register(user: User):
+    if await run_blocking(storage.get_password_hash, user.username) is not None:
         raise HTTPException(status_code=400, detail="User already exists")
     
-    users[user.username] = hash_password(user.password)
-    save_users(users)
+    hashed_password = await hash_password(user.password)
+    if not await run_blocking(storage.add_user, user.username, hashed_password):
+        raise HTTPException(status_code=400, detail="User already exists")
     
     return {"success": True, "message": "User registered successfully"}
 
 @app.post("/login")
-def login(user: User):
-    users = load_users()
-    if user.username not in users or not check_password(user.password, users[user.username]):
+async def login(user: User):
+    hashed_password = await run_blocking(storage.get_password_hash, user.username)
+    if hashed_password is None or not await check_password(user.password, hashed_password):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     token = generate_token(user.username)
-    return {"success": True, "message": "Login successful", "token": token}
+    refresh_token = await run_blocking(issue_refresh_token, user.username)
+    return {"success": True, "message": "Login successful", "token": token, "refresh_token": refresh_token}
+
+@app.post("/token/refresh")
+async def refresh(body: RefreshRequest):
+    # No bcrypt here: one HMAC and one keyed lookup. The presented token is
+    # used up, so a stolen one stops working once its owner refreshes.
+    refresh_token = new_refresh_token()
+    username = await run_blocking(
+        storage.rotate_refresh_token,
+        refresh_token_digest(SECRET_KEY, body.refresh_token),
+        refresh_token_digest(SECRET_KEY, refresh_token),
+        time.time() + REFRESH_TOKEN_DAYS * 86400
+    )
+    if username is None:
+        raise HTTPException(status_code=401, detail="Invalid refresh token")
+    return {"success": True, "message": "Token refreshed", "token": generate_token(username),
+            "refresh_token": refresh_token}
+
+@app.post("/token/revoke")
+async def revoke(body: RefreshRequest):
+    await run_blocking(storage.revoke_refresh_token, refresh_token_digest(SECRET_KEY, body.refresh_token))
+    return {"success": True, "message": "Refresh token revoked"}
 
-@app.get("/protected")
+@endpoint(app.get("/protected"), reads_only=True)
 def protected(token: str = Depends(verify_token)):
     return {"success": True, "message": f"Hello, {token['username']}!"}
 
-@app.post("/accounts/create")
+@endpoint(app.post("/accounts/create"))
 def create_account(account_data: AccountCreate, token: str = Depends(verify_token)):
-    username = token['username']
-    accounts = load_accounts()
-    
-    for account_number, account in accounts.items():
-        if account['username'] == username and account['is_active']:
-            raise HTTPException(status_code=400, detail="User already has an active account")
-    
-    account_number = generate_account_number()
-    new_account = {
-        "account_number": account_number,
-        "username": username,
-        "balance": account_data.initial_balance,
-        "is_active": True,
-        "created_at": datetime.datetime.utcnow().isoformat()
-    }
-    
-    accounts[account_number] = new_account
-    save_accounts(accounts)
+    try:
+        account = open_account(token['username'], account_data.initial_balance)
+    except AccountAlreadyExists:
+        raise HTTPException(status_code=400, detail="User already has an active account")
+    except InvalidAmount:
+        raise HTTPException(status_code=400, detail="Initial balance cannot be negative")
     
     return {
         "success": True, 
         "message": "Account created successfully",
-        "account_number": account_number,
-        "balance": account_data.initial_balance
+        "account_number": account['account_number'],
+        "balance": account['balance']
     }
 
-@app.get("/accounts/my-account")
+@endpoint(app.get("/accounts/my-account"), reads_only=True)
 def get_my_account(token: str = Depends(verify_token)):
-    username = token['username']
-    accounts = load_accounts()
+    account = storage.find_account(token['username'])
+    if not account:
+        raise HTTPException(status_code=404, detail="No active account found")
+    
+    return {
+        "success": True,
+        "account": {
+            "account_number": account['account_number'],
+            "balance": account['balance'],
+            "created_at": account['created_at']
+        }
+    }
+
+def idempotent(key: Optional[str], username: str, route: str, body: BaseModel, handler):
+    """Run handler() once per Idempotency-Key; a retry gets the first response back"""
+    if key is None:
+        return handler()
+    if not valid_key(key):
+        raise HTTPException(status_code=400, detail="Idempotency-Key must be 1 to 255 printable characters")
+
+    def capture():
+        try:
+            return 200, handler()
+        except HTTPException as e:
+            return e.status_code, {"detail": e.detail}
+
+    try:
+        status, content, replayed = storage.run_idempotent(username, key, request_fingerprint(route, body.model_dump()),
+                                                           capture)
+    except IdempotencyKeyInUse:
+        raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress",
+                            headers={"Retry-After": "1"})
+    except IdempotencyKeyReused:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+    if replayed:
+        return JSONResponse(content, status_code=status, headers={"Idempotent-Replayed": "true"})
+    if status != 200:
+        raise HTTPException(status_code=status, detail=content["detail"])
+    return content
+
+def transaction_filters(cursor: Optional[str], start: Optional[str], end: Optional[str]):
+    try:
+        after = int(cursor) if cursor is not None else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    try:
+        start = normalize_timestamp(start) if start is not None else None
+        end = normalize_timestamp(end) if end is not None else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be ISO-8601, e.g. 2024-01-31 or 2024-01-31T12:00:00")
+    return after, start, end
+
+@endpoint(app.get("/accounts/transactions"))
+def get_transactions(cursor: Optional[str] = None, limit: int = TRANSACTIONS_PAGE_SIZE, start: Optional[str] = None,
+                     end: Optional[str] = None, format: str = "json", token: str = Depends(verify_token)):
+    after, start, end = transaction_filters(cursor, start, end)
+    if not 1 <= limit <= TRANSACTIONS_PAGE_MAX:
+        raise HTTPException(status_code=400, detail=f"Limit must be between 1 and {TRANSACTIONS_PAGE_MAX}")
+    if format not in ("json", "ndjson"):
+        raise HTTPException(status_code=400, detail="Format must be json or ndjson")
+    try:
+        entries = storage.list_transactions(token['username'], after=after, start=start, end=end)
+    except AccountNotFound:
+        raise HTTPException(status_code=404, detail="No active account found")
     
-    for account_number, account in accounts.items():
-        if account['username'] == username and account['is_active']:
-            return {
-                "success": True,
-                "account": {
-                    "account_number": account['account_number'],
-                    "balance": account['balance'],
-                    "created_at": account['created_at']
-                }
-            }
+    if format == "ndjson":
+        # Every matching entry, streamed; limit does not apply
+        return StreamingResponse((json.dumps(entry) + "\n" for entry in entries), media_type="application/x-ndjson")
     
-    raise HTTPException(status_code=404, detail="No active account found")
+    transactions, next_cursor = take_page(entries, limit)
+    return {
+        "success": True,
+        "transactions": transactions,
+        "next_cursor": next_cursor
+    }
 
-@app.post("/accounts/deposit")
-def deposit(amount_data: AccountBalanceUpdate, token: str = Depends(verify_token)):
-    username = token['username']
+@endpoint(app.post("/accounts/deposit"))
+def deposit(amount_data: AccountBalanceUpdate, token: str = Depends(verify_token),
+            idempotency_key: Optional[str] = Header(None)):
+    return idempotent(idempotency_key, token['username'], "/accounts/deposit", amount_data,
+                      lambda: apply_deposit(amount_data, token['username']))
+
+def apply_deposit(amount_data: AccountBalanceUpdate, username: str):
     amount = amount_data.amount
     
     if amount <= 0:
         raise HTTPException(status_code=400, detail="Amount must be positive")
     
-    accounts = load_accounts()
-    
-    for account_number, account in accounts.items():
-        if account['username'] == username and account['is_active']:
-            account['balance'] += amount
-            save_accounts(accounts)
-            return {
-                "success": True,
-                "message": f"Deposited ${amount:.2f}",
-                "new_balance": account['balance']
-            }
+    try:
+        account = storage.deposit(username, amount)
+    except AccountNotFound:
+        raise HTTPException(status_code=404, detail="No active account found")
+    except InvalidAmount:
+        raise HTTPException(status_code=400, detail="Amount must be positive")
     
-    raise HTTPException(status_code=404, detail="No active account found")
+    return {
+        "success": True,
+        "message": f"Deposited ${amount:.2f}",
+        "new_balance": account['balance']
+    }
+
+@endpoint(app.post("/accounts/withdraw"))
+def withdraw(amount_data: AccountBalanceUpdate, token: str = Depends(verify_token),
+             idempotency_key: Optional[str] = Header(None)):
+    return idempotent(idempotency_key, token['username'], "/accounts/withdraw", amount_data,
+                      lambda: apply_withdraw(amount_data, token['username']))
 
-@app.post("/accounts/withdraw")
-def withdraw(amount_data: AccountBalanceUpdate, token: str = Depends(verify_token)):
-    username = token['username']
+def apply_withdraw(amount_data: AccountBalanceUpdate, username: str):
     amount = amount_data.amount
     
     if amount <= 0:
         raise HTTPException(status_code=400, detail="Amount must be positive")
     
-    accounts = load_accounts()
-    
-    for account_number, account in accounts.items():
-        if account['username'] == username and account['is_active']:
-            if account['balance'] < amount:
-                raise HTTPException(status_code=400, detail="Insufficient funds")
-            
-            account['balance'] -= amount
-            save_accounts(accounts)
-            return {
-                "success": True,
-                "message": f"Withdrew ${amount:.2f}",
-                "new_balance": account['balance']
-            }
+    try:
+        account = storage.withdraw(username, amount)
+    except AccountNotFound:
+        raise HTTPException(status_code=404, detail="No active account found")
+    except InvalidAmount:
+        raise HTTPException(status_code=400, detail="Amount must be positive")
+    except InsufficientFunds:
+        raise HTTPException(status_code=400, detail="Insufficient funds")
     
-    raise HTTPException(status_code=404, detail="No active account found")
+    return {
+        "success": True,
+        "message": f"Withdrew ${amount:.2f}",
+        "new_balance": account['balance']
+    }
+
+@endpoint(app.post("/accounts/transfer"))
+def transfer(transfer_data: AccountTransfer, token: str = Depends(verify_token),
+             idempotency_key: Optional[str] = Header(None)):
+    return idempotent(idempotency_key, token['username'], "/accounts/transfer", transfer_data,
+                      lambda: apply_transfer(transfer_data, token['username']))
 
-@app.post("/accounts/transfer")
-def transfer(transfer_data: AccountTransfer, token: str = Depends(verify_token)):
-    username = token['username']
+def apply_transfer(transfer_data: AccountTransfer, username: str):
     to_account_number = transfer_data.to_account_number
     amount = transfer_data.amount
     
     if amount <= 0:
         raise HTTPException(status_code=400, detail="Amount must be positive")
     
-    accounts = load_accounts()
-    
-    sender_account = None
-    sender_account_number = None
-    for account_number, account in accounts.items():
-        if account['username'] == username and account['is_active']:
-            sender_account = account
-            sender_account_number = account_number
-            break
-    
-    if not sender_account:
+    try:
+        sender_account = storage.transfer(username, to_account_number, amount)
+    except AccountNotFound:
         raise HTTPException(status_code=404, detail="No active account found")
-    
-    if to_account_number not in accounts:
+    except InvalidAmount:
+        raise HTTPException(status_code=400, detail="Amount must be positive")
+    except RecipientNotFound:
         raise HTTPException(status_code=404, detail="Recipient account not found")
-    
-    recipient_account = accounts[to_account_number]
-    if not recipient_account['is_active']:
+    except RecipientInactive:
         raise HTTPException(status_code=400, detail="Recipient account is not active")
-    
-    if sender_account['balance'] < amount:
+    except InsufficientFunds:
         raise HTTPException(status_code=400, detail="Insufficient funds")
     
-    sender_account['balance'] -= amount
-    recipient_account['balance'] += amount
-    save_accounts(accounts)
-    
     return {
         "success": True,
         "message": f"Transferred ${amount:.2f} to account {to_account_number}",
         "new_balance": sender_account['balance']
     }
 
-@app.post("/accounts/close")
-def close_account(token: str = Depends(verify_token)):
-    username = token['username']
-    accounts = load_accounts()
+@endpoint(app.post("/accounts/batch"))
+def batch(batch_data: AccountBatch, token: str = Depends(verify_token)):
+    operations = [operation.model_dump() for operation in batch_data.operations]
+    if not operations:
+        raise HTTPException(status_code=400, detail="No operations given")
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"A batch can hold at most {MAX_BATCH_OPERATIONS} operations")
+    
+    try:
+        outcomes = storage.apply_batch(token['username'], operations, batch_data.continue_on_error)
+    except AccountNotFound:
+        raise HTTPException(status_code=404, detail="No active account found")
+    except BatchAborted as e:
+        message = BATCH_ERROR_MESSAGES.get(type(e.error), "Operation failed")
+        raise HTTPException(status_code=400, detail=f"Operation {e.index} failed: {message}. No operations were applied")
     
-    for account_number, account in accounts.items():
-        if account['username'] == username and account['is_active']:
-            if account['balance'] > 0:
-                raise HTTPException(status_code=400, detail="Cannot close account with remaining balance. Please withdraw all funds first.")
-            
-            account['is_active'] = False
-            save_accounts(accounts)
-            return {
-                "success": True,
-                "message": "Account closed successfully"
-            }
+    results = []
+    new_balance = None
+    for index, (operation, outcome) in enumerate(zip(operations, outcomes)):
+        if isinstance(outcome, Exception):
+            message = BATCH_ERROR_MESSAGES.get(type(outcome), "Operation failed")
+            results.append({"index": index, "type": operation['type'], "success": False, "message": message})
+        else:
+            new_balance = outcome['balance']
+            results.append({"index": index, "type": operation['type'], "success": True, "new_balance": new_balance})
+    applied = sum(1 for result in results if result['success'])
+    if new_balance is None:
+        new_balance = storage.find_account(token['username'])['balance']
+    
+    return {
+        "success": True,
+        "message": f"Applied {applied} of {len(results)} operations",
+        "results": results,
+        "new_balance": new_balance
+    }
+
+@endpoint(app.post("/accounts/close"))
+def close_account(token: str = Depends(verify_token)):
+    try:
+        storage.close_account(token['username'])
+    except AccountNotFound:
+        raise HTTPException(status_code=404, detail="No active account found")
+    except NonZeroBalance:
+        raise HTTPException(status_code=400, detail="Cannot close account with remaining balance. Please withdraw all funds first.")
     
-    raise HTTPException(status_code=404, detail="No active account found")
+    return {
+        "success": True,
+        "message": "Account closed successfully"
+    }
+
+def verify_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not admin_token_matches(ADMIN_TOKEN, x_admin_token):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@app.get("/admin/export", dependencies=[Depends(verify_admin)])
+async def export_data():
+    exporter = BulkExporter(storage)
+
+    def lines():
+        yield from exporter.lines()
+        print(describe("Exported", exporter.report()), file=sys.stderr)
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@app.post("/admin/import", dependencies=[Depends(verify_admin)])
+async def import_data(request: Request):
+    # The body is consumed as it arrives; each full chunk is parsed and
+    # committed on the storage executor before more is read
+    importer = BulkImporter(storage, account_numbers, password_pool, chunk_size=IMPORT_CHUNK_SIZE)
+    splitter = LineSplitter()
+    async for data in request.stream():
+        for line in splitter.feed(data):
+            if importer.add(line):
+                await run_blocking(importer.flush)
+    for line in splitter.finish():
+        importer.add(line)
+    await run_blocking(importer.flush)
+    report = importer.report()
+    print(describe("Imported", report), file=sys.stderr)
+    return {"success": True, **report}
+
+@app.get("/admin/profile", dependencies=[Depends(verify_admin)])
+async def get_profile(seconds: float = 60.0, format: str = "collapsed", route: Optional[str] = None):
+    if not 0 < seconds <= PROFILE_RETENTION_SECONDS:
+        raise HTTPException(status_code=400, detail=f"Seconds must be between 0 and {PROFILE_RETENTION_SECONDS:g}")
+    if format == "collapsed":
+        return Response(await run_blocking(profiler.collapsed, seconds, route), media_type="text/plain")
+    if format == "text":
+        return Response(await run_blocking(profiler.text, seconds, route), media_type="text/plain")
+    if format == "pstats":
+        return Response(await run_blocking(profiler.pstats, seconds, route), media_type="application/octet-stream",
+                        headers={"Content-Disposition": 'attachment; filename="profile.pstats"'})
+    raise HTTPException(status_code=400, detail="Format must be collapsed, text or pstats")
+
+def serve_worker(sock):
+    """Body of each --workers process: uvicorn on the shared socket"""
+    uvicorn.Server(uvicorn.Config(app)).run(sockets=[sock])
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="127.0.0.1", port=5000)
+    parser = argparse.ArgumentParser(description="FastAPI banking server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=0, help="serve with this many worker processes")
+    args = parser.parse_args()
+
+    if args.workers > 0:
+        shared_storage = None if storage.process_safe else share_storage(storage)
+        try:
+            run_workers(serve_worker, args.workers, args.host, args.port)
+        finally:
+            if shared_storage is not None:
+                remove_shared_storage(shared_storage)
+            storage.close()
+    else:
+        uvicorn.run(app, host=args.host, port=args.port)
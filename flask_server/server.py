@@ -1,26 +1,69 @@
-from flask import Flask, request, jsonify
-import json
+from flask import Flask, Response, g, request, jsonify, stream_with_context
+from werkzeug.serving import make_server
+import argparse
+import contextlib
+import functools
 import os
-import bcrypt
+import json
 import jwt
 import datetime
-import uuid
+import sys
+import time
 from typing import Dict, Any, Optional, Tuple
 from dataclasses import dataclass, asdict
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from shared.accounts import (
+    AccountNotFound, AccountAlreadyExists, AccountNumberTaken, RecipientNotFound, RecipientInactive,
+    InsufficientFunds, NonZeroBalance, InvalidAmount, InvalidOperation, BatchAborted
+)
+from shared.allocator import AccountNumberAllocator
+from shared.bulk import BulkExporter, BulkImporter, admin_token_matches, describe, read_lines
+from shared.config import env_bool, env_float, env_int, env_str
+from shared.history import normalize_timestamp, take_page
+from shared.idempotency import IdempotencyKeyInUse, IdempotencyKeyReused, request_fingerprint, valid_key
+from shared.metrics import CONTENT_TYPE, MetricsRegistry, instrument
+from shared.passwords import PasswordPool, PasswordPoolBusy
+from shared.profiler import RequestProfile, SamplingProfiler, route_label
+from shared.storage import STORAGE_OPERATIONS, open_storage
+from shared.tokens import TokenCache, new_refresh_token, refresh_token_digest
+from shared.workers import connect_shared_storage, remove_shared_storage, run_workers, share_storage
+
 app = Flask(__name__)
 SECRET_KEY = "supersecretkeythatislongenoughtomeetjwtsecurityrequirements256bits"
 USERS_FILE = "users.json"
 ACCOUNTS_FILE = "accounts.json"
+ACCOUNTS_JOURNAL = "accounts.journal"
+ACCOUNTS_HISTORY = "accounts.history"
+STORAGE_BACKEND = env_str("STORAGE_BACKEND", "json")
+SQLITE_PATH = env_str("SQLITE_PATH", "bank.db")
+JOURNAL_FSYNC = env_bool("JOURNAL_FSYNC", True)
+JOURNAL_GROUP_WINDOW_MS = env_float("JOURNAL_GROUP_WINDOW_MS", 0.0)
+JOURNAL_GROUP_SIZE = env_int("JOURNAL_GROUP_SIZE", 256)
+BCRYPT_ROUNDS = env_int("BCRYPT_ROUNDS", 12)
+PASSWORD_POOL_WORKERS = env_int("PASSWORD_POOL_WORKERS", os.cpu_count() or 2)
+PASSWORD_POOL_QUEUE = env_int("PASSWORD_POOL_QUEUE", 32)
+PASSWORD_POOL_PROCESSES = env_bool("PASSWORD_POOL_PROCESSES", False)
+TOKEN_CACHE_SIZE = env_int("TOKEN_CACHE_SIZE", 10000)
+REFRESH_TOKEN_DAYS = env_float("REFRESH_TOKEN_DAYS", 30.0)
+IDEMPOTENCY_CACHE_SIZE = env_int("IDEMPOTENCY_CACHE_SIZE", 10000)
+IDEMPOTENCY_TTL_SECONDS = env_float("IDEMPOTENCY_TTL_SECONDS", 3600.0)
+ACCOUNT_LOCK_STRIPES = env_int("ACCOUNT_LOCK_STRIPES", 256)
+SNAPSHOT_INTERVAL_SECONDS = env_float("SNAPSHOT_INTERVAL_SECONDS", 300.0)
+SNAPSHOT_RECORDS = env_int("SNAPSHOT_RECORDS", 100000)
+ACCOUNT_SHARDS = env_int("ACCOUNT_SHARDS", 1)
+ACCOUNTS_FORMAT = env_str("ACCOUNTS_FORMAT", "json")
+MAX_BATCH_OPERATIONS = env_int("MAX_BATCH_OPERATIONS", 1000)
+TRANSACTIONS_PAGE_SIZE = env_int("TRANSACTIONS_PAGE_SIZE", 50)
+TRANSACTIONS_PAGE_MAX = env_int("TRANSACTIONS_PAGE_MAX", 500)
+ADMIN_TOKEN = env_str("ADMIN_TOKEN", "")
+PROFILE_SAMPLE_RATE = env_float("PROFILE_SAMPLE_RATE", 0.0)
+PROFILE_INTERVAL_MS = env_float("PROFILE_INTERVAL_MS", 5.0)
+PROFILE_RETENTION_SECONDS = env_float("PROFILE_RETENTION_SECONDS", 900.0)
+IMPORT_CHUNK_SIZE = env_int("IMPORT_CHUNK_SIZE", 1000)
+IMPORT_READ_SIZE = 1 << 16
 
-# Initialize data files
-if not os.path.exists(USERS_FILE):
-    with open(USERS_FILE, "w") as f:
-        json.dump({}, f)
-
-if not os.path.exists(ACCOUNTS_FILE):
-    with open(ACCOUNTS_FILE, "w") as f:
-        json.dump({}, f)
 
 @dataclass
 class Account:
@@ -42,27 +85,102 @@ class AccountTransfer:
     to_account_number: str
     amount: float
 
-def load_users() -> Dict[str, str]:
-    with open(USERS_FILE, "r") as f:
-        return json.load(f)
-
-def save_users(users: Dict[str, str]) -> None:
-    with open(USERS_FILE, "w") as f:
-        json.dump(users, f, indent=4)
-
-def load_accounts() -> Dict[str, Dict[str, Any]]:
-    with open(ACCOUNTS_FILE, "r") as f:
-        return json.load(f)
-
-def save_accounts(accounts: Dict[str, Dict[str, Any]]) -> None:
-    with open(ACCOUNTS_FILE, "w") as f:
-        json.dump(accounts, f, indent=4)
+# Worker processes started with --workers use the parent's storage rather than opening the files again
+storage = connect_shared_storage() or open_storage(
+    STORAGE_BACKEND,
+    users_file=USERS_FILE,
+    accounts_file=ACCOUNTS_FILE,
+    journal_file=ACCOUNTS_JOURNAL,
+    history_file=ACCOUNTS_HISTORY,
+    sqlite_path=SQLITE_PATH,
+    fsync=JOURNAL_FSYNC,
+    group_window=JOURNAL_GROUP_WINDOW_MS / 1000,
+    group_size=JOURNAL_GROUP_SIZE,
+    lock_stripes=ACCOUNT_LOCK_STRIPES,
+    snapshot_interval=SNAPSHOT_INTERVAL_SECONDS,
+    snapshot_records=SNAPSHOT_RECORDS,
+    shards=ACCOUNT_SHARDS,
+    snapshot_format=ACCOUNTS_FORMAT,
+    idempotency_size=IDEMPOTENCY_CACHE_SIZE,
+    idempotency_ttl=IDEMPOTENCY_TTL_SECONDS
+)
+startup_summary = storage.startup_summary()
+if startup_summary:
+    print(startup_summary, file=sys.stderr)
+account_numbers = AccountNumberAllocator(lambda number: storage.get_account(number) is not None)
+
+password_pool = PasswordPool(
+    PASSWORD_POOL_WORKERS, PASSWORD_POOL_QUEUE,
+    rounds=BCRYPT_ROUNDS,
+    use_processes=PASSWORD_POOL_PROCESSES
+)
 
 def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+    return password_pool.hash(password)
 
 def check_password(password: str, hashed_password: str) -> bool:
-    return bcrypt.checkpw(password.encode(), hashed_password.encode())
+    return password_pool.check(password, hashed_password)
+
+BATCH_ERROR_MESSAGES = {
+    InvalidOperation: "Unknown operation type",
+    InvalidAmount: "Amount must be positive",
+    InsufficientFunds: "Insufficient funds",
+    RecipientNotFound: "Recipient account not found",
+    RecipientInactive: "Recipient account not found",
+}
+
+def server_busy():
+    return jsonify({"success": False, "message": "Server busy, please retry"}), 503, {"Retry-After": "1"}
+
+token_cache = TokenCache(SECRET_KEY, algorithms=["HS256"], maxsize=TOKEN_CACHE_SIZE)
+profiler = SamplingProfiler(PROFILE_SAMPLE_RATE, PROFILE_INTERVAL_MS / 1000, PROFILE_RETENTION_SECONDS)
+
+metrics = MetricsRegistry()
+request_count = metrics.counter("http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+request_latency = metrics.histogram("http_request_duration_seconds", "HTTP request latency by route and status",
+                                    ("method", "route", "status"))
+storage_latency = metrics.histogram("storage_operation_duration_seconds", "Storage call latency by operation", ("operation",))
+instrument(storage, STORAGE_OPERATIONS, storage_latency)
+metrics.register_stats("storage", storage.stats)
+metrics.register_stats("password_pool", password_pool.stats)
+metrics.register_stats("token_cache", token_cache.stats)
+metrics.register_stats("profiler", profiler.stats)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+def profile_requested() -> bool:
+    """X-Profile: 1 together with the admin token profiles a request whatever the sample rate"""
+    return request.headers.get("X-Profile") == "1" and admin_token_matches(ADMIN_TOKEN, request.headers.get("X-Admin-Token"))
+
+@app.before_request
+def start_profile():
+    # Each request has its own thread, which is sampled until the request is torn down
+    if profiler.should_sample(profile_requested()):
+        profile = RequestProfile()
+        tracking = contextlib.ExitStack()
+        tracking.enter_context(profiler.track_thread(profile))
+        g.profile = (profile, tracking)
+
+@app.teardown_request
+def finish_profile(error):
+    if "profile" not in g:
+        return
+    profile, tracking = g.pop("profile")
+    tracking.close()
+    profiler.finish(profile, route_label(request.method, request.url_rule.rule if request.url_rule is not None else None))
+
+@app.after_request
+def record_metrics(response):
+    path = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    request_count.inc(request.method, path, response.status_code)
+    request_latency.observe(time.perf_counter() - g.request_started, request.method, path, response.status_code)
+    return response
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    return Response(metrics.render(), content_type=CONTENT_TYPE)
 
 def generate_token(username: str) -> str:
     payload = {
@@ -71,22 +189,80 @@ def generate_token(username: str) -> str:
     }
     return jwt.encode(payload, SECRET_KEY, algorithm="HS256")
 
+def issue_refresh_token(username: str) -> str:
+    """Store a new refresh token for the user and return it"""
+    refresh_token = new_refresh_token()
+    storage.add_refresh_token(refresh_token_digest(SECRET_KEY, refresh_token), username,
+                              time.time() + REFRESH_TOKEN_DAYS * 86400)
+    return refresh_token
+
 def verify_token(token: str) -> Optional[str]:
     try:
-        decoded = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+        decoded = token_cache.decode(token)
         return decoded["username"]
     except (jwt.ExpiredSignatureError, jwt.InvalidTokenError):
         return None
 
+def idempotent(view):
+    """Run view once per Idempotency-Key; a retry gets the first response back"""
+    @functools.wraps(view)
+    def wrapper():
+        key = request.headers.get("Idempotency-Key")
+        username = verify_token(request.headers.get("Authorization", "")) if key is not None else None
+        if not username:
+            return view()
+        if not valid_key(key):
+            return jsonify({"success": False, "message": "Idempotency-Key must be 1 to 255 printable characters"}), 400
+
+        response = None
+
+        def capture():
+            nonlocal response
+            response = app.make_response(view())
+            return response.status_code, response.get_json()
+
+        try:
+            status, body, replayed = storage.run_idempotent(
+                username, key, request_fingerprint(request.url_rule.rule, request.get_json(silent=True)), capture
+            )
+        except IdempotencyKeyInUse:
+            return (jsonify({"success": False, "message": "A request with this Idempotency-Key is still in progress"}),
+                    409, {"Retry-After": "1"})
+        except IdempotencyKeyReused:
+            return jsonify({"success": False, "message": "Idempotency-Key was already used for a different request"}), 422
+        if replayed:
+            return jsonify(body), status, {"Idempotent-Replayed": "true"}
+        return response
+    return wrapper
+
 def generate_account_number() -> str:
-    return str(uuid.uuid4().int)[:10]
+    return account_numbers.allocate()
+
+def open_account(username: str, initial_balance: float) -> Dict[str, Any]:
+    # Each worker process allocates numbers on its own, so one can rarely be taken by another first
+    while True:
+        account_number = generate_account_number()
+        try:
+            return storage.create_account(username, account_number, initial_balance)
+        except AccountNumberTaken:
+            continue
+        finally:
+            # Once committed the store's index covers the number; on failure it is free again
+            account_numbers.release([account_number])
+
+def to_account(account_data: Dict[str, Any]) -> Account:
+    return Account(
+        account_number=account_data["account_number"],
+        username=account_data["username"],
+        balance=account_data["balance"],
+        created_at=account_data["created_at"]
+    )
 
 def get_user_account(username: str) -> Optional[Account]:
-    accounts = load_accounts()
-    for account_data in accounts.values():
-        if account_data["username"] == username:
-            return Account(**account_data)
-    return None
+    account_data = storage.find_account(username)
+    if not account_data:
+        return None
+    return to_account(account_data)
 
 @app.route("/register", methods=["POST"])
 def register():
@@ -94,12 +270,16 @@ def register():
     username = data.get("username")
     password = data.get("password")
 
-    users = load_users()
-    if username in users:
+    if storage.get_password_hash(username) is not None:
         return jsonify({"success": False, "message": "User already exists"}), 400
 
-    users[username] = hash_password(password)
-    save_users(users)
+    try:
+        hashed_password = hash_password(password)
+    except PasswordPoolBusy:
+        return server_busy()
+
+    if not storage.add_user(username, hashed_password):
+        return jsonify({"success": False, "message": "User already exists"}), 400
 
     return jsonify({"success": True, "message": "User registered successfully"}), 201
 
@@ -109,12 +289,42 @@ def login():
     username = data.get("username")
     password = data.get("password")
 
-    users = load_users()
-    if username not in users or not check_password(password, users[username]):
-        return jsonify({"success": False, "message": "Invalid credentials"}), 401
+    hashed_password = storage.get_password_hash(username)
+    try:
+        if hashed_password is None or not check_password(password, hashed_password):
+            return jsonify({"success": False, "message": "Invalid credentials"}), 401
+    except PasswordPoolBusy:
+        return server_busy()
 
     token = generate_token(username)
-    return jsonify({"success": True, "message": "Login successful", "token": token})
+    refresh_token = issue_refresh_token(username)
+    return jsonify({"success": True, "message": "Login successful", "token": token, "refresh_token": refresh_token})
+
+@app.route("/token/refresh", methods=["POST"])
+def refresh():
+    # No bcrypt here: one HMAC and one keyed lookup. The presented token is
+    # used up, so a stolen one stops working once its owner refreshes.
+    presented = (request.get_json(silent=True) or {}).get("refresh_token")
+    if not isinstance(presented, str):
+        return jsonify({"success": False, "message": "refresh_token required"}), 400
+    refresh_token = new_refresh_token()
+    username = storage.rotate_refresh_token(
+        refresh_token_digest(SECRET_KEY, presented),
+        refresh_token_digest(SECRET_KEY, refresh_token),
+        time.time() + REFRESH_TOKEN_DAYS * 86400
+    )
+    if username is None:
+        return jsonify({"success": False, "message": "Invalid refresh token"}), 401
+    return jsonify({"success": True, "message": "Token refreshed", "token": generate_token(username),
+                    "refresh_token": refresh_token})
+
+@app.route("/token/revoke", methods=["POST"])
+def revoke():
+    presented = (request.get_json(silent=True) or {}).get("refresh_token")
+    if not isinstance(presented, str):
+        return jsonify({"success": False, "message": "refresh_token required"}), 400
+    storage.revoke_refresh_token(refresh_token_digest(SECRET_KEY, presented))
+    return jsonify({"success": True, "message": "Refresh token revoked"})
 
 @app.route("/protected", methods=["GET"])
 def protected():
@@ -145,28 +355,20 @@ def create_account():
     if initial_balance < 0:
         return jsonify({"success": False, "message": "Initial balance cannot be negative"}), 400
 
-    # Check if user already has an account
-    if get_user_account(username):
+    try:
+        account = open_account(username, initial_balance)
+    except AccountAlreadyExists:
         return jsonify({"success": False, "message": "User already has an account"}), 400
-
-    account_number = generate_account_number()
-    account = Account(
-        account_number=account_number,
-        username=username,
-        balance=initial_balance,
-        created_at=datetime.datetime.utcnow().isoformat()
-    )
-
-    accounts = load_accounts()
-    accounts[account_number] = asdict(account)
-    save_accounts(accounts)
+    except InvalidAmount:
+        return jsonify({"success": False, "message": "Initial balance cannot be negative"}), 400
+    account_number = account["account_number"]
 
     return jsonify({
         "success": True, 
         "message": "Account created successfully",
         "data": {
             "account_number": account_number,
-            "balance": initial_balance
+            "balance": account["balance"]
         }
     })
 
@@ -186,7 +388,51 @@ def get_my_account():
 
     return jsonify({"success": True, "data": asdict(account)})
 
+@app.route("/accounts/transactions", methods=["GET"])
+def get_transactions():
+    token = request.headers.get("Authorization")
+    if not token:
+        return jsonify({"success": False, "message": "Token required"}), 401
+
+    username = verify_token(token)
+    if not username:
+        return jsonify({"success": False, "message": "Invalid token"}), 401
+
+    cursor = request.args.get("cursor")
+    limit = request.args.get("limit", TRANSACTIONS_PAGE_SIZE, type=int)
+    output_format = request.args.get("format", "json")
+    try:
+        after = int(cursor) if cursor is not None else None
+    except ValueError:
+        return jsonify({"success": False, "message": "Invalid cursor"}), 400
+    try:
+        start = normalize_timestamp(request.args["start"]) if "start" in request.args else None
+        end = normalize_timestamp(request.args["end"]) if "end" in request.args else None
+    except ValueError:
+        return jsonify({"success": False, "message": "Dates must be ISO-8601, e.g. 2024-01-31 or 2024-01-31T12:00:00"}), 400
+    if not 1 <= limit <= TRANSACTIONS_PAGE_MAX:
+        return jsonify({"success": False, "message": f"Limit must be between 1 and {TRANSACTIONS_PAGE_MAX}"}), 400
+    if output_format not in ("json", "ndjson"):
+        return jsonify({"success": False, "message": "Format must be json or ndjson"}), 400
+
+    try:
+        entries = storage.list_transactions(username, after=after, start=start, end=end)
+    except AccountNotFound:
+        return jsonify({"success": False, "message": "Account not found"}), 404
+
+    if output_format == "ndjson":
+        # Every matching entry, streamed; limit does not apply
+        return Response(stream_with_context(json.dumps(entry) + "\n" for entry in entries), mimetype="application/x-ndjson")
+
+    transactions, next_cursor = take_page(entries, limit)
+    return jsonify({
+        "success": True,
+        "message": f"{len(transactions)} transactions",
+        "data": {"transactions": transactions, "next_cursor": next_cursor}
+    })
+
 @app.route("/accounts/deposit", methods=["POST"])
+@idempotent
 def deposit():
     token = request.headers.get("Authorization")
     if not token:
@@ -202,14 +448,12 @@ def deposit():
     if amount <= 0:
         return jsonify({"success": False, "message": "Amount must be positive"}), 400
 
-    account = get_user_account(username)
-    if not account:
+    try:
+        account = to_account(storage.deposit(username, amount))
+    except AccountNotFound:
         return jsonify({"success": False, "message": "Account not found"}), 404
-
-    account.balance += amount
-    accounts = load_accounts()
-    accounts[account.account_number] = asdict(account)
-    save_accounts(accounts)
+    except InvalidAmount:
+        return jsonify({"success": False, "message": "Amount must be positive"}), 400
 
     return jsonify({
         "success": True,
@@ -218,6 +462,7 @@ def deposit():
     })
 
 @app.route("/accounts/withdraw", methods=["POST"])
+@idempotent
 def withdraw():
     token = request.headers.get("Authorization")
     if not token:
@@ -233,18 +478,15 @@ def withdraw():
     if amount <= 0:
         return jsonify({"success": False, "message": "Amount must be positive"}), 400
 
-    account = get_user_account(username)
-    if not account:
+    try:
+        account = to_account(storage.withdraw(username, amount))
+    except AccountNotFound:
         return jsonify({"success": False, "message": "Account not found"}), 404
-
-    if account.balance < amount:
+    except InvalidAmount:
+        return jsonify({"success": False, "message": "Amount must be positive"}), 400
+    except InsufficientFunds:
         return jsonify({"success": False, "message": "Insufficient funds"}), 400
 
-    account.balance -= amount
-    accounts = load_accounts()
-    accounts[account.account_number] = asdict(account)
-    save_accounts(accounts)
-
     return jsonify({
         "success": True,
         "message": f"Withdrew ${amount:.2f}",
@@ -252,6 +494,7 @@ def withdraw():
     })
 
 @app.route("/accounts/transfer", methods=["POST"])
+@idempotent
 def transfer():
     token = request.headers.get("Authorization")
     if not token:
@@ -271,36 +514,70 @@ def transfer():
     if not to_account_number:
         return jsonify({"success": False, "message": "Recipient account number required"}), 400
 
-    accounts = load_accounts()
-    
-    # Get sender account
-    sender_account = get_user_account(username)
-    if not sender_account:
+    try:
+        sender_account = to_account(storage.transfer(username, to_account_number, amount))
+    except AccountNotFound:
         return jsonify({"success": False, "message": "Account not found"}), 404
-
-    # Get recipient account
-    if to_account_number not in accounts:
+    except InvalidAmount:
+        return jsonify({"success": False, "message": "Amount must be positive"}), 400
+    except (RecipientNotFound, RecipientInactive):
         return jsonify({"success": False, "message": "Recipient account not found"}), 404
-
-    if sender_account.balance < amount:
+    except InsufficientFunds:
         return jsonify({"success": False, "message": "Insufficient funds"}), 400
 
-    # Perform transfer
-    sender_account.balance -= amount
-    recipient_account_data = accounts[to_account_number]
-    recipient_account_data["balance"] += amount
-
-    # Save changes
-    accounts[sender_account.account_number] = asdict(sender_account)
-    accounts[to_account_number] = recipient_account_data
-    save_accounts(accounts)
-
     return jsonify({
         "success": True,
         "message": f"Transferred ${amount:.2f} to account {to_account_number}",
         "data": {"new_balance": sender_account.balance}
     })
 
+@app.route("/accounts/batch", methods=["POST"])
+def batch():
+    token = request.headers.get("Authorization")
+    if not token:
+        return jsonify({"success": False, "message": "Token required"}), 401
+
+    username = verify_token(token)
+    if not username:
+        return jsonify({"success": False, "message": "Invalid token"}), 401
+
+    data = request.json
+    operations = data.get("operations")
+    continue_on_error = bool(data.get("continue_on_error", False))
+
+    if not isinstance(operations, list) or not operations:
+        return jsonify({"success": False, "message": "Operations list required"}), 400
+
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        return jsonify({"success": False, "message": f"A batch can hold at most {MAX_BATCH_OPERATIONS} operations"}), 400
+
+    if not all(isinstance(operation, dict) for operation in operations):
+        return jsonify({"success": False, "message": "Each operation must be an object"}), 400
+
+    try:
+        outcomes = storage.apply_batch(username, operations, continue_on_error)
+    except AccountNotFound:
+        return jsonify({"success": False, "message": "Account not found"}), 404
+    except BatchAborted as e:
+        message = BATCH_ERROR_MESSAGES.get(type(e.error), "Operation failed")
+        return jsonify({"success": False, "message": f"Operation {e.index} failed: {message}. No operations were applied"}), 400
+
+    results = []
+    for index, (operation, outcome) in enumerate(zip(operations, outcomes)):
+        if isinstance(outcome, Exception):
+            message = BATCH_ERROR_MESSAGES.get(type(outcome), "Operation failed")
+            results.append({"index": index, "type": operation.get("type"), "success": False, "message": message})
+        else:
+            results.append({"index": index, "type": operation.get("type"), "success": True, "new_balance": outcome["balance"]})
+    applied = sum(1 for result in results if result["success"])
+    account = get_user_account(username)
+
+    return jsonify({
+        "success": True,
+        "message": f"Applied {applied} of {len(results)} operations",
+        "data": {"results": results, "new_balance": account.balance if account else None}
+    })
+
 @app.route("/accounts/close", methods=["POST"])
 def close_account():
     token = request.headers.get("Authorization")
@@ -311,18 +588,93 @@ def close_account():
     if not username:
         return jsonify({"success": False, "message": "Invalid token"}), 401
 
-    account = get_user_account(username)
-    if not account:
+    try:
+        storage.close_account(username, remove=True)
+    except AccountNotFound:
         return jsonify({"success": False, "message": "Account not found"}), 404
-
-    if account.balance > 0:
+    except NonZeroBalance:
         return jsonify({"success": False, "message": "Account must have zero balance to be closed"}), 400
 
-    accounts = load_accounts()
-    del accounts[account.account_number]
-    save_accounts(accounts)
-
     return jsonify({"success": True, "message": "Account closed successfully"})
 
+
+def admin_error():
+    if not ADMIN_TOKEN:
+        return jsonify({"success": False, "message": "Not found"}), 404
+    if not admin_token_matches(ADMIN_TOKEN, request.headers.get("X-Admin-Token")):
+        return jsonify({"success": False, "message": "Invalid admin token"}), 403
+    return None
+
+@app.route("/admin/export", methods=["GET"])
+def export_data():
+    error = admin_error()
+    if error:
+        return error
+
+    exporter = BulkExporter(storage)
+
+    def lines():
+        yield from exporter.lines()
+        print(describe("Exported", exporter.report()), file=sys.stderr)
+
+    return Response(stream_with_context(lines()), mimetype="application/x-ndjson")
+
+@app.route("/admin/import", methods=["POST"])
+def import_data():
+    error = admin_error()
+    if error:
+        return error
+
+    # Read the body as it arrives instead of buffering it; run() commits every full chunk
+    importer = BulkImporter(storage, account_numbers, password_pool, chunk_size=IMPORT_CHUNK_SIZE)
+    report = importer.run(read_lines(iter(lambda: request.stream.read(IMPORT_READ_SIZE), b"")))
+    print(describe("Imported", report), file=sys.stderr)
+    return jsonify({"success": True, "message": describe("Imported", report), "data": report})
+
+@app.route("/admin/profile", methods=["GET"])
+def get_profile():
+    error = admin_error()
+    if error:
+        return error
+
+    try:
+        seconds = float(request.args.get("seconds", 60))
+    except ValueError:
+        seconds = 0
+    if not 0 < seconds <= PROFILE_RETENTION_SECONDS:
+        return jsonify({"success": False, "message": f"Seconds must be between 0 and {PROFILE_RETENTION_SECONDS:g}"}), 400
+    route = request.args.get("route")
+    format = request.args.get("format", "collapsed")
+    if format == "collapsed":
+        return Response(profiler.collapsed(seconds, route), mimetype="text/plain")
+    if format == "text":
+        return Response(profiler.text(seconds, route), mimetype="text/plain")
+    if format == "pstats":
+        return Response(profiler.pstats(seconds, route), mimetype="application/octet-stream",
+                        headers={"Content-Disposition": 'attachment; filename="profile.pstats"'})
+    return jsonify({"success": False, "message": "Format must be collapsed, text or pstats"}), 400
+
+def serve_worker(sock):
+    """Body of each --workers process: a threaded WSGI server on the shared socket"""
+    host, port = sock.getsockname()[:2]
+    make_server(host, port, app, threaded=True, fd=sock.fileno()).serve_forever()
+
 if __name__ == "__main__":
-    app.run(debug=True)
+    parser = argparse.ArgumentParser(description="Flask banking server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=0,
+                        help="serve with this many worker processes instead of the debug server")
+    args = parser.parse_args()
+
+    if args.workers > 0:
+        shared_storage = None if storage.process_safe else share_storage(storage)
+        try:
+            run_workers(serve_worker, args.workers, args.host, args.port)
+        finally:
+            if shared_storage is not None:
+                remove_shared_storage(shared_storage)
+            storage.close()
+    else:
+        # The reloader would run this module, and so open storage, in a second process
+        app.run(host=args.host, port=args.port, debug=True, threaded=True, use_reloader=False)
@@ -0,0 +1,52 @@
+"""Rewrite the JSON backend's account snapshot for a new shard count.
+
+Stop the server first; the accounts lock keeps the two from running at
+once. Loads the snapshot and journal from the current directory, folds the
+journal in and writes every account into the new layout, so the server can
+then be started with the same ACCOUNT_SHARDS.
+
+    python reshard.py --shards 16
+    python reshard.py --shards 1      # back to a single accounts.json
+
+A server started with a different ACCOUNT_SHARDS than the files on disk
+still loads them and rebalances at its first snapshot; this does it up
+front, without waiting for one.
+"""
+import argparse
+import sys
+import time
+from typing import List, Optional
+
+from shared.config import env_bool, env_int, env_str
+from shared.storage import JsonStorage
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Change the number of account snapshot shards")
+    parser.add_argument("--shards", type=int, default=env_int("ACCOUNT_SHARDS", 1))
+    args = parser.parse_args(argv)
+    if args.shards < 1 or args.shards > 999:
+        parser.error("--shards must be between 1 and 999")
+    if env_str("ACCOUNTS_FORMAT", "json") != "json":
+        parser.error("shards apply to the JSON snapshot format; the binary balance file is not sharded")
+
+    storage = JsonStorage(
+        "users.json", "accounts.json", "accounts.journal", "accounts.history",
+        fsync=env_bool("JOURNAL_FSYNC", True),
+        shards=args.shards
+    )
+    try:
+        store = storage.accounts
+        print(storage.startup_summary(), file=sys.stderr)
+        started = time.perf_counter()
+        store.snapshotter.snapshot()
+        stats = store.snapshotter.stats()
+        print(f"Wrote {len(store.accounts)} accounts to {stats['snapshot_shards_written']} of "
+              f"{args.shards} shards ({stats['snapshot_bytes_written']} bytes) in "
+              f"{time.perf_counter() - started:.3f}s", file=sys.stderr)
+    finally:
+        storage.close()
+
+
+if __name__ == "__main__":
+    main()
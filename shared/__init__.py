@@ -0,0 +1 @@
+"""Storage and runtime helpers shared by the Flask and FastAPI servers"""
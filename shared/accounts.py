@@ -0,0 +1,454 @@
+import datetime
+import itertools
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+from shared.history import HistoryLog
+from shared.journal import Journal
+from shared.locks import LockStripes
+from shared.snapshot import Snapshotter, open_snapshot
+
+
+class AccountError(Exception):
+    """Raised when an account operation cannot be applied"""
+
+
+class AccountNotFound(AccountError):
+    pass
+
+
+class AccountAlreadyExists(AccountError):
+    pass
+
+
+class AccountNumberTaken(AccountError):
+    """The account number was allocated elsewhere (another worker process) first"""
+
+
+class RecipientNotFound(AccountError):
+    pass
+
+
+class RecipientInactive(AccountError):
+    pass
+
+
+class InsufficientFunds(AccountError):
+    pass
+
+
+class NonZeroBalance(AccountError):
+    pass
+
+
+class InvalidAmount(AccountError):
+    pass
+
+
+class InvalidOperation(AccountError):
+    pass
+
+
+class BatchAborted(AccountError):
+    """Raised when an operation in an all-or-nothing batch fails; nothing was applied"""
+
+    def __init__(self, index: int, error: AccountError):
+        super().__init__(index, error)
+        self.index = index
+        self.error = error
+
+
+BATCH_OPERATIONS = ("deposit", "withdraw", "transfer")
+
+
+def is_active(account: Dict[str, Any]) -> bool:
+    # Flask-created accounts predate the is_active flag and are deleted on close
+    return account.get("is_active", True)
+
+
+def round_cents(amount: float) -> float:
+    """Round to whole cents, the precision balances are kept at"""
+    return round(amount * 100) / 100
+
+
+def opening_balance(amount: float) -> float:
+    """Validate an initial balance (finite, not negative) and round it to whole cents"""
+    if isinstance(amount, bool) or not isinstance(amount, (int, float)) or not math.isfinite(amount) or amount < 0:
+        raise InvalidAmount(amount)
+    return round_cents(amount)
+
+
+def _add(account: Dict[str, Any], amount: float) -> None:
+    # Rounding every result keeps repeated updates from drifting off the cent
+    account["balance"] = round_cents(account["balance"] + amount)
+
+
+def apply_record(accounts: Dict[str, Dict[str, Any]], record: Dict[str, Any]) -> None:
+    """Apply one journal record to an account_number -> account map"""
+    op = record["op"]
+    if op == "create":
+        account = dict(record["account"])
+        accounts[account["account_number"]] = account
+    elif op == "deposit":
+        _add(accounts[record["account_number"]], record["amount"])
+    elif op == "withdraw":
+        _add(accounts[record["account_number"]], -record["amount"])
+    elif op == "transfer":
+        _add(accounts[record["from_account_number"]], -record["amount"])
+        _add(accounts[record["to_account_number"]], record["amount"])
+    elif op == "close":
+        if record.get("remove"):
+            del accounts[record["account_number"]]
+        else:
+            accounts[record["account_number"]]["is_active"] = False
+    elif op == "batch":
+        for child in record["records"]:
+            apply_record(accounts, child)
+    else:
+        raise ValueError(f"Unknown journal operation: {op}")
+
+
+def touched_accounts(record: Dict[str, Any]) -> Iterator[str]:
+    """Yield the account numbers a journal record changes"""
+    op = record["op"]
+    if op == "batch":
+        for child in record["records"]:
+            yield from touched_accounts(child)
+    elif op == "transfer":
+        yield record["from_account_number"]
+        yield record["to_account_number"]
+    elif op == "create":
+        yield record["account"]["account_number"]
+    else:
+        yield record["account_number"]
+
+
+def apply_logged(accounts: Dict[str, Dict[str, Any]], record: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Apply a journal record like apply_record and return its transaction history entries"""
+    op = record["op"]
+    if op == "batch":
+        entries = []
+        for child in record["records"]:
+            entries.extend(apply_logged(accounts, child))
+        return entries
+    if op == "close":
+        account_number = record["account_number"]
+        entries = [{"account_number": account_number, "type": "close", "amount": 0.0,
+                    "balance": accounts[account_number]["balance"]}]
+        apply_record(accounts, record)
+        return entries
+
+    apply_record(accounts, record)
+    if op == "create":
+        account = record["account"]
+        return [{"account_number": account["account_number"], "type": "open",
+                 "amount": account["balance"], "balance": account["balance"]}]
+    if op == "transfer":
+        sender, recipient = record["from_account_number"], record["to_account_number"]
+        return [
+            {"account_number": sender, "type": "transfer_out", "amount": record["amount"],
+             "balance": accounts[sender]["balance"], "counterparty": recipient},
+            {"account_number": recipient, "type": "transfer_in", "amount": record["amount"],
+             "balance": accounts[recipient]["balance"], "counterparty": sender}
+        ]
+    account_number = record["account_number"]
+    return [{"account_number": account_number, "type": op, "amount": record["amount"],
+             "balance": accounts[account_number]["balance"]}]
+
+
+def plan_operation(accounts: Dict[str, Dict[str, Any]], account_number: str, operation: Dict[str, Any]) -> Dict[str, Any]:
+    """Validate a deposit/withdraw/transfer against accounts and build its journal record.
+
+    accounts must contain the acting account and, for transfers, the
+    recipient if it exists.
+    """
+    kind = operation.get("type")
+    if kind not in BATCH_OPERATIONS:
+        raise InvalidOperation(kind)
+    amount = operation.get("amount")
+    if (isinstance(amount, bool) or not isinstance(amount, (int, float)) or not math.isfinite(amount)
+            or round_cents(amount) <= 0):
+        raise InvalidAmount(amount)
+    amount = round_cents(amount)
+
+    account = accounts[account_number]
+    if kind == "deposit":
+        return {"op": "deposit", "account_number": account_number, "amount": amount}
+    if kind == "transfer":
+        to_account_number = operation.get("to_account_number")
+        recipient = accounts.get(to_account_number)
+        if recipient is None:
+            raise RecipientNotFound(to_account_number)
+        if not is_active(recipient):
+            raise RecipientInactive(to_account_number)
+    if account["balance"] < amount:
+        raise InsufficientFunds(account_number)
+    if kind == "withdraw":
+        return {"op": "withdraw", "account_number": account_number, "amount": amount}
+    return {
+        "op": "transfer",
+        "from_account_number": account_number,
+        "to_account_number": to_account_number,
+        "amount": amount
+    }
+
+
+def run_batch(accounts: Dict[str, Dict[str, Any]], account_number: str, operations: List[Dict[str, Any]],
+              continue_on_error: bool = False):
+    """Plan a batch of operations against a scratch copy of the involved accounts.
+
+    Returns (records, outcomes) where outcomes holds, per operation, the
+    account as it stands after that operation or the AccountError that
+    rejected it. Without continue_on_error the first failure raises
+    BatchAborted and nothing is returned to commit.
+    """
+    working = {account_number: dict(accounts[account_number])}
+    for operation in operations:
+        to_account_number = operation.get("to_account_number")
+        if to_account_number in accounts and to_account_number not in working:
+            working[to_account_number] = dict(accounts[to_account_number])
+
+    records: List[Dict[str, Any]] = []
+    outcomes: List[Union[Dict[str, Any], AccountError]] = []
+    for index, operation in enumerate(operations):
+        try:
+            record = plan_operation(working, account_number, operation)
+        except AccountError as e:
+            if not continue_on_error:
+                raise BatchAborted(index, e)
+            outcomes.append(e)
+            continue
+        apply_record(working, record)
+        records.append(record)
+        outcomes.append(dict(working[account_number]))
+    return records, outcomes
+
+
+class AccountStore:
+    """Resident account map rebuilt from the last snapshot plus the journal.
+
+    Every mutation is queued on the journal as one compact record and applied
+    in memory; the call returns once the group commit carrying the record is
+    durable. A background Snapshotter folds the journal into the snapshot
+    so startup only replays the segments written since the last snapshot.
+    With shards > 1 the snapshot is split by a hash of account_number and a
+    snapshot rewrites only the shards its records touched; the journal stays
+    one stream, so a transfer between shards is still one atomic record.
+    snapshot_format="binary" keeps the snapshot in a BalanceFile instead,
+    where a snapshot patches the touched fixed-size records in place.
+
+    Mutations validate and apply under striped per-account locks (plus a
+    per-username stripe for create and close), so operations on unrelated
+    accounts run in parallel and the durability wait happens after the locks
+    are released.
+    """
+
+    def __init__(self, snapshot_path: str, journal_path: str, history_path: str, fsync: bool = True,
+                 group_window: float = 0.0, group_size: int = 256, lock_stripes: int = 256,
+                 snapshot_interval: float = 0.0, snapshot_records: int = 0, shards: int = 1,
+                 snapshot_format: str = "json"):
+        started = time.perf_counter()
+        self.locks = LockStripes(lock_stripes)
+        self._commit_lock = threading.Lock()
+        self.snapshot = open_snapshot(snapshot_path, snapshot_format, shards)
+        self.snapshot_path = self.snapshot.path
+        covered, self.accounts, self.snapshot_bytes_read = self.snapshot.load()
+        self.history = HistoryLog(history_path)
+        last_txid = self.history.last_txid
+
+        self.journal = Journal(journal_path, fsync=fsync, group_window=group_window, group_size=group_size,
+                               first_segment=covered + 1)
+        # Segments left behind by a crash between writing a snapshot and deleting them
+        self.journal.remove_segments(covered)
+        self.replayed_records = 0
+        for record in self.journal.replay(after=covered):
+            entries = apply_logged(self.accounts, record)
+            self.replayed_records += 1
+            txid = record.get("txid")
+            if txid is None:
+                continue
+            # History entries are flushed lazily, so a crash can lose the newest ones
+            if txid > self.history.last_txid:
+                self.history.append(txid, record["at"], entries)
+            last_txid = max(last_txid, txid)
+        self._txids = itertools.count(last_txid + 1)
+
+        self.by_username: Dict[str, str] = {}
+        for account_number, account in self.accounts.items():
+            if is_active(account):
+                self.by_username[account["username"]] = account_number
+        self.load_seconds = time.perf_counter() - started
+
+        self.snapshotter = Snapshotter(
+            self.snapshot, self.journal, apply_record, touched_accounts,
+            interval=snapshot_interval,
+            max_records=snapshot_records,
+            backlog=self.replayed_records,
+            fsync=fsync,
+            before_remove=self.history.sync
+        )
+        self.snapshotter.start()
+
+    def get(self, account_number: str) -> Optional[Dict[str, Any]]:
+        account = self.accounts.get(account_number)
+        return dict(account) if account else None
+
+    def find_active(self, username: str) -> Optional[Dict[str, Any]]:
+        account_number = self.by_username.get(username)
+        if account_number is None:
+            return None
+        return dict(self.accounts[account_number])
+
+    @contextmanager
+    def _locked_account(self, username: str, *keys: str) -> Iterator[Dict[str, Any]]:
+        """Lock the user's active account (and any extra keys) and yield it"""
+        while True:
+            account_number = self.by_username.get(username)
+            if account_number is None:
+                raise AccountNotFound(username)
+            with self.locks.hold(account_number, *keys):
+                # The account may have been closed while we waited for the lock
+                if self.by_username.get(username) == account_number:
+                    yield self.accounts[account_number]
+                    return
+
+    def _commit(self, record: Dict[str, Any]) -> int:
+        # One short critical section keeps journal order, txid order and
+        # history order identical, which is what recovery relies on
+        with self._commit_lock:
+            record["txid"] = next(self._txids)
+            record["at"] = datetime.datetime.utcnow().isoformat()
+            seq = self.journal.submit(record)
+            entries = apply_logged(self.accounts, record)
+            self.history.append(record["txid"], record["at"], entries)
+        return seq
+
+    def create(self, username: str, account_number: str, initial_balance: float) -> Dict[str, Any]:
+        initial_balance = opening_balance(initial_balance)
+        with self.locks.hold("user:" + username, account_number):
+            if username in self.by_username:
+                raise AccountAlreadyExists(username)
+            if account_number in self.accounts:
+                raise AccountNumberTaken(account_number)
+            account = {
+                "account_number": account_number,
+                "username": username,
+                "balance": initial_balance,
+                "is_active": True,
+                "created_at": datetime.datetime.utcnow().isoformat()
+            }
+            seq = self._commit({"op": "create", "account": account})
+            self.by_username[username] = account_number
+        self.journal.wait(seq)
+        return dict(account)
+
+    def _apply_operation(self, username: str, operation: Dict[str, Any], *keys: str) -> Dict[str, Any]:
+        with self._locked_account(username, *keys) as account:
+            record = plan_operation(self.accounts, account["account_number"], operation)
+            seq = self._commit(record)
+            result = dict(account)
+        self.journal.wait(seq)
+        return result
+
+    def deposit(self, username: str, amount: float) -> Dict[str, Any]:
+        return self._apply_operation(username, {"type": "deposit", "amount": amount})
+
+    def withdraw(self, username: str, amount: float) -> Dict[str, Any]:
+        return self._apply_operation(username, {"type": "withdraw", "amount": amount})
+
+    def transfer(self, username: str, to_account_number: str, amount: float) -> Dict[str, Any]:
+        operation = {"type": "transfer", "to_account_number": to_account_number, "amount": amount}
+        return self._apply_operation(username, operation, to_account_number)
+
+    def batch(self, username: str, operations: List[Dict[str, Any]], continue_on_error: bool = False):
+        """Apply a list of operations under one lock acquisition and one journal record"""
+        recipients = [op["to_account_number"] for op in operations if isinstance(op.get("to_account_number"), str)]
+        seq = None
+        with self._locked_account(username, *recipients) as account:
+            records, outcomes = run_batch(self.accounts, account["account_number"], operations, continue_on_error)
+            if records:
+                seq = self._commit({"op": "batch", "records": records})
+        if seq is not None:
+            self.journal.wait(seq)
+        return outcomes
+
+    def close(self, username: str, remove: bool = False) -> Dict[str, Any]:
+        """Deactivate the user's account, or drop it entirely when remove is set"""
+        with self._locked_account(username, "user:" + username) as account:
+            if account["balance"] > 0:
+                raise NonZeroBalance(account["account_number"])
+            closed = dict(account)
+            seq = self._commit({"op": "close", "account_number": account["account_number"], "remove": remove})
+            del self.by_username[username]
+        self.journal.wait(seq)
+        return closed
+
+    def load(self, accounts: List[Dict[str, Any]]) -> List[str]:
+        """Add complete accounts (bulk import) under one journal record.
+
+        Accounts whose number is taken, and active accounts for users that
+        already have one, are skipped. Returns the numbers that were added.
+        """
+        keys = [account["account_number"] for account in accounts]
+        keys += ["user:" + account["username"] for account in accounts]
+        with self.locks.hold(*keys):
+            records = []
+            numbers = set()
+            usernames = set()
+            for account in accounts:
+                account_number, username = account["account_number"], account["username"]
+                if account_number in self.accounts or account_number in numbers:
+                    continue
+                if is_active(account):
+                    if username in self.by_username or username in usernames:
+                        continue
+                    usernames.add(username)
+                numbers.add(account_number)
+                records.append({"op": "create", "account": dict(account, balance=round_cents(account["balance"]))})
+            if not records:
+                return []
+            seq = self._commit({"op": "batch", "records": records})
+            for record in records:
+                if is_active(record["account"]):
+                    self.by_username[record["account"]["username"]] = record["account"]["account_number"]
+        self.journal.wait(seq)
+        return [record["account"]["account_number"] for record in records]
+
+    def iter_accounts(self) -> Iterator[Dict[str, Any]]:
+        """Yield a copy of every account; accounts added meanwhile may be missed"""
+        for account_number in list(self.accounts):
+            account = self.accounts.get(account_number)
+            if account is not None:
+                yield dict(account)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {
+            "accounts": len(self.accounts),
+            "active_accounts": len(self.by_username),
+            "load_seconds": self.load_seconds,
+            "replayed_records": self.replayed_records,
+            "snapshot_bytes_read": self.snapshot_bytes_read
+        }
+        stats.update(self.snapshotter.stats())
+        for key, value in self.history.stats().items():
+            stats["history_" + key] = value
+        for key, value in self.journal.stats().items():
+            stats["journal_" + key] = value
+        return stats
+
+    def transactions(self, username: str, after: Optional[int] = None, start: Optional[str] = None,
+                     end: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """Yield the history of the user's active account, oldest first"""
+        account_number = self.by_username.get(username)
+        if account_number is None:
+            raise AccountNotFound(username)
+        return self.history.query(account_number, after=after, start=start, end=end)
+
+    def shutdown(self) -> None:
+        self.snapshotter.stop()
+        self.snapshot.close()
+        self.journal.close()
+        self.history.close()
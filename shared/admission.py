@@ -0,0 +1,153 @@
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional
+
+# Smoothing of the per-request service time used to predict queue waits
+SERVICE_TIME_WEIGHT = 0.1
+
+_deadline: "contextvars.ContextVar[Optional[float]]" = contextvars.ContextVar("deadline", default=None)
+
+
+class AdmissionRejected(Exception):
+    """The request cannot start before its deadline"""
+
+
+class DeadlineExceeded(Exception):
+    """Queued work reached a worker after its request's deadline"""
+
+
+class AdmissionGate:
+    """In-flight limit for one class of routes, with a bounded FIFO wait.
+
+    Up to limit requests run at once; the next queue_depth wait for a slot,
+    in arrival order, until their deadline. A request is turned away at
+    once when the queue is full or when the wait predicted from the recent
+    service time would already overrun its deadline, so a client is told
+    to back off instead of timing out in line. Used from one event loop
+    only, so it needs no lock.
+    """
+
+    def __init__(self, name: str, limit: int, queue_depth: int):
+        self.name = name
+        self.limit = limit
+        self.queue_depth = queue_depth
+        self._in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._service_time = 0.0
+        self._admitted = 0
+        self._rejected_full = 0
+        self._rejected_deadline = 0
+
+    async def enter(self, deadline: float) -> None:
+        """Wait for a slot until deadline (time.monotonic()), raising AdmissionRejected if none frees up"""
+        if self._in_flight < self.limit and not self._waiters:
+            self._in_flight += 1
+            self._admitted += 1
+            return
+        if len(self._waiters) >= self.queue_depth:
+            self._rejected_full += 1
+            raise AdmissionRejected(self.name)
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or (len(self._waiters) + 1) * self._service_time / self.limit > remaining:
+            self._rejected_deadline += 1
+            raise AdmissionRejected(self.name)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, remaining)
+        except asyncio.TimeoutError:
+            pass
+        except BaseException:
+            self._abandon(waiter)
+            raise
+        if waiter.cancelled():
+            self._abandon(waiter)
+            self._rejected_deadline += 1
+            raise AdmissionRejected(self.name)
+        # _release() handed this request its slot, so _in_flight already counts it
+        self._admitted += 1
+
+    def _abandon(self, waiter: asyncio.Future) -> None:
+        if waiter.done() and not waiter.cancelled():
+            # Given a slot just as the wait was cut short; pass it on
+            self._release()
+        elif waiter in self._waiters:
+            self._waiters.remove(waiter)
+
+    def _release(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._in_flight -= 1
+
+    def leave(self, service_time: float) -> None:
+        self._service_time += SERVICE_TIME_WEIGHT * (service_time - self._service_time)
+        self._release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "queue_depth": self.queue_depth,
+            "in_flight": self._in_flight,
+            "queued": len(self._waiters),
+            "admitted": self._admitted,
+            "rejected_queue_full": self._rejected_full,
+            "rejected_deadline": self._rejected_deadline,
+            "service_seconds_avg": self._service_time
+        }
+
+
+class AdmissionController:
+    """Admission gates by route class, and the deadline of the request being served.
+
+    admit() runs a request through its class's gate and makes its deadline
+    current, so before_deadline() can drop blocking work that only reaches
+    a worker thread after the deadline: nobody is waiting for its answer
+    by then.
+    """
+
+    def __init__(self, gates: Dict[str, AdmissionGate], deadline: float):
+        self.gates = gates
+        self.deadline = deadline
+        self._expired = 0
+        self._lock = threading.Lock()
+
+    async def admit(self, route_class: str, call: Callable[[], Any]) -> Any:
+        gate = self.gates.get(route_class)
+        if gate is None:
+            return await call()
+        deadline = time.monotonic() + self.deadline
+        await gate.enter(deadline)
+        token = _deadline.set(deadline)
+        started = time.monotonic()
+        try:
+            return await call()
+        finally:
+            _deadline.reset(token)
+            gate.leave(time.monotonic() - started)
+
+    def before_deadline(self, func: Callable) -> Callable:
+        """func, failing with DeadlineExceeded instead of running once the current request's deadline has passed"""
+        deadline = _deadline.get()
+        if deadline is None:
+            return func
+
+        @functools.wraps(func)
+        def guarded(*args, **kwargs):
+            if time.monotonic() > deadline:
+                with self._lock:
+                    self._expired += 1
+                raise DeadlineExceeded()
+            return func(*args, **kwargs)
+        return guarded
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"deadline_seconds": self.deadline, "expired_in_queue": self._expired}
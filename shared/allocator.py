@@ -0,0 +1,63 @@
+import random
+import threading
+from typing import Callable, Iterable, List
+
+
+class AccountNumberAllocator:
+    """Hands out unique random account numbers without rereading the store.
+
+    Candidates are checked against the store's own account index through the
+    contains callback and against an in-memory set of numbers already handed
+    out, so two requests can never be given the same number even before
+    either account is committed. Each allocation costs O(1) expected lookups
+    while the number space stays sparse.
+
+    reserve() takes a whole block at once for bulk onboarding and claim()
+    marks numbers chosen elsewhere (an import file) as taken. Callers
+    release() numbers once their accounts are committed, when the store's
+    index takes over, or once the attempt failed, so the set only holds
+    numbers still in flight.
+    """
+
+    def __init__(self, contains: Callable[[str], bool], digits: int = 10):
+        self.contains = contains
+        self._low = 10 ** (digits - 1)
+        self._high = 10 ** digits
+        self._issued = set()
+        self._lock = threading.Lock()
+        self._random = random.SystemRandom()
+
+    def allocate(self) -> str:
+        return self.reserve(1)[0]
+
+    def reserve(self, count: int) -> List[str]:
+        numbers = []
+        while len(numbers) < count:
+            number = str(self._random.randrange(self._low, self._high))
+            if self.contains(number):
+                continue
+            with self._lock:
+                if number in self._issued:
+                    continue
+                self._issued.add(number)
+            numbers.append(number)
+        return numbers
+
+    def claim(self, numbers: Iterable[str]) -> List[str]:
+        """Mark the given numbers as handed out; returns those that were not already"""
+        claimed = []
+        with self._lock:
+            for number in numbers:
+                if number not in self._issued:
+                    self._issued.add(number)
+                    claimed.append(number)
+        return claimed
+
+    def release(self, numbers: Iterable[str]) -> None:
+        """Forget numbers whose accounts were committed or never created"""
+        with self._lock:
+            self._issued.difference_update(numbers)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._issued)
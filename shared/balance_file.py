@@ -0,0 +1,343 @@
+"""Fixed-record binary account snapshot, updated in place through mmap.
+
+Layout of <accounts>.bin:
+
+    header   64 bytes: magic, version, record size, journal segment covered,
+             number of slots
+    slots    RECORD_SIZE bytes each: account number (ASCII, NUL padded),
+             owner id, flags, balance in integer cents, created_at in
+             microseconds since the epoch
+
+Owner ids index <accounts>.bin.owners, an append-only file of JSON-encoded
+usernames, one per line. The account_number -> slot index is rebuilt in
+memory when the file is opened.
+
+A snapshot changes only the slots its journal records touched, and a
+balance-only change is a single 8-byte write at a known offset. The writes
+go to <accounts>.bin.redo first, so a crash halfway through patching the
+mapped file is finished on the next open instead of leaving a mix of old
+and new slots.
+"""
+import datetime
+import json
+import mmap
+import os
+import struct
+import zlib
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+MAGIC = b"BANKBAL\x00"
+VERSION = 1
+HEADER = struct.Struct("<8sIIqq")
+HEADER_SIZE = 64
+RECORD = struct.Struct("<24sIIqq")
+RECORD_SIZE = RECORD.size
+BALANCE_OFFSET = 32
+NUMBER_SIZE = 24
+FLAG_USED = 1
+FLAG_ACTIVE = 2
+FLAG_CREATED = 4
+# Slots are added in blocks so the file is not remapped for every new account
+GROW_SLOTS = 4096
+REDO_HEADER = struct.Struct("<qqI")
+REDO_PATCH = struct.Struct("<qH")
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def _to_micros(timestamp: str) -> int:
+    return (datetime.datetime.fromisoformat(timestamp) - EPOCH) // datetime.timedelta(microseconds=1)
+
+
+def _from_micros(micros: int) -> str:
+    return (EPOCH + datetime.timedelta(microseconds=micros)).isoformat()
+
+
+def _cents(balance: float) -> int:
+    return round(balance * 100)
+
+
+class BalanceFile:
+    """Account snapshot in the fixed-record binary format.
+
+    Drop-in for ShardedSnapshot as far as AccountStore and Snapshotter are
+    concerned: load() returns every account and fold() brings the file up
+    to a sealed journal segment. `previous` is the JSON snapshot; when this
+    file does not exist yet, accounts are loaded from it and the first fold
+    writes them all out, after which the JSON files are removed (and the
+    other way round, see ShardedSnapshot).
+    """
+
+    def __init__(self, path: str, previous=None):
+        self.path = path
+        self.owners_path = path + ".owners"
+        self.redo_path = path + ".redo"
+        self.previous = previous
+        self.shards = 1
+        self._file = None
+        self._map: Optional[mmap.mmap] = None
+        self._covered = -1
+        self._capacity = 0
+        self._slots: Dict[str, int] = {}
+        self._free: List[int] = []
+        self._used = 0
+        self._owners: List[str] = []
+        self._owner_ids: Dict[str, int] = {}
+        self._records_written = 0
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def remove(self) -> None:
+        self.close()
+        for path in (self.redo_path, self.path, self.owners_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _open(self) -> int:
+        """Map the file, finishing an interrupted fold; returns bytes read"""
+        self._file = open(self.path, "r+b")
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        magic, version, record_size, self._covered, self._capacity = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION or record_size != RECORD_SIZE:
+            raise ValueError(f"{self.path} is not a version {VERSION} balance file")
+        self._load_owners()
+        self._recover()
+        return len(self._map)
+
+    def _load_owners(self) -> None:
+        with open(self.owners_path, "a+b") as f:
+            f.seek(0)
+            data = f.read()
+            complete = data[:data.rfind(b"\n") + 1]
+            if len(complete) < len(data):
+                f.truncate(len(complete))
+        self._owners = [json.loads(line) for line in complete.splitlines()]
+        self._owner_ids = {username: owner for owner, username in enumerate(self._owners)}
+
+    def _recover(self) -> None:
+        if not os.path.exists(self.redo_path):
+            return
+        with open(self.redo_path, "rb") as f:
+            data = f.read()
+        # A redo log without its checksum was cut short before any slot was
+        # touched, so the mapped file is still the previous snapshot
+        if len(data) >= REDO_HEADER.size + 4 and zlib.crc32(data[:-4]) == int.from_bytes(data[-4:], "little"):
+            self._replay_redo(data[:-4])
+            self._sync()
+        os.remove(self.redo_path)
+
+    def _replay_redo(self, data: bytes) -> None:
+        segment, capacity, count = REDO_HEADER.unpack_from(data, 0)
+        self._grow(capacity)
+        position = REDO_HEADER.size
+        for _ in range(count):
+            offset, length = REDO_PATCH.unpack_from(data, position)
+            position += REDO_PATCH.size
+            self._map[offset:offset + length] = data[position:position + length]
+            position += length
+        HEADER.pack_into(self._map, 0, MAGIC, VERSION, RECORD_SIZE, segment, capacity)
+        self._covered = segment
+
+    def _grow(self, capacity: int) -> None:
+        size = HEADER_SIZE + capacity * RECORD_SIZE
+        if size <= len(self._map):
+            return
+        self._map.flush()
+        self._map.close()
+        self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), 0)
+
+    def _sync(self) -> None:
+        self._map.flush()
+        os.fsync(self._file.fileno())
+
+    def _decode(self, slot: int) -> Tuple[int, Optional[Dict[str, Any]]]:
+        number, owner, flags, cents, created = RECORD.unpack_from(self._map, HEADER_SIZE + slot * RECORD_SIZE)
+        if not flags & FLAG_USED:
+            return flags, None
+        account = {
+            "account_number": number.rstrip(b"\0").decode("ascii"),
+            "username": self._owners[owner],
+            "balance": cents / 100,
+            "is_active": bool(flags & FLAG_ACTIVE)
+        }
+        if flags & FLAG_CREATED:
+            account["created_at"] = _from_micros(created)
+        return flags, account
+
+    def _encode(self, account: Dict[str, Any], owners: List[str]) -> bytes:
+        number = account["account_number"].encode("ascii")
+        if len(number) > NUMBER_SIZE:
+            raise ValueError(f"Account number {account['account_number']} is too long for the balance file")
+        username = account["username"]
+        owner = self._owner_ids.get(username)
+        if owner is None:
+            owner = self._owner_ids[username] = len(self._owners)
+            self._owners.append(username)
+            owners.append(username)
+        flags = FLAG_USED
+        if account.get("is_active", True):
+            flags |= FLAG_ACTIVE
+        created = 0
+        if account.get("created_at"):
+            flags |= FLAG_CREATED
+            created = _to_micros(account["created_at"])
+        return RECORD.pack(number, owner, flags, _cents(account["balance"]), created)
+
+    def load(self) -> Tuple[int, Dict[str, Dict[str, Any]], int]:
+        """Return (last journal segment covered, every account, bytes read)"""
+        if not self.exists():
+            if self.previous is not None and self.previous.exists():
+                return self.previous.load()
+            return -1, {}, 0
+        self.close()
+        read = self._open()
+        accounts: Dict[str, Dict[str, Any]] = {}
+        self._slots.clear()
+        self._free.clear()
+        for slot in range(self._capacity):
+            _, account = self._decode(slot)
+            if account is None:
+                self._free.append(slot)
+            else:
+                accounts[account["account_number"]] = account
+                self._slots[account["account_number"]] = slot
+        self._free.reverse()
+        self._used = len(self._slots)
+        return self._covered, accounts, read
+
+    def fold(self, sealed: int, replay: Callable[..., Iterator[Dict[str, Any]]],
+             apply: Callable[[Dict[str, Any], Dict[str, Any]], None],
+             touched: Callable[[Dict[str, Any]], Iterable[str]], fsync: bool = True) -> Tuple[int, int]:
+        """Bring the file up to the sealed journal segment; returns (bytes read, bytes written)"""
+        try:
+            if not self.exists():
+                return self._rewrite(sealed, replay, apply, fsync)
+            return self._fold(sealed, replay, apply, touched, fsync)
+        except BaseException:
+            # The in-memory index may be ahead of the file; the next fold reopens it
+            self.close()
+            raise
+
+    def _fold(self, sealed: int, replay: Callable[..., Iterator[Dict[str, Any]]],
+              apply: Callable[[Dict[str, Any], Dict[str, Any]], None],
+              touched: Callable[[Dict[str, Any]], Iterable[str]], fsync: bool) -> Tuple[int, int]:
+        if self._map is None:
+            self.load()
+        numbers = set()
+        for record in replay(after=self._covered, upto=sealed):
+            numbers.update(touched(record))
+        accounts = {}
+        for number in numbers:
+            slot = self._slots.get(number)
+            if slot is not None:
+                accounts[number] = self._decode(slot)[1]
+        read = len(accounts) * RECORD_SIZE
+        for record in replay(after=self._covered, upto=sealed):
+            apply(accounts, record)
+
+        patches: List[Tuple[int, bytes]] = []
+        owners: List[str] = []
+        capacity = self._capacity
+        for number in sorted(numbers):
+            slot = self._slots.get(number)
+            account = accounts.get(number)
+            if account is None:
+                if slot is not None:
+                    patches.append((HEADER_SIZE + slot * RECORD_SIZE, bytes(RECORD_SIZE)))
+                    del self._slots[number]
+                    self._free.append(slot)
+                continue
+            record = self._encode(account, owners)
+            if slot is None:
+                if not self._free:
+                    self._free = list(range(capacity + GROW_SLOTS - 1, capacity - 1, -1))
+                    capacity += GROW_SLOTS
+                slot = self._slots[number] = self._free.pop()
+            offset = HEADER_SIZE + slot * RECORD_SIZE
+            current = self._map[offset:offset + RECORD_SIZE] if offset < len(self._map) else b""
+            if current[:BALANCE_OFFSET] == record[:BALANCE_OFFSET] and current[40:] == record[40:]:
+                if current[BALANCE_OFFSET:40] != record[BALANCE_OFFSET:40]:
+                    patches.append((offset + BALANCE_OFFSET, record[BALANCE_OFFSET:40]))
+            else:
+                patches.append((offset, record))
+        written = self._append_owners(owners, fsync)
+        written += self._apply(sealed, capacity, patches, fsync)
+        self._used = len(self._slots)
+        self._records_written += len(patches)
+        return read, written
+
+    def _append_owners(self, owners: List[str], fsync: bool) -> int:
+        if not owners:
+            return 0
+        data = b"".join(json.dumps(username).encode() + b"\n" for username in owners)
+        with open(self.owners_path, "ab") as f:
+            f.write(data)
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+        return len(data)
+
+    def _apply(self, segment: int, capacity: int, patches: List[Tuple[int, bytes]], fsync: bool) -> int:
+        redo = [REDO_HEADER.pack(segment, capacity, len(patches))]
+        for offset, data in patches:
+            redo.append(REDO_PATCH.pack(offset, len(data)))
+            redo.append(data)
+        redo = b"".join(redo)
+        redo += zlib.crc32(redo).to_bytes(4, "little")
+        with open(self.redo_path, "wb") as f:
+            f.write(redo)
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+        self._replay_redo(redo[:-4])
+        self._capacity = capacity
+        if fsync:
+            self._sync()
+        os.remove(self.redo_path)
+        return len(redo) + sum(len(data) for _, data in patches)
+
+    def _rewrite(self, sealed: int, replay: Callable[..., Iterator[Dict[str, Any]]],
+                 apply: Callable[[Dict[str, Any], Dict[str, Any]], None], fsync: bool) -> Tuple[int, int]:
+        # First fold after switching formats: build the whole file beside the
+        # JSON snapshot, then drop the JSON files
+        covered, accounts, read = self.load()
+        for record in replay(after=covered, upto=sealed):
+            apply(accounts, record)
+        self._owners, self._owner_ids = [], {}
+        owners: List[str] = []
+        records = [self._encode(account, owners) for account in accounts.values()]
+        capacity = (len(records) // GROW_SLOTS + 1) * GROW_SLOTS
+        tmp_path = self.path + ".tmp"
+        for path in (self.owners_path, tmp_path):
+            if os.path.exists(path):
+                os.remove(path)
+        written = self._append_owners(owners, fsync)
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, VERSION, RECORD_SIZE, sealed, capacity).ljust(HEADER_SIZE, b"\0"))
+            f.writelines(records)
+            f.truncate(HEADER_SIZE + capacity * RECORD_SIZE)
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        written += HEADER_SIZE + len(records) * RECORD_SIZE
+        self.load()
+        if self.previous is not None:
+            self.previous.remove()
+        self._records_written += len(records)
+        return read, written
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "snapshot_slots": self._capacity,
+            "snapshot_slots_used": self._used,
+            "snapshot_records_written": self._records_written
+        }
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+            self._map = None
+            self._file = None
@@ -0,0 +1,297 @@
+"""Streaming NDJSON import and export of users and accounts.
+
+One JSON object per line, in either of two shapes:
+
+    {"type": "user", "username": "alice", "password_hash": "$2b$12$..."}
+    {"type": "account", "account_number": "1234567890", "username": "alice",
+     "balance": 10.0, "is_active": true, "created_at": "2024-01-31T12:00:00"}
+
+Imported users may carry a plain "password" instead of "password_hash"; it is
+hashed on the password pool. account_number, is_active and created_at are
+optional on import.
+"""
+import datetime
+import hmac
+import json
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from shared.accounts import is_active
+from shared.allocator import AccountNumberAllocator
+from shared.history import normalize_timestamp
+from shared.passwords import PasswordPool, PasswordPoolBusy
+from shared.storage import Storage
+
+BCRYPT_PREFIXES = ("$2a$", "$2b$", "$2y$")
+MAX_ERROR_SAMPLES = 20
+# The widest account number the binary balance file can hold
+MAX_ACCOUNT_NUMBER_DIGITS = 24
+
+
+class InvalidRecord(ValueError):
+    pass
+
+
+class LineSplitter:
+    """Split a stream of byte chunks into lines without buffering more than one partial line"""
+
+    def __init__(self):
+        self._partial = b""
+
+    def feed(self, data: bytes) -> List[bytes]:
+        lines = (self._partial + data).split(b"\n")
+        self._partial = lines.pop()
+        return lines
+
+    def finish(self) -> List[bytes]:
+        partial, self._partial = self._partial, b""
+        return [partial] if partial else []
+
+
+def admin_token_matches(expected: str, presented: Optional[str]) -> bool:
+    """Constant-time check of an X-Admin-Token header; always False when no token is configured"""
+    return bool(expected) and presented is not None and hmac.compare_digest(expected.encode(), presented.encode())
+
+
+def read_lines(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    splitter = LineSplitter()
+    for chunk in chunks:
+        yield from splitter.feed(chunk)
+    yield from splitter.finish()
+
+
+def _parse_user(record: Dict[str, Any]) -> Dict[str, Any]:
+    username = record.get("username")
+    if not isinstance(username, str) or not username:
+        raise InvalidRecord("username must be a non-empty string")
+    password_hash = record.get("password_hash")
+    if password_hash is not None:
+        if not isinstance(password_hash, str) or not password_hash.startswith(BCRYPT_PREFIXES):
+            raise InvalidRecord("password_hash must be a bcrypt hash")
+        return {"username": username, "password_hash": password_hash}
+    password = record.get("password")
+    if not isinstance(password, str) or not password:
+        raise InvalidRecord("password_hash or password is required")
+    return {"username": username, "password": password}
+
+
+def _parse_account(record: Dict[str, Any]) -> Dict[str, Any]:
+    username = record.get("username")
+    if not isinstance(username, str) or not username:
+        raise InvalidRecord("username must be a non-empty string")
+    balance = record.get("balance", 0.0)
+    if isinstance(balance, bool) or not isinstance(balance, (int, float)) or balance < 0:
+        raise InvalidRecord("balance must be a non-negative number")
+    account_number = record.get("account_number")
+    if account_number is not None and (not isinstance(account_number, str) or not account_number.isdigit()
+                                       or len(account_number) > MAX_ACCOUNT_NUMBER_DIGITS):
+        raise InvalidRecord(f"account_number must be a string of at most {MAX_ACCOUNT_NUMBER_DIGITS} digits")
+    active = record.get("is_active", True)
+    if not isinstance(active, bool):
+        raise InvalidRecord("is_active must be a boolean")
+    created_at = record.get("created_at") or datetime.datetime.utcnow().isoformat()
+    try:
+        created_at = normalize_timestamp(created_at)
+    except (TypeError, ValueError):
+        raise InvalidRecord("created_at must be an ISO-8601 string")
+    return {
+        "account_number": account_number,
+        "username": username,
+        "balance": balance,
+        "is_active": active,
+        "created_at": created_at
+    }
+
+
+class BulkImporter:
+    """Buffer NDJSON lines and commit them to storage in chunks.
+
+    add() only buffers a raw line, so it is cheap enough for an event loop,
+    and returns True once chunk_size lines are waiting; the caller then runs
+    flush() (on a worker thread, in a server), which parses the chunk, hashes
+    any plain passwords on the pool in parallel and writes it with one
+    import_users and one import_accounts call. Memory stays bounded by the
+    chunk size. Malformed lines are counted and sampled in the report rather
+    than aborting the import; users and account numbers that already exist
+    are skipped.
+    """
+
+    def __init__(self, storage: Storage, allocator: AccountNumberAllocator,
+                 passwords: Optional[PasswordPool] = None, chunk_size: int = 1000):
+        self.storage = storage
+        self.allocator = allocator
+        self.passwords = passwords
+        self.chunk_size = max(1, chunk_size)
+        self._pending: List[Tuple[int, bytes]] = []
+        self._line = 0
+        self._started = time.perf_counter()
+        self.records = 0
+        self.users = 0
+        self.accounts = 0
+        self.skipped = 0
+        self.errors = 0
+        self.error_samples: List[str] = []
+
+    def _error(self, line: int, message: str) -> None:
+        self.errors += 1
+        if len(self.error_samples) < MAX_ERROR_SAMPLES:
+            self.error_samples.append(f"line {line}: {message}")
+
+    def add(self, line: bytes) -> bool:
+        self._line += 1
+        if line.strip():
+            self.records += 1
+            self._pending.append((self._line, line))
+        return len(self._pending) >= self.chunk_size
+
+    def _parse(self, lines: List[Tuple[int, bytes]]):
+        users, accounts = [], []
+        for number, line in lines:
+            try:
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise InvalidRecord("expected a JSON object")
+                kind = record.get("type")
+                if kind == "user":
+                    users.append(dict(_parse_user(record), line=number))
+                elif kind == "account":
+                    accounts.append(dict(_parse_account(record), line=number))
+                else:
+                    raise InvalidRecord("type must be user or account")
+            except ValueError as e:
+                self._error(number, str(e))
+        return users, accounts
+
+    def _submit_hash(self, password: str, outstanding: List[Future]) -> Future:
+        # Keep no more of the pool than it will admit: when it is full, wait
+        # for one of our own hashes instead of failing the record
+        while True:
+            try:
+                return self.passwords.submit_hash(password)
+            except PasswordPoolBusy:
+                running = [future for future in outstanding if not future.done()]
+                if not running:
+                    raise
+                wait(running, return_when=FIRST_COMPLETED)
+
+    def _hash_users(self, users: List[Dict[str, Any]]) -> List[Tuple[str, str]]:
+        pending: List[Tuple[Dict[str, Any], Optional[Future]]] = []
+        outstanding: List[Future] = []
+        for user in users:
+            if "password_hash" in user:
+                pending.append((user, None))
+            elif self.passwords is None:
+                self._error(user["line"], "plain passwords are not accepted here; send password_hash")
+            else:
+                try:
+                    future = self._submit_hash(user["password"], outstanding)
+                except PasswordPoolBusy:
+                    self._error(user["line"], "password pool busy; send password_hash or retry")
+                    continue
+                outstanding.append(future)
+                pending.append((user, future))
+        return [(user["username"], future.result() if future is not None else user["password_hash"])
+                for user, future in pending]
+
+    def _number_accounts(self, accounts: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        explicit = [account["account_number"] for account in accounts if account["account_number"] is not None]
+        claimed = set(self.allocator.claim(explicit))
+        fresh = iter(self.allocator.reserve(len(accounts) - len(explicit)))
+        numbered = []
+        for account in accounts:
+            line = account.pop("line")
+            if account["account_number"] is None:
+                account["account_number"] = next(fresh)
+            elif account["account_number"] not in claimed:
+                if self.storage.get_account(account["account_number"]) is not None:
+                    self.skipped += 1
+                else:
+                    # Handed out to a concurrent request or listed twice in this chunk
+                    self._error(line, f"account number {account['account_number']} is already in use")
+                continue
+            else:
+                claimed.discard(account["account_number"])
+            numbered.append(account)
+        return numbered
+
+    def flush(self) -> None:
+        lines, self._pending = self._pending, []
+        users, accounts = self._parse(lines)
+        if users:
+            hashed = self._hash_users(users)
+            added = self.storage.import_users(hashed) if hashed else 0
+            self.users += added
+            self.skipped += len(hashed) - added
+        if accounts:
+            numbered = self._number_accounts(accounts)
+            added = self.storage.import_accounts(numbered) if numbered else []
+            self.accounts += len(added)
+            self.skipped += len(numbered) - len(added)
+            # Committed numbers are in the store's index now and the rest are free again
+            self.allocator.release(account["account_number"] for account in numbered)
+
+    def run(self, lines: Iterable[bytes]) -> Dict[str, Any]:
+        for line in lines:
+            if self.add(line):
+                self.flush()
+        self.flush()
+        return self.report()
+
+    def report(self) -> Dict[str, Any]:
+        seconds = time.perf_counter() - self._started
+        return {
+            "records": self.records,
+            "users": self.users,
+            "accounts": self.accounts,
+            "skipped": self.skipped,
+            "errors": self.errors,
+            "error_samples": self.error_samples,
+            "seconds": round(seconds, 3),
+            "records_per_second": round(self.records / seconds, 1) if seconds > 0 else 0.0
+        }
+
+
+class BulkExporter:
+    """Stream every user, then every account, as NDJSON lines"""
+
+    def __init__(self, storage: Storage):
+        self.storage = storage
+        self.records = 0
+        self._started = time.perf_counter()
+
+    def lines(self) -> Iterator[bytes]:
+        for username, password_hash in self.storage.iter_users():
+            self.records += 1
+            yield self._line({"type": "user", "username": username, "password_hash": password_hash})
+        for account in self.storage.iter_accounts():
+            self.records += 1
+            yield self._line({
+                "type": "account",
+                "account_number": account["account_number"],
+                "username": account["username"],
+                "balance": account["balance"],
+                "is_active": is_active(account),
+                "created_at": account.get("created_at")
+            })
+
+    @staticmethod
+    def _line(record: Dict[str, Any]) -> bytes:
+        return (json.dumps(record, separators=(",", ":")) + "\n").encode()
+
+    def report(self) -> Dict[str, Any]:
+        seconds = time.perf_counter() - self._started
+        return {
+            "records": self.records,
+            "seconds": round(seconds, 3),
+            "records_per_second": round(self.records / seconds, 1) if seconds > 0 else 0.0
+        }
+
+
+def describe(action: str, report: Dict[str, Any]) -> str:
+    """One log line summarising an import or export report"""
+    line = f"{action} {report['records']} records in {report['seconds']:.3f}s ({report['records_per_second']:.0f} records/s)"
+    if "users" in report:
+        line += (f": {report['users']} users, {report['accounts']} accounts added, "
+                 f"{report['skipped']} skipped, {report['errors']} errors")
+    return line
@@ -0,0 +1,181 @@
+import datetime
+import itertools
+import json
+import os
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+def normalize_timestamp(value: str) -> str:
+    """Parse an ISO-8601 date or datetime into the naive-UTC form history timestamps use.
+
+    Raises ValueError for anything datetime.fromisoformat rejects.
+    """
+    parsed = datetime.datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return parsed.isoformat()
+
+
+def take_page(entries: Iterable[Dict[str, Any]], limit: int) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """Return up to limit entries and the cursor for the next page, if there is one"""
+    page = list(itertools.islice(entries, limit + 1))
+    if len(page) > limit:
+        return page[:limit], str(page[limit - 1]["id"])
+    return page, None
+
+
+class _AccountIndex:
+    __slots__ = ("ids", "times", "offsets", "lengths")
+
+    def __init__(self):
+        self.ids = array("q")
+        self.times: List[str] = []
+        self.offsets = array("q")
+        self.lengths = array("q")
+
+    def add(self, entry_id: int, timestamp: str, offset: int, length: int) -> None:
+        self.ids.append(entry_id)
+        self.times.append(timestamp)
+        self.offsets.append(offset)
+        self.lengths.append(length)
+
+
+class HistoryLog:
+    """Append-only transaction history with a per-account, time-ordered index.
+
+    Each entry is one JSON line carrying a global, increasing id, the txid of
+    the journal record it came from, the account, the operation and the
+    balance after it. The index keeps, per account, the ids, timestamps and
+    file positions of its entries in order, so a page is located with two
+    binary searches and read with one pread per entry, however long the
+    history is.
+
+    The index is built from the file on a background thread so startup is not
+    held up; queries wait for it. Entries are buffered and only flushed when
+    read or synced: the journal stays the durable record, and entries lost in
+    a crash are re-appended from it on the next start (see last_txid).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._index: Dict[str, _AccountIndex] = {}
+        self._ready = threading.Event()
+        self._late: List[tuple] = []
+        self.last_id = 0
+        self.last_txid = 0
+
+        if not os.path.exists(path):
+            open(path, "wb").close()
+        self._truncate_torn_tail()
+        self._file = open(path, "ab")
+        self._reader = os.open(path, os.O_RDONLY)
+        self._end = self._file.tell()
+        threading.Thread(target=self._build_index, name="history-index", daemon=True).start()
+
+    def _truncate_torn_tail(self) -> None:
+        # Drop a partial final line and pick up the last complete entry's ids
+        with open(self.path, "r+b") as f:
+            size = f.seek(0, os.SEEK_END)
+            position = size
+            tail = b""
+            while position > 0:
+                step = min(65536, position)
+                position -= step
+                f.seek(position)
+                tail = f.read(step) + tail
+                if tail.count(b"\n") >= 2 or position == 0:
+                    break
+            complete = tail[:tail.rfind(b"\n") + 1]
+            if position + len(complete) < size:
+                f.truncate(position + len(complete))
+            lines = complete.splitlines()
+            if lines and (position == 0 or len(lines) > 1):
+                last = json.loads(lines[-1])
+                self.last_id = last["id"]
+                self.last_txid = last["txid"]
+
+    def _build_index(self) -> None:
+        index: Dict[str, _AccountIndex] = {}
+        offset = 0
+        with open(self.path, "rb") as f:
+            while offset < self._end:
+                line = f.readline()
+                if not line:
+                    break
+                entry = json.loads(line)
+                account_index = index.get(entry["account_number"])
+                if account_index is None:
+                    account_index = index[entry["account_number"]] = _AccountIndex()
+                account_index.add(entry["id"], entry["timestamp"], offset, len(line))
+                offset += len(line)
+        with self._lock:
+            for entry_id, account_number, timestamp, line_offset, length in self._late:
+                account_index = index.get(account_number)
+                if account_index is None:
+                    account_index = index[account_number] = _AccountIndex()
+                account_index.add(entry_id, timestamp, line_offset, length)
+            self._late = []
+            self._index = index
+            self._ready.set()
+
+    def append(self, txid: int, timestamp: str, entries: List[Dict[str, Any]]) -> None:
+        """Record the entries produced by one journal record"""
+        with self._lock:
+            for entry in entries:
+                self.last_id += 1
+                entry = dict(entry, id=self.last_id, txid=txid, timestamp=timestamp)
+                line = (json.dumps(entry, separators=(",", ":")) + "\n").encode()
+                offset = self._file.tell()
+                self._file.write(line)
+                if self._ready.is_set():
+                    account_index = self._index.get(entry["account_number"])
+                    if account_index is None:
+                        account_index = self._index[entry["account_number"]] = _AccountIndex()
+                    account_index.add(self.last_id, timestamp, offset, len(line))
+                else:
+                    self._late.append((self.last_id, entry["account_number"], timestamp, offset, len(line)))
+            self.last_txid = max(self.last_txid, txid)
+
+    def query(self, account_number: str, after: Optional[int] = None, start: Optional[str] = None,
+              end: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """Yield the account's entries in order, after the entry id `after`,
+        with start <= timestamp < end (ISO-8601 strings)
+
+        Entries are returned without the account_number and txid fields.
+        """
+        self._ready.wait()
+        with self._lock:
+            self._file.flush()
+            account_index = self._index.get(account_number)
+            if account_index is None:
+                return
+            count = len(account_index.ids)
+        first = bisect_right(account_index.ids, after, 0, count) if after is not None else 0
+        if start is not None:
+            first = max(first, bisect_left(account_index.times, start, 0, count))
+        last = bisect_left(account_index.times, end, 0, count) if end is not None else count
+        for position in range(first, last):
+            line = os.pread(self._reader, account_index.lengths[position], account_index.offsets[position])
+            entry = json.loads(line)
+            del entry["account_number"], entry["txid"]
+            yield entry
+
+    def sync(self) -> None:
+        """Make every appended entry durable"""
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"entries": self.last_id, "indexed_accounts": len(self._index)}
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.flush()
+            self._file.close()
+        os.close(self._reader)
@@ -0,0 +1,125 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+MAX_KEY_LENGTH = 255
+# A key claimed by a request that never finished it is released after this long (seconds)
+PENDING_SECONDS = 60.0
+
+
+class IdempotencyKeyInUse(Exception):
+    """The first request with this key has not finished yet"""
+
+
+class IdempotencyKeyReused(Exception):
+    """The key was already used for a request with a different body or route"""
+
+
+def valid_key(key: str) -> bool:
+    return 0 < len(key) <= MAX_KEY_LENGTH and key.isprintable()
+
+
+def request_fingerprint(route: str, body: Any) -> str:
+    """Digest of what a retry must repeat exactly for its key to match"""
+    return hashlib.sha256(json.dumps([route, body], sort_keys=True, default=str).encode()).hexdigest()
+
+
+class IdempotencyCache:
+    """Responses of finished requests, by (username, Idempotency-Key), for ttl seconds.
+
+    begin() claims a key for the first request that sends it and answers
+    later ones with its (status, body), so a retried deposit is not applied
+    twice and costs a dict lookup instead of a storage write; finish()
+    stores the response and abandon() gives the key up. Keys are scoped to
+    the user who sent them. A retry that arrives while the first request is
+    still running raises IdempotencyKeyInUse; one whose fingerprint differs
+    raises IdempotencyKeyReused. A claim never finished within
+    PENDING_SECONDS, e.g. by a worker that died, lapses.
+
+    Server errors (status 500 and up) are not stored, so those requests may
+    be retried with the same key. Entries expire in the order they were
+    stored; past maxsize the oldest go first.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 3600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[Tuple[str, str], tuple]" = OrderedDict()
+        self._pending: Dict[Tuple[str, str], Tuple[str, float]] = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._conflicts = 0
+        self._mismatches = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    def _expire(self, now: float) -> None:
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry[0] > now:
+                return
+            del self._entries[key]
+            self._expirations += 1
+
+    def begin(self, username: str, key: str, fingerprint: str) -> Optional[Tuple[int, Any]]:
+        """Return the stored (status, body) for a key, or None after claiming it for this request"""
+        cache_key = (username, key)
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.get(cache_key)
+            if entry is not None:
+                _, stored_fingerprint, status, body = entry
+                if stored_fingerprint != fingerprint:
+                    self._mismatches += 1
+                    raise IdempotencyKeyReused(key)
+                self._hits += 1
+                return status, body
+            pending = self._pending.get(cache_key)
+            if pending is not None and pending[1] > now - PENDING_SECONDS:
+                if pending[0] != fingerprint:
+                    self._mismatches += 1
+                    raise IdempotencyKeyReused(key)
+                self._conflicts += 1
+                raise IdempotencyKeyInUse(key)
+            self._pending[cache_key] = (fingerprint, now)
+            self._misses += 1
+            return None
+
+    def finish(self, username: str, key: str, status: int, body: Any) -> None:
+        """Store the response to a claimed key; a server error releases the key instead"""
+        cache_key = (username, key)
+        # Stored under the same lock that clears the claim, so no retry runs the request in between
+        with self._lock:
+            pending = self._pending.pop(cache_key, None)
+            if pending is not None and status < 500 and self.maxsize > 0:
+                self._entries[cache_key] = (time.monotonic() + self.ttl, pending[0], status, body)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                    self._evictions += 1
+
+    def abandon(self, username: str, key: str) -> None:
+        with self._lock:
+            self._pending.pop((username, key), None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._expire(time.monotonic())
+            lookups = self._hits + self._misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "in_flight": len(self._pending),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_ratio": self._hits / lookups if lookups else 0.0,
+                "conflicts": self._conflicts,
+                "mismatches": self._mismatches,
+                "evictions": self._evictions,
+                "expirations": self._expirations
+            }
@@ -0,0 +1,216 @@
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+
+class JournalError(Exception):
+    """Raised when the journal can no longer accept writes"""
+
+
+class Journal:
+    """Append-only log of account mutations, one compact JSON record per line.
+
+    The log is split into numbered segment files, <path>.00000001 and so on.
+    rotate() seals the segment being written and starts the next one, so a
+    snapshot can fold sealed segments in the background and then delete them
+    with remove_segments(). A bare <path> file from before segmenting is
+    adopted as segment 0.
+
+    Writers are group committed: submit() queues a record and wait() blocks
+    until it is durable. The first waiter to find no flush in progress becomes
+    the leader; it lingers up to group_window seconds (or until group_size
+    records are queued), then writes and syncs the whole batch at once and
+    releases every waiter in it. With group_window=0 batches still form from
+    whatever arrives while the previous flush is running.
+    """
+
+    def __init__(self, path: str, fsync: bool = True, group_window: float = 0.0, group_size: int = 256,
+                 first_segment: int = 0):
+        self.path = path
+        self.fsync = fsync
+        self.group_window = group_window
+        self.group_size = max(1, group_size)
+        self._file = None
+        self._cond = threading.Condition()
+        if os.path.exists(path) and not os.path.exists(self._segment_path(0)):
+            os.replace(path, self._segment_path(0))
+        # Never reuse the number of a segment a snapshot has already covered
+        self._segment = max(max(self.segments(), default=-1) + 1, first_segment)
+        self._segment_records = 0
+        self._pending: List[bytes] = []
+        self._submitted_seq = 0
+        self._durable_seq = 0
+        self._flushing = False
+        self._error = None
+        self._commits = 0
+        self._records = 0
+        self._bytes = 0
+        self._bytes_read = 0
+        self._max_batch = 0
+        self._flush_seconds = 0.0
+        self._wait_seconds = 0.0
+
+    def _segment_path(self, index: int) -> str:
+        return f"{self.path}.{index:08d}"
+
+    def segments(self) -> List[int]:
+        """Indices of the segment files on disk, oldest first"""
+        directory = os.path.dirname(os.path.abspath(self.path))
+        prefix = os.path.basename(self.path) + "."
+        return sorted(
+            int(name[len(prefix):]) for name in os.listdir(directory)
+            if name.startswith(prefix) and name[len(prefix):].isdigit()
+        )
+
+    def replay(self, after: int = -1, upto: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """Yield the records of segments after `after` (up to `upto`) in order.
+
+        A torn final line left by a crash mid-append is dropped and cut off its
+        segment, so the generator must be fully consumed before the first append.
+        """
+        for index in self.segments():
+            if index > after and (upto is None or index <= upto):
+                yield from self._replay_segment(self._segment_path(index))
+
+    def _replay_segment(self, path: str) -> Iterator[Dict[str, Any]]:
+        valid_bytes = 0
+        with open(path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                valid_bytes += len(line)
+                yield record
+        with self._cond:
+            self._bytes_read += valid_bytes
+        if os.path.getsize(path) > valid_bytes:
+            with open(path, "r+b") as f:
+                f.truncate(valid_bytes)
+
+    def rotate(self) -> int:
+        """Seal the segment being written and return its index.
+
+        Records submitted after this call land in the next segment, so every
+        segment up to the returned index is complete once rotate() returns.
+        """
+        with self._cond:
+            while self._flushing:
+                self._cond.wait()
+            sealed = self._segment
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._segment += 1
+            self._segment_records = 0
+            return sealed
+
+    def remove_segments(self, upto: int) -> None:
+        """Delete sealed segments whose records are covered by a snapshot"""
+        for index in self.segments():
+            if index <= upto:
+                os.remove(self._segment_path(index))
+
+    def segment_records(self) -> int:
+        """Records written to the current segment since the last rotate()"""
+        with self._cond:
+            return self._segment_records
+
+    def submit(self, record: Dict[str, Any]) -> int:
+        """Queue a record for the next group commit and return its sequence number"""
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode()
+        with self._cond:
+            if self._error is not None:
+                raise JournalError("journal is unavailable after a failed write") from self._error
+            self._pending.append(line)
+            self._submitted_seq += 1
+            if len(self._pending) >= self.group_size:
+                self._cond.notify_all()
+            return self._submitted_seq
+
+    def wait(self, seq: int) -> None:
+        """Block until the record with the given sequence number is durable"""
+        started = time.perf_counter()
+        with self._cond:
+            while self._durable_seq < seq:
+                if self._error is not None:
+                    raise JournalError("journal write failed") from self._error
+                if self._flushing:
+                    self._cond.wait()
+                else:
+                    self._lead_flush()
+            self._wait_seconds += time.perf_counter() - started
+
+    def append(self, record: Dict[str, Any]) -> None:
+        self.wait(self.submit(record))
+
+    def _lead_flush(self) -> None:
+        # Called with self._cond held; drops it while doing I/O
+        self._flushing = True
+        deadline = time.monotonic() + self.group_window
+        while len(self._pending) < self.group_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self._cond.wait(remaining)
+        batch = self._pending
+        self._pending = []
+        last_seq = self._submitted_seq
+        data = b"".join(batch)
+
+        self._cond.release()
+        started = time.perf_counter()
+        error = None
+        try:
+            if self._file is None:
+                self._file = open(self._segment_path(self._segment), "ab")
+            self._file.write(data)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+        except OSError as e:
+            error = e
+        finally:
+            elapsed = time.perf_counter() - started
+            self._cond.acquire()
+
+        self._flushing = False
+        if error is not None:
+            self._error = error
+        else:
+            self._durable_seq = last_seq
+            self._commits += 1
+            self._records += len(batch)
+            self._segment_records += len(batch)
+            self._bytes += len(data)
+            self._max_batch = max(self._max_batch, len(batch))
+            self._flush_seconds += elapsed
+        self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "group_window_seconds": self.group_window,
+                "group_size": self.group_size,
+                "commits": self._commits,
+                "records": self._records,
+                "bytes_written": self._bytes,
+                "bytes_read": self._bytes_read,
+                "max_batch": self._max_batch,
+                "avg_batch": self._records / self._commits if self._commits else 0.0,
+                "flush_seconds_total": self._flush_seconds,
+                "wait_seconds_total": self._wait_seconds,
+                "pending": len(self._pending),
+                "segment": self._segment,
+                "segment_records": self._segment_records
+            }
+
+    def close(self) -> None:
+        with self._cond:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
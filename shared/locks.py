@@ -0,0 +1,30 @@
+import threading
+import zlib
+from contextlib import contextmanager
+from typing import Iterator
+
+
+class LockStripes:
+    """Fixed pool of locks that keys (account numbers, usernames) hash onto.
+
+    hold() takes the stripes for all given keys in ascending stripe order, so
+    two callers locking overlapping keys can never deadlock, while callers
+    touching unrelated keys only collide when their stripes happen to match.
+    """
+
+    def __init__(self, stripes: int = 256):
+        self._locks = [threading.Lock() for _ in range(max(1, stripes))]
+
+    def _index(self, key: str) -> int:
+        return zlib.crc32(key.encode()) % len(self._locks)
+
+    @contextmanager
+    def hold(self, *keys: str) -> Iterator[None]:
+        locks = [self._locks[i] for i in sorted({self._index(key) for key in keys})]
+        for lock in locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release()
@@ -0,0 +1,112 @@
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict
+
+import bcrypt
+
+
+class PasswordPoolBusy(Exception):
+    """Raised when every worker is busy and the wait queue is full"""
+
+
+def _hash_password(password: str, rounds: int) -> str:
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds)).decode()
+
+
+def _check_password(password: str, hashed_password: str) -> bool:
+    return bcrypt.checkpw(password.encode(), hashed_password.encode())
+
+
+def _timed(fn, *args):
+    # Runs in the worker, so bcrypt time excludes queueing even with processes
+    started = time.perf_counter()
+    return fn(*args), time.perf_counter() - started
+
+
+class PasswordPool:
+    """Size-limited worker pool for bcrypt hashing and verification.
+
+    At most workers + queue_depth tasks are admitted at once; beyond that
+    submissions fail fast with PasswordPoolBusy instead of queueing. bcrypt
+    releases the GIL, so native threads are the default; use_processes
+    switches to a process pool.
+    """
+
+    def __init__(self, workers: int, queue_depth: int, rounds: int = 12, use_processes: bool = False):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.rounds = rounds
+        if use_processes:
+            self._executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._slots = threading.BoundedSemaphore(workers + queue_depth)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._completed = 0
+        self._rejected = 0
+        self._bcrypt_seconds = 0.0
+        self._wait_seconds = 0.0
+
+    def _submit(self, fn, *args) -> Future:
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise PasswordPoolBusy()
+        submitted = time.perf_counter()
+        try:
+            inner = self._executor.submit(_timed, fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._in_flight += 1
+        future: Future = Future()
+        inner.add_done_callback(lambda done: self._release(done, future, submitted))
+        return future
+
+    def _release(self, inner: Future, future: Future, submitted: float) -> None:
+        elapsed = time.perf_counter() - submitted
+        error = inner.exception()
+        bcrypt_seconds = 0.0
+        if error is None:
+            result, bcrypt_seconds = inner.result()
+        with self._lock:
+            self._in_flight -= 1
+            self._completed += 1
+            self._bcrypt_seconds += bcrypt_seconds
+            self._wait_seconds += elapsed - bcrypt_seconds
+        self._slots.release()
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+
+    def submit_hash(self, password: str) -> Future:
+        return self._submit(_hash_password, password, self.rounds)
+
+    def submit_check(self, password: str, hashed_password: str) -> Future:
+        return self._submit(_check_password, password, hashed_password)
+
+    def hash(self, password: str) -> str:
+        return self.submit_hash(password).result()
+
+    def check(self, password: str, hashed_password: str) -> bool:
+        return self.submit_check(password, hashed_password).result()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queue_depth": self.queue_depth,
+                "in_flight": self._in_flight,
+                "queued": max(0, self._in_flight - self.workers),
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "bcrypt_seconds_total": self._bcrypt_seconds,
+                "wait_seconds_total": self._wait_seconds
+            }
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False)
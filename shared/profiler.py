@@ -0,0 +1,282 @@
+import asyncio
+import contextlib
+import contextvars
+import functools
+import io
+import marshal
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Any, Callable, Deque, Dict, Iterator, Optional, Tuple
+
+BUCKET_SECONDS = 10.0
+MAX_DEPTH = 128
+# Leaf of a stack sampled while its request was suspended in an await rather than running
+AWAIT_FRAME = ("~", 0, "<await>")
+
+_current: "contextvars.ContextVar[Optional[RequestProfile]]" = contextvars.ContextVar("profile", default=None)
+
+
+class RequestProfile:
+    """Stacks sampled while one request was being served"""
+
+    def __init__(self):
+        self.stacks: Counter = Counter()
+        # Tracked threads currently working for this request; its task is not sampled meanwhile
+        self.threads = 0
+
+
+def _function(code) -> Tuple[str, int, str]:
+    if isinstance(code, tuple):
+        return code
+    return code.co_filename, code.co_firstlineno, code.co_name
+
+
+def _frame_stack(frame) -> tuple:
+    codes = []
+    while frame is not None and len(codes) < MAX_DEPTH:
+        codes.append(frame.f_code)
+        frame = frame.f_back
+    codes.reverse()
+    return tuple(codes)
+
+
+def _await_stack(coro) -> tuple:
+    codes = []
+    # Coroutines, generator-based coroutines and async generators name these differently
+    while coro is not None and len(codes) < MAX_DEPTH:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None) or getattr(coro, "ag_frame", None)
+        if frame is None:
+            break
+        codes.append(frame.f_code)
+        coro = (getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+                or getattr(coro, "ag_await", None))
+    return tuple(codes) + (AWAIT_FRAME,)
+
+
+def _label(function: Tuple[str, int, str]) -> str:
+    filename, line, name = function
+    if filename == "~":
+        return name
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+class SamplingProfiler:
+    """Wall-clock stack sampler for a random fraction of requests.
+
+    A sampled request registers the thread serving it (track_thread) or,
+    under asyncio, its task (track_task); work it hands to another thread is
+    followed through bind(). While any request is registered, a background
+    thread reads every registered thread's stack each interval seconds; a
+    registered task is sampled from its event loop thread when it is the
+    one running, and by its await chain when it is suspended, so time spent
+    waiting shows up too. Nothing runs while no request is sampled, so the
+    cost is the random draw per request plus the sampled requests.
+
+    Finished requests are added up per route in BUCKET_SECONDS buckets kept
+    for retention seconds; collapsed(), pstats() and text() report a window
+    of them.
+    """
+
+    def __init__(self, sample_rate: float = 0.0, interval: float = 0.005, retention: float = 900.0):
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.retention = retention
+        self._threads: Dict[int, RequestProfile] = {}
+        self._tasks: Dict[asyncio.Task, Tuple[RequestProfile, asyncio.AbstractEventLoop, int]] = {}
+        self._buckets: Deque[Tuple[float, Counter]] = deque()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self._requests = 0
+        self._samples = 0
+        self._sampler_seconds = 0.0
+
+    def should_sample(self, forced: bool = False) -> bool:
+        return forced or (self.sample_rate > 0 and random.random() < self.sample_rate)
+
+    def _start_sampler(self) -> None:
+        self._wake.set()
+        if self._sampler is None:
+            self._sampler = threading.Thread(target=self._run, name="profiler", daemon=True)
+            self._sampler.start()
+
+    def _stop_sampler(self) -> None:
+        if not self._threads and not self._tasks:
+            self._wake.clear()
+
+    @contextlib.contextmanager
+    def track_thread(self, profile: RequestProfile) -> Iterator[None]:
+        """Sample the calling thread for profile until the block exits"""
+        thread_id = threading.get_ident()
+        token = _current.set(profile)
+        with self._lock:
+            previous = self._threads.get(thread_id)
+            self._threads[thread_id] = profile
+            profile.threads += 1
+            self._start_sampler()
+        try:
+            yield
+        finally:
+            with self._lock:
+                if previous is None:
+                    del self._threads[thread_id]
+                else:
+                    self._threads[thread_id] = previous
+                profile.threads -= 1
+                self._stop_sampler()
+            _current.reset(token)
+
+    @contextlib.contextmanager
+    def track_task(self, profile: RequestProfile) -> Iterator[None]:
+        """Sample the calling asyncio task for profile until the block exits"""
+        task = asyncio.current_task()
+        token = _current.set(profile)
+        with self._lock:
+            self._tasks[task] = (profile, asyncio.get_running_loop(), threading.get_ident())
+            self._start_sampler()
+        try:
+            yield
+        finally:
+            with self._lock:
+                del self._tasks[task]
+                self._stop_sampler()
+            _current.reset(token)
+
+    def bind(self, func: Callable) -> Callable:
+        """func, tracked for the current request's profile on whichever thread runs it"""
+        profile = _current.get()
+        if profile is None:
+            return func
+
+        @functools.wraps(func)
+        def tracked(*args, **kwargs):
+            with self.track_thread(profile):
+                return func(*args, **kwargs)
+        return tracked
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait()
+            time.sleep(self.interval)
+            started = time.perf_counter()
+            self._sample()
+            with self._lock:
+                self._sampler_seconds += time.perf_counter() - started
+
+    def _sample(self) -> None:
+        frames = sys._current_frames()
+        with self._lock:
+            threads = list(self._threads.items())
+            tasks = list(self._tasks.items())
+        samples = []
+        for thread_id, profile in threads:
+            frame = frames.get(thread_id)
+            if frame is not None:
+                samples.append((profile, _frame_stack(frame)))
+        for task, (profile, loop, thread_id) in tasks:
+            if profile.threads:
+                continue
+            if asyncio.current_task(loop) is task:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    samples.append((profile, _frame_stack(frame)))
+            else:
+                samples.append((profile, _await_stack(task.get_coro())))
+        del frames
+        # Under the lock, so finish() never reads a profile that is being added to
+        with self._lock:
+            for profile, stack in samples:
+                profile.stacks[stack] += 1
+            self._samples += len(samples)
+
+    def finish(self, profile: RequestProfile, route: str) -> None:
+        """Add a finished request's samples to the current bucket under route"""
+        now = time.time()
+        start = now - now % BUCKET_SECONDS
+        with self._lock:
+            self._requests += 1
+            if not self._buckets or self._buckets[-1][0] != start:
+                self._buckets.append((start, Counter()))
+            while self._buckets[0][0] < now - self.retention - BUCKET_SECONDS:
+                self._buckets.popleft()
+            bucket = self._buckets[-1][1]
+            for stack, count in profile.stacks.items():
+                bucket[(route, stack)] += count
+
+    def _window(self, seconds: float, route: Optional[str]) -> Dict[tuple, int]:
+        since = time.time() - seconds
+        with self._lock:
+            merged = Counter()
+            for start, counts in self._buckets:
+                if start + BUCKET_SECONDS > since:
+                    merged.update(counts)
+        # The route becomes the root frame, so one report can hold every route
+        total: Counter = Counter()
+        for (stack_route, stack), count in merged.items():
+            if route is None or stack_route == route:
+                total[(("~", 0, stack_route),) + tuple(_function(code) for code in stack)] += count
+        return total
+
+    def collapsed(self, seconds: float, route: Optional[str] = None) -> str:
+        """Folded stacks (route;outer;...;inner count), the input format of flamegraph.pl and speedscope"""
+        lines = [";".join(_label(function).replace(";", ":") for function in stack) + f" {count}"
+                 for stack, count in self._window(seconds, route).items()]
+        lines.sort()
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def _stats(self, seconds: float, route: Optional[str]) -> Dict[tuple, tuple]:
+        # pstats layout: function -> (calls, calls, own time, cumulative time, {caller: (...)});
+        # the call counts are sample counts and the times are samples * interval
+        entries: Dict[tuple, list] = {}
+        for stack, count in self._window(seconds, route).items():
+            elapsed = count * self.interval
+            seen = set()
+            for index, function in enumerate(stack):
+                entry = entries.setdefault(function, [0, 0, 0.0, 0.0, {}])
+                leaf = index == len(stack) - 1
+                if function not in seen:
+                    seen.add(function)
+                    entry[0] += count
+                    entry[1] += count
+                    entry[3] += elapsed
+                if leaf:
+                    entry[2] += elapsed
+                if index:
+                    caller = stack[index - 1]
+                    calls, primitive, own, cumulative = entry[4].get(caller, (0, 0, 0.0, 0.0))
+                    entry[4][caller] = (calls + count, primitive + count, own + (elapsed if leaf else 0.0),
+                                        cumulative + elapsed)
+        return {function: tuple(entry) for function, entry in entries.items()}
+
+    def pstats(self, seconds: float, route: Optional[str] = None) -> bytes:
+        """The window as a marshalled pstats file, for python -m pstats or snakeviz"""
+        return marshal.dumps(self._stats(seconds, route))
+
+    def text(self, seconds: float, route: Optional[str] = None, limit: int = 40) -> str:
+        """pstats' report of the window, by cumulative time"""
+        out = io.StringIO()
+        stats = pstats.Stats(stream=out)
+        stats.stats = self._stats(seconds, route)
+        stats.get_top_level_stats()
+        stats.sort_stats("cumulative").print_stats(limit)
+        return out.getvalue()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "sample_rate": self.sample_rate,
+                "interval_seconds": self.interval,
+                "active": len(self._threads) + len(self._tasks),
+                "requests_sampled": self._requests,
+                "samples": self._samples,
+                "sampler_seconds_total": self._sampler_seconds
+            }
+
+
+def route_label(method: str, path: Optional[str]) -> str:
+    return f"{method} {path if path is not None else 'unmatched'}"
@@ -0,0 +1,234 @@
+import itertools
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Connection, Listener
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from shared.storage import Storage
+
+# Methods workers may call; the ones returning iterators are streamed in chunks
+REMOTE_METHODS = (
+    "get_password_hash", "add_user", "get_account", "find_account", "create_account",
+    "deposit", "withdraw", "transfer", "close_account", "apply_batch", "list_transactions",
+    "iter_users", "iter_accounts", "import_users", "import_accounts", "add_refresh_token",
+    "rotate_refresh_token", "revoke_refresh_token", "begin_idempotent", "finish_idempotent",
+    "abandon_idempotent", "stats"
+)
+STREAMED_METHODS = ("list_transactions", "iter_users", "iter_accounts")
+STREAM_CHUNK = 500
+
+
+class StorageServer:
+    """Serves one Storage to worker processes over an authenticated Unix socket.
+
+    This is the single-writer side of multi-worker mode: one process owns the
+    JSON files and every worker's storage call runs here. Each worker thread
+    keeps its own connection, served by its own thread, so calls from all
+    workers run concurrently against the backend exactly like request
+    threads in one process, and their journal records share group commits.
+
+    Iterators (transaction history, exports) are kept here and handed out a
+    chunk at a time; any connection may pull the next chunk, since a
+    streamed response can resume on a different worker thread.
+    """
+
+    def __init__(self, storage: Storage, address: str, authkey: bytes):
+        self.storage = storage
+        self.address = address
+        self.authkey = authkey
+        self._listener = Listener(address, family="AF_UNIX", authkey=authkey)
+        self._streams: Dict[int, Iterator[Any]] = {}
+        self._stream_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        threading.Thread(target=self._accept, name="storage-server", daemon=True).start()
+
+    def _accept(self) -> None:
+        while True:
+            try:
+                conn = self._listener.accept()
+            except AuthenticationError:
+                continue
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), name="storage-connection", daemon=True).start()
+
+    def _chunk(self, stream_id: int) -> Tuple[Optional[int], List[Any]]:
+        with self._lock:
+            stream = self._streams.get(stream_id)
+        if stream is None:
+            return None, []
+        chunk = list(itertools.islice(stream, STREAM_CHUNK))
+        if len(chunk) < STREAM_CHUNK:
+            with self._lock:
+                self._streams.pop(stream_id, None)
+            return None, chunk
+        return stream_id, chunk
+
+    def _handle(self, op: str, name: Any, args: tuple, kwargs: dict, opened: set) -> Any:
+        if op == "next":
+            return self._chunk(name)
+        if name not in REMOTE_METHODS:
+            raise AttributeError(name)
+        result = getattr(self.storage, name)(*args, **kwargs)
+        if name not in STREAMED_METHODS:
+            return result
+        stream_id = next(self._stream_ids)
+        with self._lock:
+            self._streams[stream_id] = iter(result)
+        opened.add(stream_id)
+        return self._chunk(stream_id)
+
+    def _serve(self, conn: Connection) -> None:
+        opened: set = set()
+        try:
+            while True:
+                try:
+                    op, name, args, kwargs, abandoned = conn.recv()
+                except (EOFError, OSError):
+                    return
+                with self._lock:
+                    for stream_id in abandoned:
+                        self._streams.pop(stream_id, None)
+                try:
+                    reply = (True, self._handle(op, name, args, kwargs, opened))
+                except Exception as e:
+                    reply = (False, e)
+                conn.send(reply)
+        finally:
+            # A worker that went away cannot come back for its iterators
+            with self._lock:
+                for stream_id in opened:
+                    self._streams.pop(stream_id, None)
+            conn.close()
+
+    def close(self) -> None:
+        self._listener.close()
+
+
+class RemoteStorage(Storage):
+    """Storage client for a StorageServer, with one connection per thread"""
+
+    process_safe = True
+
+    def __init__(self, address: str, authkey: bytes):
+        self.address = address
+        self.authkey = authkey
+        self._local = threading.local()
+        self._connections: List[Connection] = []
+        self._connections_lock = threading.Lock()
+        # Streams dropped before the end; closed on the next call rather than
+        # from a finalizer, which could run in the middle of another call
+        self._abandoned: List[int] = []
+        self._abandoned_lock = threading.Lock()
+
+    def _connection(self) -> Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = Client(self.address, family="AF_UNIX", authkey=self.authkey)
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def _request(self, op: str, name: Any, *args, **kwargs) -> Any:
+        conn = self._connection()
+        with self._abandoned_lock:
+            abandoned, self._abandoned = self._abandoned, []
+        conn.send((op, name, args, kwargs, abandoned))
+        ok, result = conn.recv()
+        if not ok:
+            raise result
+        return result
+
+    def _stream(self, name: str, *args, **kwargs) -> Iterator[Any]:
+        # The first chunk comes back with the call, so errors such as
+        # AccountNotFound are raised here rather than on first iteration
+        stream_id, chunk = self._request("call", name, *args, **kwargs)
+        return self._drain(stream_id, chunk)
+
+    def _drain(self, stream_id: Optional[int], chunk: List[Any]) -> Iterator[Any]:
+        try:
+            while True:
+                yield from chunk
+                if stream_id is None:
+                    return
+                stream_id, chunk = self._request("next", stream_id)
+        finally:
+            if stream_id is not None:
+                with self._abandoned_lock:
+                    self._abandoned.append(stream_id)
+
+    def get_password_hash(self, username: str) -> Optional[str]:
+        return self._request("call", "get_password_hash", username)
+
+    def add_user(self, username: str, password_hash: str) -> bool:
+        return self._request("call", "add_user", username, password_hash)
+
+    def get_account(self, account_number: str) -> Optional[Dict[str, Any]]:
+        return self._request("call", "get_account", account_number)
+
+    def find_account(self, username: str) -> Optional[Dict[str, Any]]:
+        return self._request("call", "find_account", username)
+
+    def create_account(self, username: str, account_number: str, initial_balance: float) -> Dict[str, Any]:
+        return self._request("call", "create_account", username, account_number, initial_balance)
+
+    def deposit(self, username: str, amount: float) -> Dict[str, Any]:
+        return self._request("call", "deposit", username, amount)
+
+    def withdraw(self, username: str, amount: float) -> Dict[str, Any]:
+        return self._request("call", "withdraw", username, amount)
+
+    def transfer(self, username: str, to_account_number: str, amount: float) -> Dict[str, Any]:
+        return self._request("call", "transfer", username, to_account_number, amount)
+
+    def close_account(self, username: str, remove: bool = False) -> Dict[str, Any]:
+        return self._request("call", "close_account", username, remove=remove)
+
+    def apply_batch(self, username: str, operations: List[Dict[str, Any]], continue_on_error: bool = False) -> list:
+        return self._request("call", "apply_batch", username, operations, continue_on_error)
+
+    def list_transactions(self, username: str, after: Optional[int] = None, start: Optional[str] = None,
+                          end: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        return self._stream("list_transactions", username, after=after, start=start, end=end)
+
+    def iter_users(self) -> Iterator[Tuple[str, str]]:
+        return self._stream("iter_users")
+
+    def iter_accounts(self) -> Iterator[Dict[str, Any]]:
+        return self._stream("iter_accounts")
+
+    def import_users(self, users: List[Tuple[str, str]]) -> int:
+        return self._request("call", "import_users", users)
+
+    def import_accounts(self, accounts: List[Dict[str, Any]]) -> List[str]:
+        return self._request("call", "import_accounts", accounts)
+
+    def add_refresh_token(self, digest: str, username: str, expires_at: float) -> None:
+        return self._request("call", "add_refresh_token", digest, username, expires_at)
+
+    def rotate_refresh_token(self, digest: str, new_digest: str, expires_at: float) -> Optional[str]:
+        return self._request("call", "rotate_refresh_token", digest, new_digest, expires_at)
+
+    def revoke_refresh_token(self, digest: str) -> bool:
+        return self._request("call", "revoke_refresh_token", digest)
+
+    def begin_idempotent(self, username: str, key: str, fingerprint: str) -> Optional[Tuple[int, Any]]:
+        return self._request("call", "begin_idempotent", username, key, fingerprint)
+
+    def finish_idempotent(self, username: str, key: str, status: int, body: Any) -> None:
+        return self._request("call", "finish_idempotent", username, key, status, body)
+
+    def abandon_idempotent(self, username: str, key: str) -> None:
+        return self._request("call", "abandon_idempotent", username, key)
+
+    def stats(self) -> Dict[str, Any]:
+        return self._request("call", "stats")
+
+    def close(self) -> None:
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
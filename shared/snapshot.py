@@ -0,0 +1,318 @@
+import json
+import os
+import re
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from shared.balance_file import BalanceFile
+from shared.journal import Journal
+
+
+def read_snapshot(path: str) -> Tuple[int, Dict[str, Dict[str, Any]], int]:
+    """Return (last journal segment covered, accounts, bytes read).
+
+    A plain account_number -> account map, as written before snapshots
+    existed, covers no segment.
+    """
+    if not os.path.exists(path):
+        return -1, {}, 0
+    with open(path, "rb") as f:
+        data = f.read()
+    snapshot = json.loads(data)
+    if "journal_segment" in snapshot and "accounts" in snapshot:
+        return snapshot["journal_segment"], snapshot["accounts"], len(data)
+    return -1, snapshot, len(data)
+
+
+def _replace(path: str, data: bytes, fsync: bool) -> int:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        if fsync:
+            os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    if fsync:
+        directory = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+    return len(data)
+
+
+def write_snapshot(path: str, segment: int, accounts: Dict[str, Dict[str, Any]], fsync: bool = True) -> int:
+    """Atomically replace the snapshot with minified JSON; returns bytes written"""
+    data = json.dumps({"journal_segment": segment, "accounts": accounts}, separators=(",", ":")).encode()
+    return _replace(path, data, fsync)
+
+
+def shard_of(account_number: str, shards: int) -> int:
+    """The shard an account belongs to; stable across processes and restarts"""
+    return zlib.crc32(account_number.encode()) % shards
+
+
+class ShardedSnapshot:
+    """The snapshot split into `shards` files keyed by a hash of account_number.
+
+    With one shard this is the single snapshot file read_snapshot() and
+    write_snapshot() have always handled. With more, that file becomes a
+    manifest, {"journal_segment": N, "shards": [file, ...]}, naming one file
+    per shard, and each snapshot rewrites only the shards its journal
+    records touched. Shard files carry the segment they were written at in
+    their name and are never overwritten: the manifest is replaced last, so
+    a crash mid-snapshot leaves the previous manifest and every file it
+    names intact.
+
+    Any layout on disk loads, whatever the configured shard count; when the
+    two differ the next snapshot rewrites every shard (see reshard.py to do
+    that offline).
+    """
+
+    def __init__(self, path: str, shards: int = 1, previous=None):
+        self.path = path
+        self.shards = max(1, shards)
+        self.previous = previous
+        self.directory = os.path.dirname(os.path.abspath(path))
+        root, ext = os.path.splitext(os.path.basename(path))
+        self._prefix = root + "."
+        self._ext = ext
+        self._file_pattern = re.compile(re.escape(root) + r"\.\d{3}\.\d{8}" + re.escape(ext) + "$")
+        self._shards_written = 0
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def remove(self) -> None:
+        if self.exists():
+            os.remove(self.path)
+        self.remove_unused([])
+
+    def _shard_file(self, shard: int, segment: int) -> str:
+        return f"{self._prefix}{shard:03d}.{segment:08d}{self._ext}"
+
+    def _read(self, name: str) -> Tuple[Dict[str, Any], int]:
+        with open(os.path.join(self.directory, name), "rb") as f:
+            data = f.read()
+        return json.loads(data), len(data)
+
+    def manifest(self) -> Tuple[int, Optional[List[str]]]:
+        """Return (last journal segment covered, shard files), or None for the files when unsharded"""
+        if not os.path.exists(self.path):
+            return -1, None
+        snapshot, _ = self._read(os.path.basename(self.path))
+        if "journal_segment" in snapshot and "shards" in snapshot:
+            return snapshot["journal_segment"], snapshot["shards"]
+        return snapshot.get("journal_segment", -1) if "accounts" in snapshot else -1, None
+
+    def load(self) -> Tuple[int, Dict[str, Dict[str, Any]], int]:
+        """Return (last journal segment covered, every account, bytes read)"""
+        if not self.exists() and self.previous is not None and self.previous.exists():
+            return self.previous.load()
+        covered, files = self.manifest()
+        if files is None:
+            return read_snapshot(self.path)
+        accounts: Dict[str, Dict[str, Any]] = {}
+        total = 0
+        for name in files:
+            shard, size = self._read(name)
+            accounts.update(shard["accounts"])
+            total += size
+        return covered, accounts, total
+
+    def matches(self, files: Optional[List[str]]) -> bool:
+        """Whether files, from manifest(), are laid out for the configured shard count"""
+        if files is None:
+            return self.shards == 1
+        return self.shards > 1 and len(files) == self.shards
+
+    def load_shards(self, files: List[str], shards: Iterable[int]) -> Tuple[Dict[str, Dict[str, Any]], int]:
+        """Return the accounts of the given shards of a matching layout, and bytes read"""
+        accounts: Dict[str, Dict[str, Any]] = {}
+        total = 0
+        for shard in shards:
+            data, size = self._read(files[shard])
+            accounts.update(data["accounts"])
+            total += size
+        return accounts, total
+
+    def write(self, segment: int, accounts: Dict[str, Dict[str, Any]], shards: Iterable[int],
+              files: Optional[List[str]], fsync: bool = True) -> int:
+        """Write the given shards of accounts, covering segment; returns bytes written.
+
+        files is the current layout from manifest(); shards not listed are
+        kept from it, so it must match unless every shard is listed.
+        """
+        if self.shards == 1:
+            written = write_snapshot(self.path, segment, accounts, fsync=fsync)
+            self.remove_unused([])
+            return written
+        split: Dict[int, Dict[str, Dict[str, Any]]] = {shard: {} for shard in shards}
+        for account_number, account in accounts.items():
+            shard = shard_of(account_number, self.shards)
+            if shard in split:
+                split[shard][account_number] = account
+        names = list(files) if self.matches(files) else [""] * self.shards
+        written = 0
+        for shard, shard_accounts in sorted(split.items()):
+            names[shard] = self._shard_file(shard, segment)
+            written += write_snapshot(os.path.join(self.directory, names[shard]), segment, shard_accounts,
+                                      fsync=fsync)
+        if "" in names:
+            raise ValueError("A sharded snapshot layout change must rewrite every shard")
+        data = json.dumps({"journal_segment": segment, "shards": names}).encode()
+        written += _replace(self.path, data, fsync)
+        self.remove_unused(names)
+        return written
+
+    def fold(self, sealed: int, replay: Callable[..., Iterator[Dict[str, Any]]],
+             apply: Callable[[Dict[str, Any], Dict[str, Any]], None],
+             touched: Callable[[Dict[str, Any]], Iterable[str]], fsync: bool = True) -> Tuple[int, int]:
+        """Bring the snapshot up to the sealed journal segment; returns (bytes read, bytes written)"""
+        covered, files = self.manifest()
+        if files is not None and self.matches(files):
+            # Only the shards these records touch are read and rewritten
+            dirty = set()
+            for record in replay(after=covered, upto=sealed):
+                dirty.update(shard_of(account_number, self.shards) for account_number in touched(record))
+                if len(dirty) == self.shards:
+                    break
+            shards = sorted(dirty)
+            accounts, read = self.load_shards(files, shards)
+        else:
+            shards = list(range(self.shards))
+            covered, accounts, read = self.load()
+        for record in replay(after=covered, upto=sealed):
+            apply(accounts, record)
+        written = self.write(sealed, accounts, shards, files, fsync=fsync)
+        if self.previous is not None and self.previous.exists():
+            self.previous.remove()
+        self._shards_written += len(shards)
+        return read, written
+
+    def stats(self) -> Dict[str, Any]:
+        return {"snapshot_shards": self.shards, "snapshot_shards_written": self._shards_written}
+
+    def close(self) -> None:
+        pass
+
+    def remove_unused(self, files: List[str]) -> None:
+        """Delete shard files the manifest no longer names, including ones left by a crash"""
+        keep = set(files)
+        for name in os.listdir(self.directory):
+            if name not in keep and self._file_pattern.match(name):
+                os.remove(os.path.join(self.directory, name))
+
+
+def open_snapshot(path: str, snapshot_format: str = "json", shards: int = 1):
+    """The snapshot layout for a format, "json" (sharded) or "binary" (BalanceFile).
+
+    The binary file sits beside the JSON one as <root>.bin. Each layout
+    falls back to loading the other when its own files do not exist yet,
+    and removes them once it has written its own, so switching formats
+    migrates the accounts at the first snapshot.
+    """
+    binary_path = os.path.splitext(path)[0] + ".bin"
+    if snapshot_format == "binary":
+        return BalanceFile(binary_path, previous=ShardedSnapshot(path, shards))
+    if snapshot_format == "json":
+        return ShardedSnapshot(path, shards, previous=BalanceFile(binary_path))
+    raise ValueError(f"Unknown snapshot format: {snapshot_format}")
+
+
+class Snapshotter:
+    """Background compaction of the journal into the snapshot.
+
+    A snapshot is taken once `max_records` records have been journaled since
+    the last one, or every `interval` seconds while there is anything new.
+    It seals the current journal segment, has the snapshot layout (a
+    ShardedSnapshot or a BalanceFile) fold the sealed segments into what it
+    holds with `apply`, touching only what `touched` says the records change,
+    calls `before_remove` (so anything derived from those segments can be
+    made durable) and deletes the segments. The live account map is never
+    read, so requests are not blocked; a crash at any step leaves either the
+    old or the new snapshot plus every segment it does not cover.
+    """
+
+    def __init__(self, snapshot, journal: Journal, apply: Callable[[Dict[str, Any], Dict[str, Any]], None],
+                 touched: Callable[[Dict[str, Any]], Iterable[str]],
+                 interval: float = 0.0, max_records: int = 0, backlog: int = 0, fsync: bool = True,
+                 before_remove: Optional[Callable[[], None]] = None):
+        self.layout = snapshot
+        self.journal = journal
+        self.apply = apply
+        self.touched = touched
+        self.interval = interval
+        self.max_records = max_records
+        self.fsync = fsync
+        self.before_remove = before_remove
+        self._backlog = backlog
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._snapshots = 0
+        self._bytes_read = 0
+        self._bytes_written = 0
+        self._last_seconds = 0.0
+        self._last_finished = time.monotonic()
+        # Read from the layout between folds only, so stats() never waits for one
+        self._layout_stats = snapshot.stats()
+
+    def start(self) -> None:
+        if self.interval <= 0 and self.max_records <= 0:
+            return
+        self._thread = threading.Thread(target=self._run, name="snapshotter", daemon=True)
+        self._thread.start()
+
+    def _due(self) -> bool:
+        pending = self._backlog + self.journal.segment_records()
+        if pending == 0:
+            return False
+        if self.max_records > 0 and pending >= self.max_records:
+            return True
+        return self.interval > 0 and time.monotonic() - self._last_finished >= self.interval
+
+    def _run(self) -> None:
+        while not self._stop.wait(1.0):
+            if self._due():
+                self.snapshot()
+
+    def snapshot(self) -> int:
+        """Fold every sealed segment into the snapshot now; returns the last segment covered"""
+        with self._lock:
+            started = time.perf_counter()
+            sealed = self.journal.rotate()
+            read, written = self.layout.fold(sealed, self.journal.replay, self.apply, self.touched,
+                                             fsync=self.fsync)
+            if self.before_remove is not None:
+                self.before_remove()
+            self.journal.remove_segments(sealed)
+            self._backlog = 0
+            self._last_finished = time.monotonic()
+            layout_stats = self.layout.stats()
+            with self._stats_lock:
+                self._layout_stats = layout_stats
+                self._snapshots += 1
+                self._bytes_read += read
+                self._bytes_written += written
+                self._last_seconds = time.perf_counter() - started
+            return sealed
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            stats = {
+                "snapshots": self._snapshots,
+                "snapshot_fold_bytes_read": self._bytes_read,
+                "snapshot_bytes_written": self._bytes_written,
+                "last_snapshot_seconds": self._last_seconds
+            }
+            stats.update(self._layout_stats)
+            return stats
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
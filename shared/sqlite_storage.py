@@ -0,0 +1,422 @@
+import datetime
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from shared.accounts import (
+    AccountAlreadyExists, AccountNotFound, AccountNumberTaken, NonZeroBalance, apply_logged, opening_balance,
+    plan_operation, round_cents, run_batch
+)
+from shared.idempotency import PENDING_SECONDS, IdempotencyKeyInUse, IdempotencyKeyReused
+from shared.storage import Storage
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    password_hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS accounts (
+    account_number TEXT PRIMARY KEY,
+    username TEXT NOT NULL,
+    balance REAL NOT NULL,
+    is_active INTEGER NOT NULL DEFAULT 1,
+    created_at TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS accounts_active_username ON accounts(username) WHERE is_active = 1;
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    account_number TEXT NOT NULL,
+    type TEXT NOT NULL,
+    amount REAL NOT NULL,
+    balance REAL NOT NULL,
+    counterparty TEXT,
+    timestamp TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transactions_account ON transactions(account_number, id);
+CREATE INDEX IF NOT EXISTS transactions_account_time ON transactions(account_number, timestamp);
+CREATE TABLE IF NOT EXISTS refresh_tokens (
+    digest TEXT PRIMARY KEY,
+    username TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS refresh_tokens_expiry ON refresh_tokens(expires_at);
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    username TEXT NOT NULL,
+    key TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    status INTEGER,
+    body TEXT,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (username, key)
+);
+CREATE INDEX IF NOT EXISTS idempotency_keys_expiry ON idempotency_keys(expires_at);
+"""
+
+# Statements are kept as constants so sqlite3's per-connection statement cache
+# prepares each one once and reuses it
+SELECT_PASSWORD_HASH = "SELECT password_hash FROM users WHERE username = ?"
+INSERT_USER = "INSERT OR IGNORE INTO users (username, password_hash) VALUES (?, ?)"
+SELECT_ACCOUNT = "SELECT * FROM accounts WHERE account_number = ?"
+SELECT_ACTIVE_ACCOUNT = "SELECT * FROM accounts WHERE username = ? AND is_active = 1"
+INSERT_ACCOUNT = ("INSERT INTO accounts (account_number, username, balance, is_active, created_at) "
+                  "VALUES (?, ?, ?, 1, ?)")
+SET_BALANCE = "UPDATE accounts SET balance = ? WHERE account_number = ?"
+DEACTIVATE_ACCOUNT = "UPDATE accounts SET is_active = 0 WHERE account_number = ?"
+DELETE_ACCOUNT = "DELETE FROM accounts WHERE account_number = ?"
+IMPORT_ACCOUNT = ("INSERT OR IGNORE INTO accounts (account_number, username, balance, is_active, created_at) "
+                  "VALUES (:account_number, :username, :balance, :is_active, :created_at)")
+SELECT_USERS_AFTER = "SELECT username, password_hash FROM users WHERE username > ? ORDER BY username LIMIT ?"
+SELECT_ACCOUNTS_AFTER = "SELECT * FROM accounts WHERE account_number > ? ORDER BY account_number LIMIT ?"
+EXPORT_CHUNK = 1000
+INSERT_TRANSACTION = ("INSERT INTO transactions (account_number, type, amount, balance, counterparty, timestamp) "
+                      "VALUES (:account_number, :type, :amount, :balance, :counterparty, :timestamp)")
+# Keyset pagination: the (account_number, id) index makes every page cost the same
+SELECT_TRANSACTIONS = ("SELECT id, type, amount, balance, counterparty, timestamp FROM transactions "
+                       "WHERE account_number = ? AND id > ? AND timestamp >= ? AND timestamp < ? "
+                       "ORDER BY id LIMIT ?")
+TRANSACTIONS_CHUNK = 500
+INSERT_REFRESH_TOKEN = "INSERT OR REPLACE INTO refresh_tokens (digest, username, expires_at) VALUES (?, ?, ?)"
+SELECT_REFRESH_TOKEN = "SELECT username FROM refresh_tokens WHERE digest = ? AND expires_at > ?"
+DELETE_REFRESH_TOKEN = "DELETE FROM refresh_tokens WHERE digest = ?"
+DELETE_EXPIRED_REFRESH_TOKENS = "DELETE FROM refresh_tokens WHERE expires_at <= ?"
+# Expired refresh tokens are deleted on a write at most this often (seconds)
+REFRESH_TOKEN_SWEEP_INTERVAL = 60.0
+# Expired idempotency keys are deleted, and the size bound enforced, at most this often (seconds)
+IDEMPOTENCY_SWEEP_INTERVAL = 60.0
+# A claimed key has a NULL status until its response is stored
+SELECT_IDEMPOTENCY_KEY = ("SELECT fingerprint, status, body FROM idempotency_keys "
+                          "WHERE username = ? AND key = ? AND expires_at > ?")
+CLAIM_IDEMPOTENCY_KEY = ("INSERT OR REPLACE INTO idempotency_keys (username, key, fingerprint, status, body, expires_at) "
+                         "VALUES (?, ?, ?, NULL, NULL, ?)")
+STORE_IDEMPOTENCY_KEY = ("UPDATE idempotency_keys SET status = ?, body = ?, expires_at = ? "
+                         "WHERE username = ? AND key = ? AND status IS NULL")
+DELETE_IDEMPOTENCY_CLAIM = "DELETE FROM idempotency_keys WHERE username = ? AND key = ? AND status IS NULL"
+DELETE_EXPIRED_IDEMPOTENCY_KEYS = "DELETE FROM idempotency_keys WHERE expires_at <= ?"
+COUNT_IDEMPOTENCY_KEYS = "SELECT COUNT(*), COUNT(*) - COUNT(status) FROM idempotency_keys"
+DELETE_OLDEST_IDEMPOTENCY_KEYS = ("DELETE FROM idempotency_keys WHERE rowid IN "
+                                  "(SELECT rowid FROM idempotency_keys WHERE status IS NOT NULL ORDER BY expires_at LIMIT ?)")
+
+
+def _log(conn: sqlite3.Connection, entries: List[Dict[str, Any]], timestamp: str) -> None:
+    conn.executemany(INSERT_TRANSACTION, [dict(entry, counterparty=entry.get("counterparty"), timestamp=timestamp)
+                                          for entry in entries])
+
+
+def _now() -> str:
+    return datetime.datetime.utcnow().isoformat()
+
+
+def _account(row: sqlite3.Row) -> Dict[str, Any]:
+    account = dict(row)
+    account["is_active"] = bool(account["is_active"])
+    return account
+
+
+class SqliteStorage(Storage):
+    """SQLite database in WAL mode with one connection per thread.
+
+    Mutations run in BEGIN IMMEDIATE transactions, which take SQLite's write
+    lock up front, so concurrent threads and processes serialize their
+    read-modify-write cycles while readers keep going against the WAL.
+    """
+
+    process_safe = True
+
+    def __init__(self, path: str, fsync: bool = True, busy_timeout: float = 5.0, idempotency_size: int = 10000,
+                 idempotency_ttl: float = 3600.0):
+        self.path = path
+        self.fsync = fsync
+        self.busy_timeout = busy_timeout
+        self.idempotency_size = idempotency_size
+        self.idempotency_ttl = idempotency_ttl
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._last_sweep = 0.0
+        self._swept = 0
+        self._last_idempotency_sweep = 0.0
+        self._idempotency_counts = {"hits": 0, "misses": 0, "conflicts": 0, "mismatches": 0, "evictions": 0,
+                                    "expirations": 0}
+        self._counts_lock = threading.Lock()
+        conn = self._connection()
+        conn.executescript(SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.path,
+                timeout=self.busy_timeout,
+                isolation_level=None,
+                check_same_thread=False,
+                cached_statements=64
+            )
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=" + ("FULL" if self.fsync else "NORMAL"))
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _active_account(self, conn: sqlite3.Connection, username: str) -> Dict[str, Any]:
+        row = conn.execute(SELECT_ACTIVE_ACCOUNT, (username,)).fetchone()
+        if row is None:
+            raise AccountNotFound(username)
+        return _account(row)
+
+    def get_password_hash(self, username: str) -> Optional[str]:
+        row = self._connection().execute(SELECT_PASSWORD_HASH, (username,)).fetchone()
+        return row["password_hash"] if row else None
+
+    def add_user(self, username: str, password_hash: str) -> bool:
+        cursor = self._connection().execute(INSERT_USER, (username, password_hash))
+        return cursor.rowcount == 1
+
+    def get_account(self, account_number: str) -> Optional[Dict[str, Any]]:
+        row = self._connection().execute(SELECT_ACCOUNT, (account_number,)).fetchone()
+        return _account(row) if row else None
+
+    def find_account(self, username: str) -> Optional[Dict[str, Any]]:
+        row = self._connection().execute(SELECT_ACTIVE_ACCOUNT, (username,)).fetchone()
+        return _account(row) if row else None
+
+    def create_account(self, username: str, account_number: str, initial_balance: float) -> Dict[str, Any]:
+        # Validated and rounded like AccountStore.create, so both backends hold the same balances
+        initial_balance = opening_balance(initial_balance)
+        created_at = datetime.datetime.utcnow().isoformat()
+        with self._transaction() as conn:
+            if conn.execute(SELECT_ACTIVE_ACCOUNT, (username,)).fetchone() is not None:
+                raise AccountAlreadyExists(username)
+            try:
+                conn.execute(INSERT_ACCOUNT, (account_number, username, initial_balance, created_at))
+            except sqlite3.IntegrityError:
+                raise AccountNumberTaken(account_number)
+            _log(conn, [{"account_number": account_number, "type": "open",
+                         "amount": initial_balance, "balance": initial_balance}], created_at)
+        return {
+            "account_number": account_number,
+            "username": username,
+            "balance": initial_balance,
+            "is_active": True,
+            "created_at": created_at
+        }
+
+    def _load_accounts(self, conn: sqlite3.Connection, username: str,
+                       operations: List[Dict[str, Any]]) -> Tuple[str, Dict[str, Dict[str, Any]]]:
+        # The acting account plus every recipient that exists, as plan_operation expects
+        account = self._active_account(conn, username)
+        accounts = {account["account_number"]: account}
+        for operation in operations:
+            to_account_number = operation.get("to_account_number")
+            if isinstance(to_account_number, str) and to_account_number not in accounts:
+                row = conn.execute(SELECT_ACCOUNT, (to_account_number,)).fetchone()
+                if row is not None:
+                    accounts[to_account_number] = _account(row)
+        return account["account_number"], accounts
+
+    def _apply_operation(self, username: str, operation: Dict[str, Any]) -> Dict[str, Any]:
+        # Validated and rounded to the cent by the same plan_operation as the JSON store
+        with self._transaction() as conn:
+            account_number, accounts = self._load_accounts(conn, username, [operation])
+            entries = apply_logged(accounts, plan_operation(accounts, account_number, operation))
+            conn.executemany(SET_BALANCE, [(a["balance"], n) for n, a in accounts.items()])
+            _log(conn, entries, _now())
+        return accounts[account_number]
+
+    def deposit(self, username: str, amount: float) -> Dict[str, Any]:
+        return self._apply_operation(username, {"type": "deposit", "amount": amount})
+
+    def withdraw(self, username: str, amount: float) -> Dict[str, Any]:
+        return self._apply_operation(username, {"type": "withdraw", "amount": amount})
+
+    def transfer(self, username: str, to_account_number: str, amount: float) -> Dict[str, Any]:
+        return self._apply_operation(username, {"type": "transfer", "to_account_number": to_account_number,
+                                                "amount": amount})
+
+    def close_account(self, username: str, remove: bool = False) -> Dict[str, Any]:
+        with self._transaction() as conn:
+            account = self._active_account(conn, username)
+            if account["balance"] > 0:
+                raise NonZeroBalance(account["account_number"])
+            conn.execute(DELETE_ACCOUNT if remove else DEACTIVATE_ACCOUNT, (account["account_number"],))
+            _log(conn, [{"account_number": account["account_number"], "type": "close",
+                         "amount": 0.0, "balance": account["balance"]}], _now())
+        return account
+
+    def apply_batch(self, username: str, operations: List[Dict[str, Any]], continue_on_error: bool = False) -> list:
+        with self._transaction() as conn:
+            account_number, accounts = self._load_accounts(conn, username, operations)
+            records, outcomes = run_batch(accounts, account_number, operations, continue_on_error)
+            entries = []
+            for record in records:
+                entries.extend(apply_logged(accounts, record))
+            conn.executemany(SET_BALANCE, [(a["balance"], n) for n, a in accounts.items()])
+            _log(conn, entries, _now())
+        return outcomes
+
+    def list_transactions(self, username: str, after: Optional[int] = None, start: Optional[str] = None,
+                          end: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        account = self.find_account(username)
+        if account is None:
+            raise AccountNotFound(username)
+        return self._transactions(account["account_number"], after or 0, start or "", end or "\uffff")
+
+    def _transactions(self, account_number: str, after: int, start: str, end: str) -> Iterator[Dict[str, Any]]:
+        # Fetch in chunks so long exports never hold more than one chunk in memory; a
+        # streamed response may resume on another thread, so look the connection up each time
+        while True:
+            rows = self._connection().execute(SELECT_TRANSACTIONS, (account_number, after, start, end, TRANSACTIONS_CHUNK)).fetchall()
+            for row in rows:
+                entry = dict(row)
+                if entry["counterparty"] is None:
+                    del entry["counterparty"]
+                yield entry
+            if len(rows) < TRANSACTIONS_CHUNK:
+                return
+            after = rows[-1]["id"]
+
+    def _iter_rows(self, statement: str) -> Iterator[sqlite3.Row]:
+        # Keyset pagination on the primary key, one chunk in memory at a time
+        after = ""
+        while True:
+            rows = self._connection().execute(statement, (after, EXPORT_CHUNK)).fetchall()
+            yield from rows
+            if len(rows) < EXPORT_CHUNK:
+                return
+            after = rows[-1][0]
+
+    def iter_users(self) -> Iterator[Tuple[str, str]]:
+        for row in self._iter_rows(SELECT_USERS_AFTER):
+            yield row["username"], row["password_hash"]
+
+    def iter_accounts(self) -> Iterator[Dict[str, Any]]:
+        for row in self._iter_rows(SELECT_ACCOUNTS_AFTER):
+            yield _account(row)
+
+    def import_users(self, users: List[Tuple[str, str]]) -> int:
+        with self._transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(INSERT_USER, users)
+            return conn.total_changes - before
+
+    def import_accounts(self, accounts: List[Dict[str, Any]]) -> List[str]:
+        added = []
+        with self._transaction() as conn:
+            # OR IGNORE skips taken numbers and, through the partial unique
+            # index, second active accounts for a username
+            for account in accounts:
+                account = dict(account, balance=round_cents(account["balance"]))
+                if conn.execute(IMPORT_ACCOUNT, account).rowcount == 1:
+                    added.append(account)
+            _log(conn, [{"account_number": account["account_number"], "type": "open",
+                         "amount": account["balance"], "balance": account["balance"]} for account in added],
+                 _now())
+        return [account["account_number"] for account in added]
+
+    def _sweep_refresh_tokens(self, conn: sqlite3.Connection, now: float) -> None:
+        if now - self._last_sweep < REFRESH_TOKEN_SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        self._swept += conn.execute(DELETE_EXPIRED_REFRESH_TOKENS, (now,)).rowcount
+
+    def add_refresh_token(self, digest: str, username: str, expires_at: float) -> None:
+        with self._transaction() as conn:
+            conn.execute(INSERT_REFRESH_TOKEN, (digest, username, expires_at))
+            self._sweep_refresh_tokens(conn, time.time())
+
+    def rotate_refresh_token(self, digest: str, new_digest: str, expires_at: float) -> Optional[str]:
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(SELECT_REFRESH_TOKEN, (digest, now)).fetchone()
+            if row is None:
+                return None
+            conn.execute(DELETE_REFRESH_TOKEN, (digest,))
+            conn.execute(INSERT_REFRESH_TOKEN, (new_digest, row["username"], expires_at))
+            self._sweep_refresh_tokens(conn, now)
+            return row["username"]
+
+    def revoke_refresh_token(self, digest: str) -> bool:
+        return self._connection().execute(DELETE_REFRESH_TOKEN, (digest,)).rowcount == 1
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._counts_lock:
+            self._idempotency_counts[name] += amount
+
+    def _sweep_idempotency_keys(self, conn: sqlite3.Connection, now: float) -> None:
+        # The size bound is enforced here too, so it may be overshot for up to a sweep interval
+        if now - self._last_idempotency_sweep < IDEMPOTENCY_SWEEP_INTERVAL:
+            return
+        self._last_idempotency_sweep = now
+        self._count("expirations", conn.execute(DELETE_EXPIRED_IDEMPOTENCY_KEYS, (now,)).rowcount)
+        keys, in_flight = conn.execute(COUNT_IDEMPOTENCY_KEYS).fetchone()
+        size = keys - in_flight
+        if size > self.idempotency_size:
+            self._count("evictions", conn.execute(DELETE_OLDEST_IDEMPOTENCY_KEYS,
+                                                  (size - self.idempotency_size,)).rowcount)
+
+    def begin_idempotent(self, username: str, key: str, fingerprint: str) -> Optional[Tuple[int, Any]]:
+        # Every worker process opens the same database, so a retry finds the key whichever one it reaches
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(SELECT_IDEMPOTENCY_KEY, (username, key, now)).fetchone()
+            if row is not None:
+                if row["fingerprint"] != fingerprint:
+                    self._count("mismatches")
+                    raise IdempotencyKeyReused(key)
+                if row["status"] is None:
+                    self._count("conflicts")
+                    raise IdempotencyKeyInUse(key)
+                self._count("hits")
+                return row["status"], json.loads(row["body"])
+            conn.execute(CLAIM_IDEMPOTENCY_KEY, (username, key, fingerprint, now + PENDING_SECONDS))
+            self._sweep_idempotency_keys(conn, now)
+        self._count("misses")
+        return None
+
+    def finish_idempotent(self, username: str, key: str, status: int, body: Any) -> None:
+        conn = self._connection()
+        if status < 500 and self.idempotency_size > 0:
+            conn.execute(STORE_IDEMPOTENCY_KEY, (status, json.dumps(body), time.time() + self.idempotency_ttl,
+                                                 username, key))
+        else:
+            conn.execute(DELETE_IDEMPOTENCY_CLAIM, (username, key))
+
+    def abandon_idempotent(self, username: str, key: str) -> None:
+        self._connection().execute(DELETE_IDEMPOTENCY_CLAIM, (username, key))
+
+    def stats(self) -> Dict[str, Any]:
+        size, in_flight = self._connection().execute(COUNT_IDEMPOTENCY_KEYS).fetchone()
+        with self._counts_lock:
+            stats = {"idempotency_" + name: count for name, count in self._idempotency_counts.items()}
+        lookups = stats["idempotency_hits"] + stats["idempotency_misses"]
+        stats.update({
+            "idempotency_size": size - in_flight,
+            "idempotency_maxsize": self.idempotency_size,
+            "idempotency_ttl_seconds": self.idempotency_ttl,
+            "idempotency_in_flight": in_flight,
+            "idempotency_hit_ratio": stats["idempotency_hits"] / lookups if lookups else 0.0
+        })
+        with self._connections_lock:
+            stats.update({"connections": len(self._connections), "refresh_tokens_swept": self._swept})
+        return stats
+
+    def close(self) -> None:
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
@@ -0,0 +1,308 @@
+import os
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory locks, one process per data directory is up to the operator
+    fcntl = None
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from shared.accounts import AccountStore
+from shared.idempotency import IdempotencyCache
+from shared.tokens import RefreshTokenStore
+from shared.users import UserStore
+
+# Storage methods the servers call per request, for timing in shared.metrics. list_transactions
+# is left out: it returns a lazy iterator, so the work happens while the response is written
+STORAGE_OPERATIONS = (
+    "get_password_hash", "add_user", "get_account", "find_account", "create_account",
+    "deposit", "withdraw", "transfer", "close_account", "apply_batch",
+    "import_users", "import_accounts", "add_refresh_token", "rotate_refresh_token", "revoke_refresh_token",
+    "begin_idempotent", "finish_idempotent"
+)
+
+
+class Storage:
+    """Persistence interface used by both servers for users and accounts.
+
+    Account methods raise the AccountError subclasses from shared.accounts
+    and return plain account dicts. Backends that answer get_account and
+    find_account from memory, without blocking, set memory_reads. Backends
+    that several processes may open at once set process_safe; the others are
+    shared between worker processes through shared.remote_storage.
+    """
+
+    memory_reads = False
+    process_safe = False
+
+    def get_password_hash(self, username: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def add_user(self, username: str, password_hash: str) -> bool:
+        """Store a new user; returns False if the username is taken"""
+        raise NotImplementedError
+
+    def get_account(self, account_number: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def find_account(self, username: str) -> Optional[Dict[str, Any]]:
+        """Return the user's active account, if any"""
+        raise NotImplementedError
+
+    def create_account(self, username: str, account_number: str, initial_balance: float) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def deposit(self, username: str, amount: float) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def withdraw(self, username: str, amount: float) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def transfer(self, username: str, to_account_number: str, amount: float) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def close_account(self, username: str, remove: bool = False) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def apply_batch(self, username: str, operations: List[Dict[str, Any]], continue_on_error: bool = False) -> list:
+        """Apply deposit/withdraw/transfer operations in order under one commit.
+
+        Returns one outcome per operation: the account after it was applied or
+        the AccountError that rejected it. Without continue_on_error the first
+        rejection raises BatchAborted and nothing is applied.
+        """
+        raise NotImplementedError
+
+    def list_transactions(self, username: str, after: Optional[int] = None, start: Optional[str] = None,
+                          end: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """Yield the history of the user's active account, oldest first.
+
+        Entries have an increasing integer id; `after` resumes past a given id
+        and start/end bound the ISO-8601 timestamp (start inclusive, end
+        exclusive). Raises AccountNotFound when the user has no active account.
+        """
+        raise NotImplementedError
+
+    def iter_users(self) -> Iterator[Tuple[str, str]]:
+        """Yield (username, password_hash) for every user, for export"""
+        raise NotImplementedError
+
+    def iter_accounts(self) -> Iterator[Dict[str, Any]]:
+        """Yield every account, active or not, for export"""
+        raise NotImplementedError
+
+    def import_users(self, users: List[Tuple[str, str]]) -> int:
+        """Add (username, password_hash) pairs in one write; existing usernames
+        are left alone. Returns how many were added."""
+        raise NotImplementedError
+
+    def import_accounts(self, accounts: List[Dict[str, Any]]) -> List[str]:
+        """Add complete account dicts in one commit, skipping taken account
+        numbers and active accounts for users that already have one. Returns
+        the account numbers that were added."""
+        raise NotImplementedError
+
+    def add_refresh_token(self, digest: str, username: str, expires_at: float) -> None:
+        """Store a refresh token, keyed by its digest, until expires_at (epoch seconds)"""
+        raise NotImplementedError
+
+    def rotate_refresh_token(self, digest: str, new_digest: str, expires_at: float) -> Optional[str]:
+        """Atomically replace a live refresh token with a new one for the same user.
+
+        Returns the username, or None (storing nothing) when the token is
+        unknown, revoked, already rotated or expired.
+        """
+        raise NotImplementedError
+
+    def revoke_refresh_token(self, digest: str) -> bool:
+        raise NotImplementedError
+
+    def begin_idempotent(self, username: str, key: str, fingerprint: str) -> Optional[Tuple[int, Any]]:
+        """Return the (status, body) stored for the user's Idempotency-Key, or claim it and return None.
+
+        Raises IdempotencyKeyInUse while another request holds the claim and
+        IdempotencyKeyReused when the key was used with another fingerprint.
+        Backends shared by several worker processes keep the keys where all
+        of them see the same ones.
+        """
+        raise NotImplementedError
+
+    def finish_idempotent(self, username: str, key: str, status: int, body: Any) -> None:
+        """Store the response to a claimed key; server errors (status 500 and up) release the claim"""
+        raise NotImplementedError
+
+    def abandon_idempotent(self, username: str, key: str) -> None:
+        raise NotImplementedError
+
+    def run_idempotent(self, username: str, key: str, fingerprint: str,
+                       handler: Callable[[], Tuple[int, Any]]) -> Tuple[int, Any, bool]:
+        """Return (status, body, replayed), calling handler only for a key not seen before"""
+        stored = self.begin_idempotent(username, key, fingerprint)
+        if stored is not None:
+            return stored[0], stored[1], True
+        try:
+            status, body = handler()
+        except BaseException:
+            self.abandon_idempotent(username, key)
+            raise
+        self.finish_idempotent(username, key, status, body)
+        return status, body, False
+
+    def stats(self) -> Dict[str, Any]:
+        """Numeric counters for the metrics endpoint"""
+        return {}
+
+    def startup_summary(self) -> Optional[str]:
+        """One line describing how the backend was loaded, for the server log"""
+        return None
+
+    def close(self) -> None:
+        pass
+
+
+class StorageLocked(RuntimeError):
+    """Raised when another process already has the JSON files open"""
+
+
+class JsonStorage(Storage):
+    """The user credential file plus the journaled, resident AccountStore.
+
+    Users live in <users>.jsonl next to the configured users.json, which is
+    converted on first start (see UserStore), and refresh tokens in
+    refresh_tokens.jsonl beside it. Idempotency keys are only kept in memory.
+
+    Only one process may have the files open: the account map lives in its
+    memory, so a second writer would silently diverge. An exclusive lock on
+    <accounts>.lock enforces that.
+    """
+
+    memory_reads = True
+
+    def __init__(self, users_path: str, accounts_path: str, journal_path: str, history_path: str,
+                 idempotency_size: int = 10000, idempotency_ttl: float = 3600.0, **store_options):
+        self._lock_file = open(accounts_path + ".lock", "a")
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self._lock_file.close()
+                raise StorageLocked(f"{accounts_path} is in use by another process; start extra workers "
+                                    "with --workers so they share it")
+        self.users_path = os.path.splitext(users_path)[0] + ".jsonl"
+        fsync = store_options.get("fsync", True)
+        self.users = UserStore(self.users_path, legacy_path=users_path, fsync=fsync)
+        self.refresh_tokens = RefreshTokenStore(
+            os.path.join(os.path.dirname(users_path), "refresh_tokens.jsonl"), fsync=fsync)
+        self.accounts = AccountStore(accounts_path, journal_path, history_path, **store_options)
+        self.idempotency = IdempotencyCache(idempotency_size, idempotency_ttl)
+
+    def get_password_hash(self, username: str) -> Optional[str]:
+        return self.users.get(username)
+
+    def add_user(self, username: str, password_hash: str) -> bool:
+        return self.users.add(username, password_hash)
+
+    def get_account(self, account_number: str) -> Optional[Dict[str, Any]]:
+        return self.accounts.get(account_number)
+
+    def find_account(self, username: str) -> Optional[Dict[str, Any]]:
+        return self.accounts.find_active(username)
+
+    def create_account(self, username: str, account_number: str, initial_balance: float) -> Dict[str, Any]:
+        return self.accounts.create(username, account_number, initial_balance)
+
+    def deposit(self, username: str, amount: float) -> Dict[str, Any]:
+        return self.accounts.deposit(username, amount)
+
+    def withdraw(self, username: str, amount: float) -> Dict[str, Any]:
+        return self.accounts.withdraw(username, amount)
+
+    def transfer(self, username: str, to_account_number: str, amount: float) -> Dict[str, Any]:
+        return self.accounts.transfer(username, to_account_number, amount)
+
+    def close_account(self, username: str, remove: bool = False) -> Dict[str, Any]:
+        return self.accounts.close(username, remove=remove)
+
+    def apply_batch(self, username: str, operations: List[Dict[str, Any]], continue_on_error: bool = False) -> list:
+        return self.accounts.batch(username, operations, continue_on_error)
+
+    def list_transactions(self, username: str, after: Optional[int] = None, start: Optional[str] = None,
+                          end: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        return self.accounts.transactions(username, after=after, start=start, end=end)
+
+    def iter_users(self) -> Iterator[Tuple[str, str]]:
+        return self.users.items()
+
+    def iter_accounts(self) -> Iterator[Dict[str, Any]]:
+        return self.accounts.iter_accounts()
+
+    def import_users(self, users: List[Tuple[str, str]]) -> int:
+        return self.users.add_many(users)
+
+    def import_accounts(self, accounts: List[Dict[str, Any]]) -> List[str]:
+        return self.accounts.load(accounts)
+
+    def add_refresh_token(self, digest: str, username: str, expires_at: float) -> None:
+        self.refresh_tokens.add(digest, username, expires_at)
+
+    def rotate_refresh_token(self, digest: str, new_digest: str, expires_at: float) -> Optional[str]:
+        return self.refresh_tokens.rotate(digest, new_digest, expires_at)
+
+    def revoke_refresh_token(self, digest: str) -> bool:
+        return self.refresh_tokens.revoke(digest)
+
+    def begin_idempotent(self, username: str, key: str, fingerprint: str) -> Optional[Tuple[int, Any]]:
+        return self.idempotency.begin(username, key, fingerprint)
+
+    def finish_idempotent(self, username: str, key: str, status: int, body: Any) -> None:
+        self.idempotency.finish(username, key, status, body)
+
+    def abandon_idempotent(self, username: str, key: str) -> None:
+        self.idempotency.abandon(username, key)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = self.accounts.stats()
+        for key, value in self.users.stats().items():
+            stats["users_" + key] = value
+        for key, value in self.refresh_tokens.stats().items():
+            stats["refresh_tokens_" + key] = value
+        for key, value in self.idempotency.stats().items():
+            stats["idempotency_" + key] = value
+        return stats
+
+    def startup_summary(self) -> Optional[str]:
+        store = self.accounts
+        return (f"Loaded {len(store.accounts)} accounts from {store.snapshot_path} and replayed "
+                f"{store.replayed_records} journal records in {store.load_seconds:.3f}s")
+
+    def close(self) -> None:
+        self.accounts.shutdown()
+        self.users.close()
+        self.refresh_tokens.close()
+        self._lock_file.close()
+
+
+def open_storage(backend: str, users_file: str, accounts_file: str, journal_file: str, history_file: str, sqlite_path: str,
+                 fsync: bool = True, group_window: float = 0.0, group_size: int = 256,
+                 lock_stripes: int = 256, snapshot_interval: float = 0.0, snapshot_records: int = 0,
+                 shards: int = 1, snapshot_format: str = "json", idempotency_size: int = 10000,
+                 idempotency_ttl: float = 3600.0) -> Storage:
+    """Build the storage backend named by the STORAGE_BACKEND setting"""
+    if backend == "json":
+        return JsonStorage(
+            users_file, accounts_file, journal_file, history_file,
+            idempotency_size=idempotency_size,
+            idempotency_ttl=idempotency_ttl,
+            fsync=fsync,
+            group_window=group_window,
+            group_size=group_size,
+            lock_stripes=lock_stripes,
+            snapshot_interval=snapshot_interval,
+            snapshot_records=snapshot_records,
+            shards=shards,
+            snapshot_format=snapshot_format
+        )
+    if backend == "sqlite":
+        from shared.sqlite_storage import SqliteStorage
+        return SqliteStorage(sqlite_path, fsync=fsync, idempotency_size=idempotency_size,
+                             idempotency_ttl=idempotency_ttl)
+    raise ValueError(f"Unknown storage backend: {backend}")
@@ -0,0 +1,202 @@
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import jwt
+
+
+class TokenCache:
+    """Bounded LRU of verified JWT claims, keyed by the SHA-256 digest of the token.
+
+    A hit skips jwt.decode entirely; entries are dropped once the token's exp
+    has passed, so an expired token always falls through to jwt.decode and
+    fails there. Access tokens are stateless and never revoked (revoking a
+    refresh token only stops new ones being issued), so a cached entry is
+    exactly as valid as the token it came from.
+    """
+
+    def __init__(self, secret: str, algorithms: Iterable[str] = ("HS256",), maxsize: int = 10000):
+        self.secret = secret
+        self.algorithms = list(algorithms)
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[bytes, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._decode_seconds = 0.0
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def decode(self, token: str) -> Dict[str, Any]:
+        """Return the token's claims, raising jwt.InvalidTokenError like jwt.decode"""
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                claims, expires_at = entry
+                if expires_at is None or time.time() < expires_at:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return dict(claims)
+                del self._entries[key]
+            self._misses += 1
+
+        started = time.perf_counter()
+        try:
+            claims = jwt.decode(token, self.secret, algorithms=self.algorithms)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._decode_seconds += elapsed
+        if self.maxsize > 0:
+            with self._lock:
+                self._entries[key] = (claims, claims.get("exp"))
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                    self._evictions += 1
+        return dict(claims)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "hit_ratio": self._hits / lookups if lookups else 0.0,
+                "decode_seconds_total": self._decode_seconds
+            }
+
+
+def new_refresh_token() -> str:
+    return secrets.token_urlsafe(32)
+
+
+def refresh_token_digest(secret: str, token: str) -> str:
+    """The key a refresh token is stored under; the token itself is never stored"""
+    return hmac.new(secret.encode(), token.encode(), hashlib.sha256).hexdigest()
+
+
+class RefreshTokenStore:
+    """Live refresh tokens, by digest, in memory and in an append-only log.
+
+    Each change is one JSON line: {"add": digest, "user": ..., "exp": ...}
+    or {"del": digest}. Startup replays the log and drops expired tokens.
+    Expired tokens are also swept from memory at most every sweep_interval
+    seconds, on the next write, and the log is rewritten with only the live
+    tokens once dead lines outnumber them.
+    """
+
+    def __init__(self, path: str, fsync: bool = True, sweep_interval: float = 60.0):
+        self.path = path
+        self.fsync = fsync
+        self.sweep_interval = sweep_interval
+        self._lock = threading.Lock()
+        self._tokens: Dict[str, Tuple[str, float]] = {}
+        self._lines = 0
+        self._swept = 0
+        self._compactions = 0
+        self._last_sweep = time.monotonic()
+        self._load()
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        now = time.time()
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                change = json.loads(line)
+                self._lines += 1
+                if "add" in change:
+                    self._tokens[change["add"]] = (change["user"], change["exp"])
+                else:
+                    self._tokens.pop(change["del"], None)
+        self._tokens = {digest: entry for digest, entry in self._tokens.items() if entry[1] > now}
+        # Start from a clean log, which also drops a line torn by a crash
+        self._compact()
+
+    def _compact(self) -> None:
+        data = b"".join(self._line({"add": digest, "user": username, "exp": expires_at})
+                        for digest, (username, expires_at) in self._tokens.items())
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._lines = len(self._tokens)
+        self._compactions += 1
+
+    @staticmethod
+    def _line(change: Dict[str, Any]) -> bytes:
+        return (json.dumps(change, separators=(",", ":")) + "\n").encode()
+
+    def _append(self, *changes: Dict[str, Any]) -> None:
+        data = b"".join(self._line(change) for change in changes)
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self._fd, view):]
+        if self.fsync:
+            os.fsync(self._fd)
+        self._lines += len(changes)
+        self._sweep()
+
+    def _sweep(self) -> None:
+        if time.monotonic() - self._last_sweep < self.sweep_interval:
+            return
+        self._last_sweep = time.monotonic()
+        now = time.time()
+        expired = [digest for digest, (_, expires_at) in self._tokens.items() if expires_at <= now]
+        for digest in expired:
+            del self._tokens[digest]
+        self._swept += len(expired)
+        if self._lines > 2 * len(self._tokens) + 1000:
+            self._compact()
+            os.close(self._fd)
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+
+    def add(self, digest: str, username: str, expires_at: float) -> None:
+        with self._lock:
+            self._tokens[digest] = (username, expires_at)
+            self._append({"add": digest, "user": username, "exp": expires_at})
+
+    def rotate(self, digest: str, new_digest: str, expires_at: float) -> Optional[str]:
+        with self._lock:
+            entry = self._tokens.get(digest)
+            if entry is None or entry[1] <= time.time():
+                return None
+            username = entry[0]
+            del self._tokens[digest]
+            self._tokens[new_digest] = (username, expires_at)
+            self._append({"del": digest}, {"add": new_digest, "user": username, "exp": expires_at})
+            return username
+
+    def revoke(self, digest: str) -> bool:
+        with self._lock:
+            if self._tokens.pop(digest, None) is None:
+                return False
+            self._append({"del": digest})
+            return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"live": len(self._tokens), "swept": self._swept, "compactions": self._compactions}
+
+    def close(self) -> None:
+        os.close(self._fd)
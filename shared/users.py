@@ -0,0 +1,120 @@
+import json
+import os
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+READ_SIZE = 1 << 16
+
+
+class UserStore:
+    """Append-only credential file with an in-memory username index.
+
+    Each user is one JSON line, {"username": ..., "password_hash": ...}.
+    The index maps a username to the position and length of its line, so a
+    login reads just that line with one pread and a registration appends
+    just the new one; neither touches the rest of the file. The index is
+    built by one scan at startup and holds no hashes.
+
+    A users.json from before this store is converted on first open and then
+    removed.
+    """
+
+    def __init__(self, path: str, legacy_path: Optional[str] = None, fsync: bool = True):
+        self.path = path
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._index: Dict[str, Tuple[int, int]] = {}
+        self._bytes_read = 0
+        self._bytes_written = 0
+        if not os.path.exists(path) and legacy_path is not None and os.path.exists(legacy_path):
+            self._convert(legacy_path)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o600)
+        self._end = self._build_index()
+
+    def _encode(self, username: str, password_hash: str) -> bytes:
+        return (json.dumps({"username": username, "password_hash": password_hash}, separators=(",", ":"))
+                + "\n").encode()
+
+    def _convert(self, legacy_path: str) -> None:
+        with open(legacy_path, "rb") as f:
+            users = json.load(f)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.writelines(self._encode(username, password_hash) for username, password_hash in users.items())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        os.remove(legacy_path)
+
+    def _build_index(self) -> int:
+        offset = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # Torn by a crash mid-append; the registration never returned
+                    os.truncate(self.path, offset)
+                    break
+                self._index[json.loads(line)["username"]] = (offset, len(line))
+                offset += len(line)
+        return offset
+
+    def get(self, username: str) -> Optional[str]:
+        with self._lock:
+            position = self._index.get(username)
+            self._bytes_read += position[1] if position else 0
+        if position is None:
+            return None
+        offset, length = position
+        return json.loads(os.pread(self._fd, length, offset))["password_hash"]
+
+    def add_many(self, users: List[Tuple[str, str]]) -> int:
+        """Append the users that do not exist yet with one write; returns how many were added"""
+        with self._lock:
+            lines = []
+            added = {}
+            offset = self._end
+            for username, password_hash in users:
+                if username in self._index or username in added:
+                    continue
+                line = self._encode(username, password_hash)
+                added[username] = (offset, len(line))
+                lines.append(line)
+                offset += len(line)
+            if not lines:
+                return 0
+            data = b"".join(lines)
+            view = memoryview(data)
+            while view:
+                view = view[os.write(self._fd, view):]
+            if self.fsync:
+                os.fsync(self._fd)
+            # Published only once written, so a lookup never reads past the end
+            self._index.update(added)
+            self._end = offset
+            self._bytes_written += len(data)
+            return len(added)
+
+    def add(self, username: str, password_hash: str) -> bool:
+        return self.add_many([(username, password_hash)]) == 1
+
+    def items(self) -> Iterator[Tuple[str, str]]:
+        """Yield (username, password_hash) in registration order; later additions may be missed"""
+        with self._lock:
+            end = self._end
+        offset = 0
+        partial = b""
+        while offset < end:
+            data = os.pread(self._fd, min(READ_SIZE, end - offset), offset)
+            offset += len(data)
+            lines = (partial + data).split(b"\n")
+            partial = lines.pop()
+            for line in lines:
+                user = json.loads(line)
+                yield user["username"], user["password_hash"]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"count": len(self._index), "bytes_read": self._bytes_read, "bytes_written": self._bytes_written}
+
+    def close(self) -> None:
+        os.close(self._fd)
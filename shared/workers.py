@@ -0,0 +1,99 @@
+"""Multi-process deployment shared by both servers.
+
+The parent process opens storage as usual. When the backend is not
+process_safe (the JSON files), share_storage() serves it to the workers over
+a Unix socket and connect_shared_storage(), called by each worker at import,
+returns a RemoteStorage for it; SQLite workers simply open the database
+themselves. Everything else (HTTP parsing, JWT, bcrypt) runs in the workers,
+so it scales with the number of processes.
+"""
+import multiprocessing
+import os
+import secrets
+import shutil
+import signal
+import socket
+import tempfile
+import time
+from multiprocessing.connection import wait
+from typing import Callable, List, Optional
+
+from shared.remote_storage import RemoteStorage, StorageServer
+from shared.storage import Storage
+
+STORAGE_ADDRESS_ENV = "BANK_STORAGE_ADDRESS"
+STORAGE_AUTHKEY_ENV = "BANK_STORAGE_AUTHKEY"
+# A worker that dies sooner than this is failing to start, not crashing; restarting it would loop
+MIN_WORKER_SECONDS = 5.0
+
+
+def connect_shared_storage() -> Optional[Storage]:
+    """In a worker process, the parent's shared storage; None everywhere else"""
+    address = os.environ.get(STORAGE_ADDRESS_ENV)
+    if not address:
+        return None
+    return RemoteStorage(address, bytes.fromhex(os.environ[STORAGE_AUTHKEY_ENV]))
+
+
+def share_storage(storage: Storage) -> StorageServer:
+    """Serve storage to worker processes started after this call.
+
+    The socket address and a random authkey are passed down through the
+    environment, which spawned and forked workers both inherit.
+    """
+    directory = tempfile.mkdtemp(prefix="bank-storage-")
+    server = StorageServer(storage, os.path.join(directory, "storage.sock"), secrets.token_bytes(32))
+    server.start()
+    os.environ[STORAGE_ADDRESS_ENV] = server.address
+    os.environ[STORAGE_AUTHKEY_ENV] = server.authkey.hex()
+    return server
+
+
+def remove_shared_storage(server: StorageServer) -> None:
+    server.close()
+    shutil.rmtree(os.path.dirname(server.address), ignore_errors=True)
+
+
+def run_workers(serve: Callable[[socket.socket], None], workers: int, host: str, port: int) -> None:
+    """Bind host:port once and run serve(sock) in that many spawned processes.
+
+    The workers accept on the shared listening socket, so the kernel spreads
+    connections across them. A worker that dies is replaced, unless it died
+    during startup; SIGINT or SIGTERM stops them all. serve must be
+    importable from the main module, which each spawned worker imports
+    afresh.
+    """
+    sock = socket.create_server((host, port), backlog=1024)
+    context = multiprocessing.get_context("spawn")
+    processes: List[multiprocessing.Process] = []
+    started: List[float] = []
+
+    def start(index: int) -> None:
+        process = context.Process(target=serve, args=(sock,), name=f"worker-{index}")
+        process.start()
+        processes[index:index + 1] = [process]
+        started[index:index + 1] = [time.monotonic()]
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        for index in range(workers):
+            start(index)
+        while True:
+            wait([process.sentinel for process in processes])
+            for index, process in enumerate(processes):
+                if process.is_alive():
+                    continue
+                if time.monotonic() - started[index] < MIN_WORKER_SECONDS:
+                    raise SystemExit(f"Worker exited with code {process.exitcode} during startup")
+                start(index)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+        sock.close()
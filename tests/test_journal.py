@@ -0,0 +1,71 @@
+import glob
+import os
+
+import pytest
+
+from shared.accounts import AccountStore
+
+
+def open_store(directory, **options) -> AccountStore:
+    return AccountStore(
+        os.path.join(directory, "accounts.json"),
+        os.path.join(directory, "accounts.journal"),
+        os.path.join(directory, "accounts.history"),
+        fsync=False,
+        **options
+    )
+
+
+def last_segment(directory) -> str:
+    return sorted(glob.glob(os.path.join(directory, "accounts.journal.*")))[-1]
+
+
+@pytest.mark.parametrize("torn", [
+    b'{"op":"deposit","account_number":"1000000001","amo',
+    # A whole record whose newline never reached the disk was never acknowledged either
+    b'{"op":"deposit","account_number":"1000000001","amount":5.0}',
+])
+def test_replay_drops_torn_final_record(tmp_path, torn):
+    store = open_store(tmp_path)
+    store.create("alice", "1000000001", 100.0)
+    store.deposit("alice", 25.0)
+    store.shutdown()
+
+    segment = last_segment(tmp_path)
+    intact_size = os.path.getsize(segment)
+    with open(segment, "ab") as f:
+        f.write(torn)
+
+    store = open_store(tmp_path)
+    assert store.replayed_records == 2
+    assert store.get("1000000001")["balance"] == 125.0
+    assert os.path.getsize(segment) == intact_size
+
+    # Appends after the cut must land on a clean line boundary
+    store.deposit("alice", 1.0)
+    store.shutdown()
+    store = open_store(tmp_path)
+    assert store.replayed_records == 3
+    assert store.get("1000000001")["balance"] == 126.0
+    store.shutdown()
+
+
+@pytest.mark.parametrize("snapshot_format,shards", [("json", 1), ("json", 4), ("binary", 1)])
+def test_snapshot_plus_journal_tail(tmp_path, snapshot_format, shards):
+    store = open_store(tmp_path, snapshot_format=snapshot_format, shards=shards)
+    store.create("alice", "1000000001", 100.0)
+    store.create("bob", "1000000002", 50.0)
+    store.transfer("alice", "1000000002", 30.0)
+    covered = store.snapshotter.snapshot()
+
+    store.withdraw("bob", 10.0)
+    store.create("carol", "1000000003", 7.5)
+    expected = {number: store.get(number) for number in ("1000000001", "1000000002", "1000000003")}
+    store.shutdown()
+
+    store = open_store(tmp_path, snapshot_format=snapshot_format, shards=shards)
+    assert store.replayed_records == 2
+    assert all(segment > covered for segment in store.journal.segments())
+    assert {number: store.get(number) for number in expected} == expected
+    assert store.find_active("carol")["balance"] == 7.5
+    store.shutdown()
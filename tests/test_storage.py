@@ -0,0 +1,169 @@
+import os
+import time
+
+import pytest
+
+from shared.accounts import BatchAborted, InsufficientFunds, InvalidAmount
+from shared.idempotency import IdempotencyKeyInUse, IdempotencyKeyReused
+from shared.remote_storage import RemoteStorage, StorageServer
+from shared.storage import open_storage
+
+
+def open_backend(backend, directory):
+    return open_storage(
+        backend,
+        users_file=os.path.join(directory, "users.json"),
+        accounts_file=os.path.join(directory, "accounts.json"),
+        journal_file=os.path.join(directory, "accounts.journal"),
+        history_file=os.path.join(directory, "accounts.history"),
+        sqlite_path=os.path.join(directory, "bank.db"),
+        fsync=False
+    )
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def backend(request):
+    return request.param
+
+
+@pytest.fixture
+def storage(backend, tmp_path):
+    storage = open_backend(backend, tmp_path)
+    yield storage
+    storage.close()
+
+
+def test_refresh_token_reuse_is_rejected(backend, tmp_path):
+    expires_at = time.time() + 60
+    storage = open_backend(backend, tmp_path)
+    try:
+        storage.add_refresh_token("first", "alice", expires_at)
+        assert storage.rotate_refresh_token("first", "second", expires_at) == "alice"
+        # The rotated token is used up: presenting it again issues nothing
+        assert storage.rotate_refresh_token("first", "stolen", expires_at) is None
+        assert storage.rotate_refresh_token("stolen", "third", expires_at) is None
+    finally:
+        storage.close()
+
+    # Reopened, so the JSON backend has to rebuild the same state from its file
+    storage = open_backend(backend, tmp_path)
+    try:
+        assert storage.rotate_refresh_token("first", "stolen", expires_at) is None
+        assert storage.rotate_refresh_token("second", "third", expires_at) == "alice"
+        assert storage.revoke_refresh_token("third")
+        assert storage.rotate_refresh_token("third", "fourth", expires_at) is None
+        assert not storage.revoke_refresh_token("third")
+
+        storage.add_refresh_token("expired", "alice", time.time() - 1)
+        assert storage.rotate_refresh_token("expired", "fifth", expires_at) is None
+    finally:
+        storage.close()
+
+
+def test_idempotent_replay_and_key_mismatch(storage):
+    calls = []
+
+    def deposit():
+        calls.append(None)
+        return 200, {"new_balance": 100.0 + len(calls)}
+
+    assert storage.run_idempotent("alice", "key", "deposit 1", deposit) == (200, {"new_balance": 101.0}, False)
+    assert storage.run_idempotent("alice", "key", "deposit 1", deposit) == (200, {"new_balance": 101.0}, True)
+    assert len(calls) == 1
+
+    with pytest.raises(IdempotencyKeyReused):
+        storage.run_idempotent("alice", "key", "deposit 2", deposit)
+    # Keys are scoped to the user who sent them
+    assert storage.run_idempotent("bob", "key", "deposit 2", deposit)[2] is False
+    assert len(calls) == 2
+
+
+def test_idempotent_in_flight_and_failures(storage):
+    assert storage.begin_idempotent("alice", "key", "deposit 1") is None
+    with pytest.raises(IdempotencyKeyInUse):
+        storage.begin_idempotent("alice", "key", "deposit 1")
+    with pytest.raises(IdempotencyKeyReused):
+        storage.begin_idempotent("alice", "key", "deposit 2")
+    storage.finish_idempotent("alice", "key", 400, {"detail": "Insufficient funds"})
+    assert storage.begin_idempotent("alice", "key", "deposit 1") == (400, {"detail": "Insufficient funds"})
+
+    # Server errors and exceptions release the key so the request can be retried
+    assert storage.run_idempotent("alice", "busy", "deposit 1", lambda: (503, {"detail": "busy"}))[2] is False
+    assert storage.run_idempotent("alice", "busy", "deposit 1", lambda: (200, {}))[2] is False
+
+    def crash():
+        raise RuntimeError("storage went away")
+
+    with pytest.raises(RuntimeError):
+        storage.run_idempotent("alice", "crash", "deposit 1", crash)
+    assert storage.run_idempotent("alice", "crash", "deposit 1", lambda: (200, {}))[2] is False
+
+
+def test_idempotency_keys_are_shared_between_workers(tmp_path):
+    storage = open_backend("json", tmp_path)
+    server = StorageServer(storage, os.path.join(tmp_path, "storage.sock"), b"secret")
+    server.start()
+    first, second = RemoteStorage(server.address, b"secret"), RemoteStorage(server.address, b"secret")
+    try:
+        assert first.run_idempotent("alice", "key", "deposit 1", lambda: (200, {"new_balance": 1.0}))[2] is False
+        assert second.run_idempotent("alice", "key", "deposit 1", lambda: (200, {"new_balance": 2.0})) == (
+            200, {"new_balance": 1.0}, True)
+        with pytest.raises(IdempotencyKeyReused):
+            second.begin_idempotent("alice", "key", "deposit 2")
+    finally:
+        first.close()
+        second.close()
+        server.close()
+        storage.close()
+
+
+BATCH = [
+    {"type": "deposit", "amount": 5.0},
+    {"type": "transfer", "to_account_number": "1000000002", "amount": 20.0},
+    {"type": "withdraw", "amount": 1000.0},
+    {"type": "deposit", "amount": 0.001},
+]
+
+
+def test_batch_aborts_as_a_whole(storage):
+    storage.create_account("alice", "1000000001", 100.0)
+    storage.create_account("bob", "1000000002", 0.0)
+
+    with pytest.raises(BatchAborted) as aborted:
+        storage.apply_batch("alice", BATCH)
+    assert aborted.value.index == 2
+    assert isinstance(aborted.value.error, InsufficientFunds)
+    assert storage.get_account("1000000001")["balance"] == 100.0
+    assert storage.get_account("1000000002")["balance"] == 0.0
+    assert [entry["type"] for entry in storage.list_transactions("alice")] == ["open"]
+
+
+def test_batch_continue_on_error_skips_failures(storage):
+    storage.create_account("alice", "1000000001", 100.0)
+    storage.create_account("bob", "1000000002", 0.0)
+
+    outcomes = storage.apply_batch("alice", BATCH, continue_on_error=True)
+    assert [outcome["balance"] for outcome in outcomes[:2]] == [105.0, 85.0]
+    assert isinstance(outcomes[2], InsufficientFunds)
+    assert isinstance(outcomes[3], InvalidAmount)
+    assert storage.get_account("1000000001")["balance"] == 85.0
+    assert storage.get_account("1000000002")["balance"] == 20.0
+    assert [entry["type"] for entry in storage.list_transactions("alice")] == ["open", "deposit", "transfer_out"]
+
+
+def test_opening_and_imported_balances_are_rounded(storage):
+    # Same checks on each backend, so a balance kept unrounded on one of them shows up here
+    assert storage.create_account("alice", "1000000001", 0.005)["balance"] == 0.0
+    storage.create_account("bob", "1000000002", 20.0)
+    storage.transfer("bob", "1000000001", 10.0)
+    assert storage.get_account("1000000001")["balance"] == 10.0
+    assert [entry["balance"] for entry in storage.list_transactions("alice")] == [0.0, 10.0]
+
+    for balance in (-1.0, float("nan"), float("inf")):
+        with pytest.raises(InvalidAmount):
+            storage.create_account("carol", "1000000003", balance)
+    assert storage.find_account("carol") is None
+
+    assert storage.import_accounts([{"account_number": "1000000004", "username": "dave", "balance": 1.006,
+                                     "is_active": True, "created_at": "2024-01-31T12:00:00"}]) == ["1000000004"]
+    assert storage.get_account("1000000004")["balance"] == 1.01